@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the admission control of OpenSearch searches.
+
+Each client, identified by its address and clientId parameter, has a token
+bucket that refills at ckanext.opensearch.client_rate requests per second and
+holds up to ckanext.opensearch.client_burst requests. The clientId is chosen
+by the client, so each address also has a bucket and a concurrency cap of its
+own, ckanext.opensearch.address_clients times those of a client, which all of
+its clientIds share. The number of searches that run at the same time is
+capped per client and for the whole process. Searches over a limit are
+rejected before anything is validated or searched: 429 if the client or its
+address exceeds its limits, 503 if the process is busy, both with a
+Retry-After header.
+
+Behind a reverse proxy, the address is read from X-Forwarded-For, but only if
+the request comes from one of ckanext.opensearch.trusted_proxies.
+
+The limits and counters belong to the process, so with several CKAN workers
+each of them enforces the limits separately.
+"""
+
+from collections import OrderedDict
+import math
+import threading
+from timeit import default_timer
+
+from six.moves.urllib.parse import parse_qs
+from webob import Response
+
+from .config import (
+    get_address_clients,
+    get_admission_max_clients,
+    get_client_burst,
+    get_client_max_concurrent,
+    get_client_rate,
+    get_max_concurrent,
+    get_trusted_proxies,
+)
+
+REASONS = {429: "Too Many Requests", 503: "Service Unavailable"}
+
+# The length that clientIds are cut to in the keys of clients.
+MAX_CLIENT_ID_LENGTH = 100
+
+_admission = None
+_admission_lock = threading.Lock()
+
+
+class AdmissionError(Exception):
+    """Raised when a search is over a limit."""
+
+    def __init__(self, status, retry_after, message):
+        super(AdmissionError, self).__init__(message)
+        self.status = status
+        self.retry_after = max(int(math.ceil(retry_after)), 1)
+        self.message = message
+
+    def make_response(self):
+        """Return the plain text response that rejects the search."""
+        response = Response(
+            body=self.message.encode("utf-8"),
+            status="{} {}".format(self.status, REASONS[self.status]),
+            content_type="text/plain",
+        )
+        response.charset = "UTF-8"
+        response.headers["Retry-After"] = str(self.retry_after)
+
+        return response
+
+
+class ClientState(object):
+    """The token bucket, running searches and counters of a client."""
+
+    def __init__(self, tokens, now):
+        self.tokens = tokens
+        self.updated = now
+        self.active = 0
+        self.admitted = 0
+        self.rate_limited = 0
+        self.concurrency_limited = 0
+        self.busy = 0
+
+    def as_dict(self):
+        return OrderedDict(
+            [
+                ("active", self.active),
+                ("admitted", self.admitted),
+                ("rate_limited", self.rate_limited),
+                ("concurrency_limited", self.concurrency_limited),
+                ("busy", self.busy),
+                ("tokens", round(self.tokens, 2)),
+            ]
+        )
+
+
+class Admission(object):
+    """The admission control of a process."""
+
+    def __init__(
+        self,
+        rate,
+        burst,
+        client_max_concurrent,
+        max_concurrent,
+        max_clients,
+        address_clients=1,
+    ):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.client_max_concurrent = client_max_concurrent
+        self.max_concurrent = max_concurrent
+        self.max_clients = max_clients
+        self.address_clients = max(address_clients, 1)
+        self.active = 0
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return (
+            self.rate > 0 or self.client_max_concurrent > 0 or self.max_concurrent > 0
+        )
+
+    def admit(self, client, searches=1, address=None):
+        """
+        Admit searches of a client, e.g., the queries of a batch, which must
+        be released once their response has been written. If the client's
+        address is given, the searches are also charged to the address, whose
+        limits are address_clients times those of a client.
+
+        Raises an AdmissionError if the searches are over a limit.
+        """
+        now = default_timer()
+
+        with self._lock:
+            state = self._get_state(client, 1, now)
+            charged = [(state, 1)]
+            if address is not None:
+                address_state = self._get_state(address, self.address_clients, now)
+                charged.append((address_state, self.address_clients))
+            self._forget_idle((client, address))
+
+            if self.max_concurrent and self.active + searches > self.max_concurrent:
+                state.busy += 1
+                raise AdmissionError(503, 1, "Too many searches are running.")
+
+            for charged_state, scale in charged:
+                self._check_limits(charged_state, searches, now, scale)
+
+            for charged_state, _ in charged:
+                if self.rate > 0:
+                    charged_state.tokens -= searches
+                charged_state.active += searches
+                charged_state.admitted += searches
+            self.active += searches
+
+    def _check_limits(self, state, searches, now, scale):
+        """
+        Raise an AdmissionError if searches are over the limits of a client or
+        address, which are scale times those of a client.
+        """
+        client_max = self.client_max_concurrent * scale
+        if client_max and state.active + searches > client_max:
+            state.concurrency_limited += 1
+            raise AdmissionError(
+                429,
+                1,
+                "No more than {} concurrent searches are allowed.".format(client_max),
+            )
+
+        if self.rate > 0:
+            rate = self.rate * scale
+            burst = self.burst * scale
+            elapsed = now - state.updated
+            state.tokens = min(burst, state.tokens + elapsed * rate)
+            state.updated = now
+            if state.tokens < searches:
+                state.rate_limited += 1
+                raise AdmissionError(
+                    429,
+                    (min(searches, burst) - state.tokens) / rate,
+                    "No more than {} searches per second and {} at once are "
+                    "allowed.".format(rate, burst),
+                )
+
+    def release(self, client, searches=1, address=None):
+        """Release admitted searches of a client and its address."""
+        with self._lock:
+            self.active -= searches
+            for key in (client, address):
+                state = self._clients.get(key)
+                if key is not None and state is not None:
+                    state.active -= searches
+
+    def _get_state(self, client, scale, now):
+        """
+        Return the state of a client or address whose limits are scale times
+        those of a client, marking it as the most recently seen.
+        """
+        state = self._clients.pop(client, None)
+        if state is None:
+            state = ClientState(self.burst * scale, now)
+        self._clients[client] = state
+
+        return state
+
+    def _forget_idle(self, keep):
+        """
+        Forget the clients that haven't been seen for the longest time and
+        don't have a search running while there are too many, except the
+        ones in keep.
+        """
+        if len(self._clients) > self.max_clients:
+            for idle in list(self._clients):
+                if len(self._clients) <= self.max_clients:
+                    break
+                if self._clients[idle].active == 0 and idle not in keep:
+                    del self._clients[idle]
+
+    def get_counters(self):
+        """Return the counters of the process and of each client."""
+        with self._lock:
+            clients = OrderedDict(
+                (client, state.as_dict()) for client, state in self._clients.items()
+            )
+
+        return OrderedDict(
+            [
+                ("active", self.active),
+                ("max_concurrent", self.max_concurrent),
+                ("client_rate", self.rate),
+                ("client_burst", self.burst),
+                ("client_max_concurrent", self.client_max_concurrent),
+                ("address_clients", self.address_clients),
+                ("clients", clients),
+            ]
+        )
+
+
+class ReleasingIterable(object):
+    """
+    The body of an admitted search's response, which releases the search when
+    the server closes it, i.e., once a streamed feed has been written.
+    """
+
+    def __init__(self, app_iter, release):
+        self.app_iter = app_iter
+        self.release = release
+
+    def __iter__(self):
+        return iter(self.app_iter)
+
+    def close(self):
+        try:
+            close = getattr(self.app_iter, "close", None)
+            if close is not None:
+                close()
+        finally:
+            self.release()
+
+
+def get_client_address(environ):
+    """
+    Return the address of a request's client.
+
+    If the request comes from a trusted proxy, the address is the last one in
+    X-Forwarded-For that isn't a trusted proxy itself. Other clients could
+    send any X-Forwarded-For, so it's ignored.
+    """
+    address = environ.get("REMOTE_ADDR", "unknown")
+    trusted_proxies = set(get_trusted_proxies())
+    forwarded = [
+        forwarded_address.strip()
+        for forwarded_address in environ.get("HTTP_X_FORWARDED_FOR", "").split(",")
+        if forwarded_address.strip()
+    ]
+    while address in trusted_proxies and forwarded:
+        address = forwarded.pop()
+
+    return address
+
+
+def get_client_keys(environ):
+    """
+    Return the keys of a request's client, its address and clientId, and of
+    its address, which all the clientIds of the address share.
+    """
+    address = get_client_address(environ)
+    client_id = parse_qs(environ.get("QUERY_STRING", "")).get("clientId", [""])[0]
+
+    return (
+        "client:{} {}".format(address, client_id[:MAX_CLIENT_ID_LENGTH]).strip(),
+        "address:{}".format(address),
+    )
+
+
+def get_admission():
+    """Return the admission control of this process, creating it on first use."""
+    global _admission
+
+    if _admission is None:
+        with _admission_lock:
+            if _admission is None:
+                _admission = Admission(
+                    get_client_rate(),
+                    get_client_burst(),
+                    get_client_max_concurrent(),
+                    get_max_concurrent(),
+                    get_admission_max_clients(),
+                    get_address_clients(),
+                )
+
+    return _admission
+
+
+def reset_admission():
+    """
+    Discard the admission control of this process, so it's created again
+    with the current settings when it's next used.
+    """
+    global _admission
+
+    with _admission_lock:
+        _admission = None
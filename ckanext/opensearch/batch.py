@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+Contains functions for batch searches, which execute several OpenSearch
+queries in one request.
+
+All queries are validated before any of them is executed. The searches then
+run concurrently on a pool of threads that is shared by all batch searches of
+the process, so a batch takes about as long as its slowest query. The results
+are rendered in the request's thread and returned as a JSON object with a
+GeoJSON feature collection (or an error) per query.
+"""
+
+import json
+import logging
+from multiprocessing.pool import ThreadPool
+import threading
+
+import six
+from six.moves.urllib.parse import urlencode
+from webob.exc import HTTPException
+from webob.multidict import MultiDict
+
+from ckan.lib.base import abort
+from ckan.lib.search import SearchError
+import ckan.model as model
+
+from .config import get_batch_max_queries, get_batch_workers, settings
+from .encoders import encode, stream_geojson
+from .search import make_search_query, process_query
+
+log = logging.getLogger(__name__)
+
+CONTENT_TYPE = "application/json"
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class BatchQuery(object):
+    """A query of a batch search."""
+
+    def __init__(self, search_type, params):
+        self.search_type = search_type
+        self.params = params
+        self.param_dict = None
+        self.request_url = make_request_url(search_type, params)
+
+
+def get_pool():
+    """Return the thread pool of this process, creating it on first use."""
+    global _pool
+
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPool(max(get_batch_workers(), 1))
+
+    return _pool
+
+
+def parse_batch(body):
+    """
+    Return the queries of a batch request body: a JSON list of parameter
+    sets, or an object with the list as its "queries" member.
+
+    Each parameter set is an object of OpenSearch parameters, whose values are
+    strings or lists of strings for repeated parameters. A "searchType" of
+    "collection" makes it a collection search instead of a dataset search.
+    """
+    try:
+        batch = json.loads(body)
+    except ValueError:
+        abort(400, "The batch must be a JSON document.")
+
+    if isinstance(batch, dict):
+        batch = batch.get("queries")
+    if not isinstance(batch, list) or not batch:
+        abort(400, "The batch must contain a list of queries.")
+
+    max_queries = get_batch_max_queries()
+    if len(batch) > max_queries:
+        abort(400, "A batch can't contain more than {} queries.".format(max_queries))
+
+    queries = []
+    for number, query in enumerate(batch, 1):
+        if not isinstance(query, dict):
+            abort(400, "Query {} must be an object of parameters.".format(number))
+
+        query = dict(query)
+        search_type = query.pop("searchType", "dataset")
+        if search_type not in ("dataset", "collection"):
+            abort(400, "Invalid searchType ({})".format(search_type))
+
+        params = MultiDict()
+        for name, values in query.items():
+            if not isinstance(values, list):
+                values = [values]
+            for value in values:
+                params.add(name, six.text_type(value))
+
+        queries.append(BatchQuery(search_type, params))
+
+    return queries
+
+
+def make_request_url(search_type, params):
+    """Return the URL of a query's endpoint, on which the feed's links are based."""
+    if search_type == "collection":
+        endpoint = "collection_search.geojson"
+    else:
+        endpoint = "search.geojson"
+
+    query_string = urlencode(
+        [(name, value.encode("utf-8")) for name, value in params.items()]
+    )
+
+    return "{}/opensearch/{}?{}".format(settings.site_url, endpoint, query_string)
+
+
+def validate_batch(queries):
+    """Validate every query, aborting with the number of the first invalid one."""
+    for number, query in enumerate(queries, 1):
+        try:
+            query.param_dict = make_search_query(query.search_type, query.params)
+        except HTTPException as e:
+            abort(400, "Query {}: {}".format(number, getattr(e, "detail", e)))
+
+
+def run_batch(queries, context):
+    """
+    Execute the validated queries concurrently and return a (results_dict,
+    error) tuple for each of them.
+    """
+    pool = get_pool()
+    pending = [
+        pool.apply_async(run_query, (query, dict(context))) for query in queries
+    ]
+
+    return [result.get() for result in pending]
+
+
+def run_query(query, context):
+    """
+    Execute a query in a worker thread.
+
+    The results are read completely, so nothing is fetched after the thread's
+    database session has been removed.
+    """
+    try:
+        results_dict = process_query(
+            query.search_type, query.param_dict, query.request_url, context
+        )
+        results_dict["results"] = list(results_dict["results"])
+        return results_dict, None
+    except SearchError as e:
+        return None, str(e)
+    except Exception:
+        log.exception("A query of a batch search failed.")
+        return None, "The search failed."
+    finally:
+        model.Session.remove()
+
+
+def make_batch_response(queries, results):
+    """Return the JSON body with the feature collection or error of each query."""
+    items = []
+
+    for query, (results_dict, error) in zip(queries, results):
+        if error is not None:
+            items.append(encode({"error": error}).encode("utf-8"))
+        else:
+            items.append(b"".join(stream_geojson(results_dict, query.search_type)))
+
+    return b'{"results":[' + b",".join(items) + b"]}"
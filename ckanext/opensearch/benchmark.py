@@ -0,0 +1,451 @@
+# -*- coding: utf-8 -*-
+"""
+Contains a benchmark of the OpenSearch request pipeline.
+
+The benchmark sends dataset, collection and description document requests to
+the CKAN application, but package_search is replaced with a stub that returns
+synthetic Sentinel-like datasets, so no Solr index is needed. The time spent in
+each stage of the pipeline and the peak memory of each request are recorded.
+"""
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+import json
+import math
+import platform
+from timeit import default_timer
+import uuid
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+import ckan.logic as logic
+from ckan.common import config
+from webob import Request
+
+from ckanext.opensearch import caching, description_document, fragments, search
+from ckanext.opensearch.config import get_registry
+
+
+# The functions that are timed, by module.
+SEARCH_STAGES = [
+    "make_param_dict",
+    "validate_params",
+    "translate_os_query",
+    "search",
+    "process_query",
+]
+DESCRIPTION_DOCUMENT_STAGES = ["make_description_document"]
+
+
+def make_polygon(vertices, center_x=10.0, center_y=45.0, radius=1.0):
+    """Return a GeoJSON polygon with the given number of vertices."""
+    coordinates = []
+    for i in range(vertices):
+        angle = 2 * math.pi * i / vertices
+        coordinates.append(
+            [center_x + radius * math.cos(angle), center_y + radius * math.sin(angle)]
+        )
+    coordinates.append(coordinates[0])
+
+    return json.dumps({"type": "Polygon", "coordinates": [coordinates]})
+
+
+def make_package(index, collection_id, extras_count, resources_count, vertices):
+    """Return a synthetic dataset like the ones returned by package_search."""
+    name = "s1a_iw_grdh_1sdv_20170226t153347_{:06d}".format(index)
+    extras = [
+        {"key": "collection_id", "value": collection_id},
+        {"key": "identifier", "value": name.upper()},
+        {"key": "StartTime", "value": "2017-02-26T15:33:47.000Z"},
+        {"key": "StopTime", "value": "2017-02-26T15:34:21.000Z"},
+        {"key": "Swath", "value": "IW"},
+        {"key": "OrbitDirection", "value": "ASCENDING"},
+        {"key": "TransmitterReceiverPolarisation", "value": "VV VH"},
+        {"key": "CloudCoverage", "value": "0.3715"},
+        {"key": "spatial", "value": make_polygon(vertices)},
+    ]
+    for i in range(extras_count):
+        extras.append({"key": "extra_{}".format(i), "value": "value {}".format(i)})
+
+    resources = []
+    for i in range(resources_count):
+        resources.append(
+            {
+                "name": ["Product Download", "Metadata Download", "Thumbnail"][i % 3],
+                "url": "https://example.com/{}/{}".format(name, i),
+                "mimetype": "application/zip",
+                "size": 1024 * (i + 1),
+            }
+        )
+
+    return {
+        "id": str(uuid.UUID(int=index)),
+        "name": name,
+        "title": name.upper(),
+        "notes": "Synthetic Sentinel-1 product {}.".format(index),
+        "metadata_created": "2018-01-16T10:00:00.000000",
+        "metadata_modified": "2018-01-16T10:00:00.000000",
+        "organization": {"name": "esa", "title": "European Space Agency"},
+        "tags": [{"name": "Sentinel-1"}, {"name": "GRD"}],
+        "extras": extras,
+        "resources": resources,
+    }
+
+
+class StubPackageSearch(object):
+    """A replacement for package_search that returns synthetic datasets."""
+
+    def __init__(self, extras_count, resources_count, vertices, total=100000):
+        self.extras_count = extras_count
+        self.resources_count = resources_count
+        self.vertices = vertices
+        self.total = total
+        self.collection_ids = list(get_registry().collections)
+
+    def __call__(self, context, data_dict):
+        rows = int(data_dict.get("rows", 20))
+        start = int(data_dict.get("start", 0))
+        collection_id = self.collection_ids[0] if self.collection_ids else "dataset"
+        results = [
+            make_package(
+                start + i,
+                collection_id,
+                self.extras_count,
+                self.resources_count,
+                self.vertices,
+            )
+            for i in range(min(rows, max(self.total - start, 0)))
+        ]
+        facets = {
+            "collection_id": {
+                _id: self.total // (i + 1) for i, _id in enumerate(self.collection_ids)
+            }
+        }
+
+        return {"count": self.total, "results": results, "facets": facets}
+
+
+class StageTimer(object):
+    """Records the duration of each call of the wrapped functions."""
+
+    def __init__(self):
+        self.durations = OrderedDict()
+
+    def record(self, stage, duration):
+        self.durations.setdefault(stage, []).append(duration)
+
+    def wrap(self, stage, function):
+        """Return a version of the function whose calls are timed."""
+
+        def timed(*args, **kwargs):
+            start = default_timer()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.record(stage, default_timer() - start)
+
+        return timed
+
+    def wrap_iterator(self, stage, function):
+        """
+        Return a version of a function returning an iterator whose iteration is
+        timed as well, e.g. a streamed feed, which is rendered while it's read.
+        """
+
+        def timed(*args, **kwargs):
+            start = default_timer()
+            iterator = iter(function(*args, **kwargs))
+
+            return self.iter_timed(stage, iterator, default_timer() - start)
+
+        return timed
+
+    def iter_timed(self, stage, iterator, elapsed):
+        """
+        Yield the chunks of an iterator and record the time spent producing
+        them, without the time the consumer spends on each chunk.
+        """
+        try:
+            while True:
+                start = default_timer()
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed += default_timer() - start
+                yield chunk
+        finally:
+            self.record(stage, elapsed)
+
+
+@contextmanager
+def patched(target, name, replacement):
+    """Temporarily replace an attribute of a module or object."""
+    original = getattr(target, name)
+    setattr(target, name, replacement)
+    try:
+        yield
+    finally:
+        setattr(target, name, original)
+
+
+@contextmanager
+def benchmark_environment(timer, stub):
+    """
+    Route package_search to the stub, time the pipeline stages and disable the
+    caches and the direct Solr engine for the duration of the benchmark.
+
+    The caches are created with the configured sizes when they're first used,
+    so they're replaced with new ones that are created with the overrides.
+    """
+    get_action = logic.get_action
+
+    def get_stub_action(name):
+        if name == "package_search":
+            return timer.wrap("package_search (stub)", stub)
+        return get_action(name)
+
+    overrides = {
+        "ckanext.opensearch.search_engine": "package_search",
+        "ckanext.opensearch.result_cache_size": "0",
+        "ckanext.opensearch.entry_cache_size": "0",
+        "ckanext.opensearch.count_cache_ttl": "0",
+    }
+    previous = dict((key, config.get(key)) for key in overrides)
+    config.update(overrides)
+
+    patches = [
+        patched(logic, "get_action", get_stub_action),
+        patched(caching, "_result_cache", None),
+        patched(caching, "_count_cache", None),
+        patched(fragments, "_fragments", OrderedDict()),
+    ]
+    for stage in SEARCH_STAGES:
+        function = getattr(search, stage)
+        patches.append(patched(search, stage, timer.wrap(stage, function)))
+    patches.append(
+        patched(
+            search,
+            "make_atom_feed",
+            timer.wrap_iterator("make_atom_feed", search.make_atom_feed),
+        )
+    )
+    for stage in DESCRIPTION_DOCUMENT_STAGES:
+        function = timer.wrap(stage, getattr(description_document, stage))
+        patches.append(patched(description_document, stage, function))
+
+    try:
+        for patch in patches:
+            patch.__enter__()
+        yield
+    finally:
+        for patch in reversed(patches):
+            patch.__exit__(None, None, None)
+        for key, value in previous.items():
+            if value is None:
+                config.pop(key, None)
+            else:
+                config[key] = value
+
+
+def measure_request(app, url, reset=None):
+    """
+    Send a request to the WSGI application and return its duration, the size
+    of the response and the peak memory allocated while handling it (None
+    without tracemalloc).
+
+    The response is read like a server would send it: each chunk is counted
+    and discarded, so a streamed response is never held in memory at once.
+    """
+    if reset is not None:
+        reset()
+
+    if tracemalloc is not None:
+        tracemalloc.start()
+    start = default_timer()
+    status, headers, app_iter = Request.blank(url).call_application(app)
+    size = 0
+    try:
+        for chunk in app_iter:
+            size += len(chunk)
+    finally:
+        if hasattr(app_iter, "close"):
+            app_iter.close()
+    duration = default_timer() - start
+    peak = None
+    if tracemalloc is not None:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    if not status.startswith("200"):
+        raise RuntimeError("{} returned {}".format(url, status))
+
+    return duration, size, peak
+
+
+def summarize(durations):
+    """Return summary statistics of a list of durations in milliseconds."""
+    durations = sorted(duration * 1000.0 for duration in durations)
+    count = len(durations)
+    middle = count // 2
+    if count % 2:
+        median = durations[middle]
+    else:
+        median = (durations[middle - 1] + durations[middle]) / 2.0
+
+    return OrderedDict(
+        [
+            ("count", count),
+            ("min", durations[0]),
+            ("median", median),
+            ("mean", sum(durations) / count),
+            ("max", durations[-1]),
+        ]
+    )
+
+
+def reset_description_documents():
+    """Discard the pre-rendered description documents, so they're rendered again."""
+    description_document._documents = (None, {})
+
+
+def make_scenarios(rows):
+    """Return the URLs of the benchmarked requests."""
+    collection_ids = list(get_registry().collections)
+    scenarios = OrderedDict()
+    scenarios["dataset"] = ("/opensearch/search.atom?rows={}".format(rows), None)
+    if collection_ids:
+        scenarios["collection_product"] = (
+            "/opensearch/search.atom?productType={}&rows={}".format(
+                collection_ids[0], rows
+            ),
+            None,
+        )
+        scenarios["collection"] = (
+            "/opensearch/collection_search.atom?rows={}".format(rows),
+            None,
+        )
+    scenarios["osdd"] = (
+        "/opensearch/description.xml?osdd=dataset",
+        reset_description_documents,
+    )
+    scenarios["osdd_cached"] = ("/opensearch/description.xml?osdd=dataset", None)
+
+    return scenarios
+
+
+def run_benchmark(
+    app, rows=20, extras=10, resources=3, vertices=5, iterations=20, warmup=2
+):
+    """
+    Run every scenario and return the results as a dict that can be saved as
+    JSON.
+    """
+    stub = StubPackageSearch(extras, resources, vertices)
+    results = OrderedDict()
+    results["meta"] = OrderedDict(
+        [
+            ("timestamp", datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")),
+            ("python", platform.python_version()),
+            ("rows", rows),
+            ("extras", extras),
+            ("resources", resources),
+            ("vertices", vertices),
+            ("iterations", iterations),
+            ("tracemalloc", tracemalloc is not None),
+        ]
+    )
+    results["scenarios"] = OrderedDict()
+
+    for name, (url, reset) in make_scenarios(rows).items():
+        timer = StageTimer()
+        with benchmark_environment(timer, stub):
+            for _ in range(warmup):
+                measure_request(app, url, reset)
+            timer.durations.clear()
+
+            durations = []
+            peaks = []
+            size = 0
+            for _ in range(iterations):
+                duration, size, peak = measure_request(app, url, reset)
+                durations.append(duration)
+                peaks.append(peak)
+
+        scenario = OrderedDict()
+        scenario["url"] = url
+        scenario["response_bytes"] = size
+        scenario["peak_memory_bytes"] = None if None in peaks else max(peaks)
+        scenario["request"] = summarize(durations)
+        scenario["stages"] = OrderedDict(
+            (stage, summarize(stage_durations))
+            for stage, stage_durations in timer.durations.items()
+        )
+        results["scenarios"][name] = scenario
+
+    return results
+
+
+def compare_to_baseline(results, baseline, threshold=0.2):
+    """
+    Return a list of regressions: scenario requests or stages whose median
+    duration grew by more than the threshold (a fraction) compared to the
+    baseline, and scenarios whose peak memory grew by more than the threshold.
+    """
+    regressions = []
+
+    for name, scenario in results["scenarios"].items():
+        baseline_scenario = baseline.get("scenarios", {}).get(name)
+        if not baseline_scenario:
+            continue
+
+        timings = [("request", scenario["request"], baseline_scenario["request"])]
+        for stage, summary in scenario["stages"].items():
+            if stage in baseline_scenario.get("stages", {}):
+                timings.append((stage, summary, baseline_scenario["stages"][stage]))
+
+        for stage, summary, baseline_summary in timings:
+            limit = baseline_summary["median"] * (1 + threshold)
+            if summary["median"] > limit:
+                regressions.append(
+                    "{} {}: median {:.3f} ms > {:.3f} ms".format(
+                        name, stage, summary["median"], baseline_summary["median"]
+                    )
+                )
+
+        peak = scenario.get("peak_memory_bytes")
+        baseline_peak = baseline_scenario.get("peak_memory_bytes")
+        if peak and baseline_peak and peak > baseline_peak * (1 + threshold):
+            regressions.append(
+                "{} peak memory: {} bytes > {} bytes".format(name, peak, baseline_peak)
+            )
+
+    return regressions
+
+
+def format_results(results):
+    """Return a readable table of the results."""
+    lines = []
+    for name, scenario in results["scenarios"].items():
+        peak = scenario["peak_memory_bytes"]
+        lines.append(
+            "{} ({} bytes, peak memory {})".format(
+                name,
+                scenario["response_bytes"],
+                "n/a" if peak is None else "{} bytes".format(peak),
+            )
+        )
+        rows = [("request", scenario["request"])] + list(scenario["stages"].items())
+        for stage, summary in rows:
+            lines.append(
+                "    {:<24} median {:>9.3f} ms  mean {:>9.3f} ms  max {:>9.3f} ms".format(  # noqa: E501
+                    stage, summary["median"], summary["mean"], summary["max"]
+                )
+            )
+
+    return "\n".join(lines)
@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+"""Contains helpers for caching OpenSearch responses."""
+
+from calendar import timegm
+from collections import OrderedDict
+from email.utils import mktime_tz, parsedate_tz
+import hashlib
+import logging
+import threading
+import time
+
+try:
+    import redis
+except ImportError:
+    redis = None
+from sqlalchemy import event
+from sqlalchemy.orm.attributes import get_history
+
+import ckan.model as model
+
+from .config import (
+    get_count_cache_ttl,
+    get_registry,
+    get_result_cache_redis_url,
+    get_result_cache_size,
+    get_result_cache_ttl,
+)
+
+log = logging.getLogger(__name__)
+
+# The key of the session info with the collections to invalidate on commit.
+PENDING_INVALIDATIONS = "ckanext.opensearch.pending_invalidations"
+
+
+def make_etag(body):
+    """Return a strong ETag for a response body."""
+    return '"{}"'.format(hashlib.sha1(body).hexdigest())
+
+
+def etag_matches(if_none_match, etag):
+    """
+    Return True if the value of an If-None-Match header matches the ETag.
+
+    If-None-Match uses the weak comparison function, so weak (W/"...") and
+    strong validators with the same value match.
+    """
+    if not if_none_match:
+        return False
+
+    if etag.startswith("W/"):
+        etag = etag[2:]
+
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+
+    return False
+
+
+def make_feed_etag(*parts):
+    """
+    Return a weak ETag for a search feed that depends on the given parts.
+
+    The feeds include the time they were generated, so they're never
+    byte-for-byte identical and only a weak validator is appropriate.
+    """
+    digest = hashlib.sha1(
+        "\n".join(u"{}".format(part) for part in parts).encode("utf-8")
+    ).hexdigest()
+
+    return 'W/"{}"'.format(digest)
+
+
+def not_modified_since(if_modified_since, last_modified):
+    """
+    Return True if the value of an If-Modified-Since header is no earlier than
+    the last modification, a naive UTC datetime. HTTP dates have a resolution
+    of one second.
+    """
+    if not if_modified_since or last_modified is None:
+        return False
+
+    parsed = parsedate_tz(if_modified_since)
+    if parsed is None:
+        return False
+
+    return mktime_tz(parsed) >= timegm(last_modified.timetuple())
+
+
+class Generations(object):
+    """
+    Generation counters for the collections whose results are cached.
+
+    A cached result is only valid as long as the counters it was stored with
+    are unchanged. Every dataset change increments the counter of the
+    dataset's collection and the counter shared by all searches that aren't
+    restricted to a collection. If the collection is unknown, the counter
+    shared by all collections is incremented as well.
+
+    With a Redis URL the counters are shared, so a dataset changed by a
+    harvester process also invalidates the results cached by the web
+    processes. Otherwise they only exist in memory.
+    """
+
+    ALL = "__all__"
+    ANY = "__any__"
+    PREFIX = "ckanext-opensearch:generation:"
+
+    def __init__(self, redis_url=None):
+        self._local = {}
+        self._lock = threading.Lock()
+        self._redis = None
+        if redis_url:
+            if redis is None:
+                log.warning("Redis isn't installed. Cache invalidation is local.")
+            else:
+                self._redis = redis.StrictRedis.from_url(redis_url)
+
+    def get(self, collection_id):
+        """Return the counters that cached results for the collection depend on."""
+        if collection_id is None:
+            names = [self.ALL]
+        else:
+            names = [collection_id, self.ANY]
+
+        if self._redis is not None:
+            try:
+                values = self._redis.mget([self.PREFIX + name for name in names])
+                return tuple(int(value or 0) for value in values)
+            except redis.RedisError:
+                log.exception("Could not read the OpenSearch cache generations.")
+
+        return tuple(self._local.get(name, 0) for name in names)
+
+    def bump(self, collection_id):
+        """Invalidate the results that depend on a collection."""
+        names = [self.ALL, collection_id if collection_id else self.ANY]
+
+        with self._lock:
+            for name in names:
+                self._local[name] = self._local.get(name, 0) + 1
+
+        if self._redis is not None:
+            try:
+                pipeline = self._redis.pipeline()
+                for name in names:
+                    pipeline.incr(self.PREFIX + name)
+                pipeline.execute()
+            except redis.RedisError:
+                log.exception("Could not invalidate the OpenSearch result cache.")
+
+
+class ResultCache(object):
+    """
+    An LRU cache with a time to live for search results.
+
+    Each entry belongs to a collection (or to None if the search isn't
+    restricted to one) and stops being valid as soon as that collection's
+    generation changes.
+    """
+
+    def __init__(self, max_entries, ttl, generations):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.generations = generations
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, collection_id):
+        """Return the cached value or None if there is no valid entry."""
+        if not self.max_entries:
+            return None
+
+        generation = self.generations.get(collection_id)
+
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            expires, entry_generation, value = entry
+            if expires < time.time() or entry_generation != generation:
+                return None
+            # Re-insert the entry to mark it as the most recently used.
+            self._entries[key] = entry
+
+        return value
+
+    def get_generation(self, collection_id):
+        """
+        Return the generation that a value for the collection depends on. It
+        must be read before the value is computed and passed to set().
+        """
+        if not self.max_entries:
+            return None
+
+        return self.generations.get(collection_id)
+
+    def set(self, key, collection_id, value, generation=None):
+        """
+        Store a value, evicting the least recently used entries if necessary.
+
+        generation is the collection's generation from before the value was
+        computed, so a value computed while the collection was invalidated is
+        never valid. Without it, the current generation is used.
+        """
+        if not self.max_entries:
+            return
+
+        if generation is None:
+            generation = self.generations.get(collection_id)
+        expires = time.time() + self.ttl
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (expires, generation, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, collection_id):
+        """Invalidate the entries that depend on a collection."""
+        self.generations.bump(collection_id)
+
+    def clear(self):
+        """Remove all entries."""
+        with self._lock:
+            self._entries.clear()
+
+
+def invalidate_after_commit(session, collection_id):
+    """
+    Invalidate the cached results of a collection once the session's
+    transaction has been committed.
+
+    CKAN indexes changed datasets when the transaction is committed, so if the
+    results were invalidated any earlier, a concurrent search could still
+    cache the results from before the change as current.
+    """
+    session.info.setdefault(PENDING_INVALIDATIONS, set()).add(collection_id)
+
+
+def setup_invalidation(session):
+    """Invalidate the pending collections whenever the session commits."""
+    if not event.contains(session, "after_commit", invalidate_pending):
+        event.listen(session, "before_flush", invalidate_previous_collections)
+        event.listen(session, "after_commit", invalidate_pending)
+        event.listen(session, "after_soft_rollback", discard_pending)
+
+
+def invalidate_previous_collections(session, flush_context, instances):
+    """
+    Invalidate the collections that changed datasets were in before the
+    change, once it's committed.
+
+    The plugin's hooks only get the dataset as it is after the change, so a
+    dataset moved to another collection would stay in the cached results of
+    its old collection. The stored value of a changed collection_id extra is
+    only known until the change is flushed.
+    """
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, model.PackageExtra) and obj.key == "collection_id":
+            for collection_id in get_history(obj, "value").sum():
+                if collection_id:
+                    invalidate_after_commit(session, collection_id)
+
+
+def invalidate_pending(session):
+    """Invalidate the collections whose datasets were changed and committed."""
+    pending = session.info.pop(PENDING_INVALIDATIONS, None)
+    if pending:
+        cache = get_result_cache()
+        for collection_id in pending:
+            cache.invalidate(collection_id)
+
+
+def discard_pending(session, previous_transaction):
+    """Forget the collections whose changes were rolled back."""
+    session.info.pop(PENDING_INVALIDATIONS, None)
+
+
+def make_query_key(search_type, param_dict):
+    """
+    Return a canonical, hashable form of a validated query.
+
+    The parameters are sorted by name and repeated parameters are merged, so
+    equivalent queries share the same key regardless of the order of the
+    parameters in the URL.
+    """
+    values = {}
+    for param, value in param_dict.items():
+        values.setdefault(param, set()).add(value)
+
+    return (search_type,) + tuple(
+        (param, tuple(sorted(values[param]))) for param in sorted(values)
+    )
+
+
+def make_page_key(request_url, output_format, encoding):
+    """
+    Return the key of a rendered page of results.
+
+    The links in a page are based on the request URL, so pages are cached
+    by URL rather than by query.
+    """
+    return ("page", request_url, output_format, encoding)
+
+
+def cache_stream(
+    cache, key, collection_id, chunks, generation, etag=None, last_modified=None
+):
+    """
+    Yield the chunks of a streamed response and cache the complete body with
+    its ETag and last modification once the response has been written.
+
+    generation is the collection's generation from before the search, so a
+    response whose results changed while it was written isn't cached.
+    """
+    written = []
+    for chunk in chunks:
+        written.append(chunk)
+        yield chunk
+
+    cache.set(
+        key, collection_id, (etag, last_modified, b"".join(written)), generation
+    )
+
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """Return the result cache of this process, creating it on first use."""
+    global _result_cache
+
+    if _result_cache is None:
+        with _result_cache_lock:
+            if _result_cache is None:
+                _result_cache = ResultCache(
+                    get_result_cache_size(),
+                    get_result_cache_ttl(),
+                    Generations(get_result_cache_redis_url()),
+                )
+
+    return _result_cache
+
+
+_count_cache = None
+
+
+def get_count_cache():
+    """
+    Return the cache of collection totals of this process, creating it on
+    first use.
+
+    The totals are approximate: they're only refreshed when they expire, not
+    when datasets change, so their generations are never bumped.
+    """
+    global _count_cache
+
+    if _count_cache is None:
+        with _result_cache_lock:
+            if _count_cache is None:
+                ttl = get_count_cache_ttl()
+                # One total per collection plus the total of all datasets.
+                max_entries = len(get_registry().collections) + 1 if ttl > 0 else 0
+                _count_cache = ResultCache(max_entries, ttl, Generations())
+
+    return _count_cache
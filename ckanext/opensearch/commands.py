@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""Contains the paster commands of the OpenSearch extension."""
+
+from __future__ import print_function
+
+import json
+import sys
+
+from ckan.lib.cli import CkanCommand
+
+
+class OpenSearchCommand(CkanCommand):
+    """
+    OpenSearch commands
+
+    Usage:
+
+        opensearch benchmark [--rows=N] [--extras=N] [--resources=N]
+                             [--vertices=N] [--iterations=N]
+                             [--output=FILE] [--baseline=FILE] [--threshold=F]
+            Benchmark the OpenSearch request pipeline with a stubbed
+            package_search returning synthetic datasets. Prints the latency of
+            each stage and the peak memory of each request, optionally saves
+            the results as JSON and compares them with a baseline saved by a
+            previous run. Exits with status 1 if the median latency of a stage
+            (or the peak memory) grew by more than the threshold (default:
+            0.2, i.e., 20%).
+
+        opensearch rebuild-summaries
+            Recompute the collection summaries from the public, active
+            datasets and create the summary table if it doesn't exist yet.
+    """
+
+    summary = __doc__.split("\n")[0]
+    usage = __doc__
+    min_args = 1
+    max_args = 1
+
+    def __init__(self, name):
+        super(OpenSearchCommand, self).__init__(name)
+        self.parser.add_option("--rows", type="int", default=20)
+        self.parser.add_option("--extras", type="int", default=10)
+        self.parser.add_option("--resources", type="int", default=3)
+        self.parser.add_option("--vertices", type="int", default=5)
+        self.parser.add_option("--iterations", type="int", default=20)
+        self.parser.add_option("--output", default=None)
+        self.parser.add_option("--baseline", default=None)
+        self.parser.add_option("--threshold", type="float", default=0.2)
+
+    def command(self):
+        self._load_config()
+
+        cmd = self.args[0]
+        if cmd == "benchmark":
+            self.benchmark()
+        elif cmd == "rebuild-summaries":
+            self.rebuild_summaries()
+        else:
+            print("Command {} not recognized".format(cmd))
+            print(self.usage)
+            sys.exit(1)
+
+    def benchmark(self):
+        from ckan.common import config
+        from ckan.config.middleware import make_app
+        from ckanext.opensearch import benchmark
+
+        app = make_app(config["global_conf"], **config)
+        results = benchmark.run_benchmark(
+            app,
+            rows=self.options.rows,
+            extras=self.options.extras,
+            resources=self.options.resources,
+            vertices=self.options.vertices,
+            iterations=self.options.iterations,
+        )
+        print(benchmark.format_results(results))
+
+        if self.options.output:
+            with open(self.options.output, "w") as f:
+                json.dump(results, f, indent=2)
+            print("Saved the results to {}".format(self.options.output))
+
+        if self.options.baseline:
+            with open(self.options.baseline) as f:
+                baseline = json.load(f)
+            regressions = benchmark.compare_to_baseline(
+                results, baseline, self.options.threshold
+            )
+            for regression in regressions:
+                print("Regression: {}".format(regression))
+            if regressions:
+                sys.exit(1)
+            print("No regressions compared to {}".format(self.options.baseline))
+
+    def rebuild_summaries(self):
+        from ckanext.opensearch import model as opensearch_model
+
+        opensearch_model.setup()
+        summaries = opensearch_model.rebuild_summaries()
+        for collection_id in sorted(summaries):
+            print(
+                "{}: {} products".format(collection_id, summaries[collection_id].count)
+            )
+        print("Rebuilt the summaries of {} collections".format(len(summaries)))
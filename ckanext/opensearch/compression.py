@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Contains functions for compressing responses with gzip or, if the brotli
+package is installed, Brotli.
+"""
+
+import logging
+from timeit import default_timer
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from .config import get_brotli_quality, get_compression_enabled, get_gzip_level
+from .instrumentation import record
+
+log = logging.getLogger(__name__)
+
+# The content codings in order of preference.
+if brotli is not None:
+    ENCODINGS = ["br", "gzip"]
+else:
+    ENCODINGS = ["gzip"]
+
+# Documents that are compressed once and then served many times are compressed
+# with the best settings instead of the configured ones.
+BEST_LEVELS = {"gzip": 9, "br": 11}
+
+
+def negotiate_encoding(accept_encoding):
+    """
+    Return the preferred content coding that an Accept-Encoding header
+    accepts, or None if the response shouldn't be compressed.
+    """
+    if not accept_encoding or not get_compression_enabled():
+        return None
+
+    qualities = {}
+    for item in accept_encoding.split(","):
+        parts = item.split(";")
+        coding = parts[0].strip().lower()
+        quality = 1.0
+        for param in parts[1:]:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding] = quality
+
+    best = None
+    best_quality = 0.0
+    for encoding in ENCODINGS:
+        quality = qualities.get(encoding, qualities.get("*", 0.0))
+        if quality > best_quality:
+            best = encoding
+            best_quality = quality
+
+    return best
+
+
+def get_level(encoding):
+    """Return the configured compression level of a content coding."""
+    if encoding == "br":
+        return get_brotli_quality()
+
+    return get_gzip_level()
+
+
+class Compressor(object):
+    """Incrementally compresses a response body with a content coding."""
+
+    def __init__(self, encoding, level=None):
+        if level is None:
+            level = get_level(encoding)
+
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=level)
+            self._compress = getattr(
+                self._compressor, "process", None
+            ) or getattr(self._compressor, "compress")
+            self._finish = self._compressor.finish
+        else:
+            # 16 + MAX_WBITS writes a gzip header and trailer.
+            self._compressor = zlib.compressobj(
+                level, zlib.DEFLATED, 16 + zlib.MAX_WBITS
+            )
+            self._compress = self._compressor.compress
+            self._finish = self._compressor.flush
+
+    def compress(self, data):
+        return self._compress(data)
+
+    def finish(self):
+        return self._finish()
+
+
+def compress(body, encoding, level=None):
+    """Return a compressed response body."""
+    compressor = Compressor(encoding, level)
+    start = default_timer()
+    compressed = compressor.compress(body) + compressor.finish()
+    log_compression(encoding, len(body), len(compressed), default_timer() - start)
+
+    return compressed
+
+
+def compress_stream(chunks, encoding, level=None):
+    """
+    Compress the chunks of a streamed response body as they're read.
+
+    Only the compressed output that's ready is yielded, so the client gets a
+    steady stream of data without the response ever being held in memory.
+    """
+    compressor = Compressor(encoding, level)
+    size = 0
+    compressed_size = 0
+    duration = 0.0
+
+    for chunk in chunks:
+        size += len(chunk)
+        start = default_timer()
+        compressed = compressor.compress(chunk)
+        duration += default_timer() - start
+        if compressed:
+            compressed_size += len(compressed)
+            yield compressed
+
+    start = default_timer()
+    compressed = compressor.finish()
+    duration += default_timer() - start
+    compressed_size += len(compressed)
+    log_compression(encoding, size, compressed_size, duration)
+
+    yield compressed
+
+
+def log_compression(encoding, size, compressed_size, duration):
+    """
+    Log the ratio and the time of a compression and record the time as a
+    stage of the request.
+    """
+    record("compress", duration)
+    log.debug(
+        "Compressed %d bytes to %d bytes (ratio %.2f) with %s in %.1f ms",
+        size,
+        compressed_size,
+        float(size) / compressed_size if compressed_size else 0.0,
+        encoding,
+        duration * 1000.0,
+    )
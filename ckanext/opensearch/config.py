@@ -1,42 +1,68 @@
 # -*- coding: utf-8 -*-
-"""This module processes configuration files and creates constants."""
+"""
+This module processes configuration files and provides the settings.
+
+Nothing is read when the module is imported. The TOML files are loaded into the
+parameter registry when OpenSearch is first used, and the site settings are
+read from the CKAN config the first time they're needed.
+"""
 
 import toml
 import os
 import inspect
 from collections import OrderedDict
 import logging
+import threading
+import time
 import six
 
+try:
+    from collections.abc import Mapping
+except ImportError:  # Python 2
+    from collections import Mapping
+
 from ckan.common import config
+import ckan.plugins.toolkit as toolkit
 
 
 log = logging.getLogger(__name__)
 
 
-def load_config_file(file_path):
+def resolve_config_path(file_path):
     """
     Given a path like "ckanext.opensearch:namespaces.toml"
-    find the second part relative to the import path of the first
+    return the path of the second part relative to the import path of the first
     """
     module_name, file_name = file_path.split(":", 1)
     module = __import__(module_name, fromlist=[""])
-    file_path = os.path.join(os.path.dirname(inspect.getfile(module)), file_name)
 
-    return open(file_path)
+    return os.path.join(os.path.dirname(inspect.getfile(module)), file_name)
 
 
-def load_settings(settings_name):
+def load_config_file(file_path):
     """
-    Load the TOML file containing the named settings specified in the
-    INI file.
+    Given a path like "ckanext.opensearch:namespaces.toml"
+    find the second part relative to the import path of the first
     """
+    return open(resolve_config_path(file_path))
+
+
+def get_settings_path(settings_name):
+    """Return the path of the TOML file containing the named settings."""
     config_name = "ckanext.opensearch." + settings_name
     default_location = "ckanext.opensearch.defaults:{}.toml".format(settings_name)
     location = config.get(config_name, default_location)
-    file = load_config_file(location)
 
-    return toml.load(file, _dict=OrderedDict)
+    return resolve_config_path(location)
+
+
+def load_settings(settings_name):
+    """
+    Load the TOML file containing the named settings specified in the
+    INI file.
+    """
+    with open(get_settings_path(settings_name)) as file:
+        return toml.load(file, _dict=OrderedDict)
 
 
 def get_site_url():
@@ -73,6 +99,19 @@ def get_temporal_end_field():
     ).strip()
 
 
+def get_temporal_granularity():
+    """
+    Return the unit of Solr date math (SECOND, MINUTE, HOUR or DAY) that NOW
+    is rounded to in temporal filters, or an empty string to not round it.
+    """
+    return six.text_type(
+        os.environ.get(
+            "CKANEXT__OPENSEARCH__TEMPORAL_GRANULARITY",
+            config.get("ckanext.opensearch.temporal_granularity", "HOUR"),
+        )
+    ).strip().upper()
+
+
 def get_short_name():
     """
     Return the short name of the portal/service.
@@ -88,25 +127,700 @@ def get_short_name():
     ).strip()
 
 
-# Constants
-try:
-    COLLECTIONS = load_settings("collections_list")
-except IOError:
-    log.debug("No OpenSearch collections are configured.")
-    COLLECTIONS = {}
-
-PARAMETERS = {}
-PARAMETERS["dataset"] = load_settings("dataset_parameters")
-PARAMETERS["collection"] = load_settings("collection_parameters")
-
-for _id, details in COLLECTIONS.items():
-    PARAMETERS[_id] = dict(PARAMETERS["dataset"])
-    additional_parameters = details.get("additional_parameters", [])
-    for parameters_file in additional_parameters:
-        PARAMETERS[_id].update(load_settings(parameters_file))
-
-NAMESPACES = load_settings("namespaces")
-
-SITE_URL = get_site_url()
-SITE_TITLE = get_site_title()
-SHORT_NAME = get_short_name()
+def get_description_document_max_age():
+    """Return the number of seconds that clients may cache description documents."""
+    return int(
+        os.environ.get(
+            "CKANEXT__OPENSEARCH__DESCRIPTION_DOCUMENT_MAX_AGE",
+            config.get("ckanext.opensearch.description_document_max_age", 3600),
+        )
+    )
+
+
+def get_result_cache_size():
+    """
+    Return the maximum number of search results kept in the result cache.
+
+    0 (the default) disables the cache.
+    """
+    return int(
+        os.environ.get(
+            "CKANEXT__OPENSEARCH__RESULT_CACHE_SIZE",
+            config.get("ckanext.opensearch.result_cache_size", 0),
+        )
+    )
+
+
+def get_result_cache_ttl():
+    """Return the number of seconds that cached search results stay valid."""
+    return float(
+        os.environ.get(
+            "CKANEXT__OPENSEARCH__RESULT_CACHE_TTL",
+            config.get("ckanext.opensearch.result_cache_ttl", 300),
+        )
+    )
+
+
+def get_result_cache_redis_url():
+    """
+    Return the URL of the Redis server used to share cache invalidations
+    between processes, or an empty string if they are only kept in memory.
+    """
+    return six.text_type(
+        os.environ.get(
+            "CKANEXT__OPENSEARCH__RESULT_CACHE_REDIS_URL",
+            config.get("ckanext.opensearch.result_cache_redis_url", ""),
+        )
+    ).strip()
+
+
+def get_stream_chunk_size():
+    """
+    Return the number of results fetched from Solr at a time when a page of
+    results is streamed. Pages with more results are fetched in several
+    chunks while the feed is written, so memory use doesn't grow with the
+    page size.
+    """
+    return int(
+        os.environ.get(
+            "CKANEXT__OPENSEARCH__STREAM_CHUNK_SIZE",
+            config.get("ckanext.opensearch.stream_chunk_size", 100),
+        )
+    )
+
+
+def get_projection_enabled():
+    """
+    Return True if searches should only fetch the index fields used by the
+    feeds instead of complete datasets.
+    """
+    return toolkit.asbool(
+        os.environ.get(
+            "CKANEXT__OPENSEARCH__PROJECTION",
+            config.get("ckanext.opensearch.projection", False),
+        )
+    )
+
+
+def get_projection_extras():
+    """Return the names of the extras that the feeds use."""
+    return toolkit.aslist(
+        os.environ.get(
+            "CKANEXT__OPENSEARCH__PROJECTION_EXTRAS",
+            config.get(
+                "ckanext.opensearch.projection_extras",
+                "collection_id identifier spatial StartTime StopTime "
+                "timerange_start timerange_end Swath OrbitDirection "
+                "TransmitterReceiverPolarisation CloudCoverage",
+            ),
+        )
+    )
+
+
+def get_search_engine():
+    """
+    Return the engine used to execute searches: "package_search" (the default)
+    or "solr" to query the Solr index directly.
+    """
+    return six.text_type(
+        os.environ.get(
+            "CKANEXT__OPENSEARCH__SEARCH_ENGINE",
+            config.get("ckanext.opensearch.search_engine", "package_search"),
+        )
+    ).strip()
+
+
+def get_conditional_get_enabled():
+    """
+    Return True if search feeds should have ETag and Last-Modified headers
+    and conditional requests should be probed, so unchanged feeds can be
+    answered with 304 responses.
+    """
+    return toolkit.asbool(
+        os.environ.get(
+            "CKANEXT__OPENSEARCH__CONDITIONAL_GET",
+            config.get("ckanext.opensearch.conditional_get", True),
+        )
+    )
+
+
+def get_collection_summaries_enabled():
+    """
+    Return True if collection searches should use the collection summary
+    table, which is maintained as datasets are created, updated and deleted,
+    instead of facetting over the whole index.
+    """
+    return toolkit.asbool(
+        os.environ.get(
+            "CKANEXT__OPENSEARCH__COLLECTION_SUMMARIES",
+            config.get("ckanext.opensearch.collection_summaries", False),
+        )
+    )
+
+
+def get_compression_enabled():
+    """
+    Return True if responses should be compressed for clients that accept
+    gzip or Brotli.
+    """
+    return toolkit.asbool(
+        os.environ.get(
+            "CKANEXT__OPENSEARCH__COMPRESSION",
+            config.get("ckanext.opensearch.compression", True),
+        )
+    )
+
+
+def get_gzip_level():
+    """Return the gzip compression level (1-9) of streamed responses."""
+    return int(
+        os.environ.get(
+            "CKANEXT__OPENSEARCH__GZIP_LEVEL",
+            config.get("ckanext.opensearch.gzip_level", 6),
+        )
+    )
+
+
+def get_brotli_quality():
+    """Return the Brotli quality (0-11) of streamed responses."""
+    return int(
+        os.environ.get(
+            "CKANEXT__OPENSEARCH__BROTLI_QUALITY",
+            config.get("ckanext.opensearch.brotli_quality", 4),
+        )
+    )
+
+
+def get_batch_max_queries():
+    """Return the maximum number of queries in a batch search."""
+    return int(
+        os.environ.get(
+            "CKANEXT__OPENSEARCH__BATCH_MAX_QUERIES",
+            config.get("ckanext.opensearch.batch_max_queries", 20),
+        )
+    )
+
+
+def get_batch_workers():
+    """
+    Return the number of threads that execute the queries of batch searches,
+    shared by all batch searches of a process.
+    """
+    return int(
+        os.environ.get(
+            "CKANEXT__OPENSEARCH__BATCH_WORKERS",
+            config.get("ckanext.opensearch.batch_workers", 4),
+        )
+    )
+
+
+def get_server_timing_enabled():
+    """
+    Return True if responses should have a Server-Timing header with the
+    durations of the stages that ran before the response was sent.
+    """
+    return toolkit.asbool(
+        os.environ.get(
+            "CKANEXT__OPENSEARCH__SERVER_TIMING",
+            config.get("ckanext.opensearch.server_timing", True),
+        )
+    )
+
+
+def get_slow_query_threshold():
+    """
+    Return the duration in milliseconds above which requests are written to
+    the slow query log. 0 disables the log.
+    """
+    return float(
+        os.environ.get(
+            "CKANEXT__OPENSEARCH__SLOW_QUERY_THRESHOLD",
+            config.get("ckanext.opensearch.slow_query_threshold", 1000),
+        )
+    )
+
+
+def get_coordinate_precision():
+    """
+    Return the number of decimals that the coordinates of footprints are
+    rounded to in the results, or None (the default) to keep them as they are.
+    """
+    precision = six.text_type(
+        os.environ.get(
+            "CKANEXT__OPENSEARCH__COORDINATE_PRECISION",
+            config.get("ckanext.opensearch.coordinate_precision", ""),
+        )
+    ).strip()
+
+    return int(precision) if precision else None
+
+
+def get_simplify_tolerance():
+    """
+    Return the tolerance, in degrees, that footprints are simplified to in the
+    results. 0 (the default) disables simplification.
+    """
+    return float(
+        os.environ.get(
+            "CKANEXT__OPENSEARCH__SIMPLIFY_TOLERANCE",
+            config.get("ckanext.opensearch.simplify_tolerance", 0),
+        )
+    )
+
+
+def get_footprint_cache_size():
+    """
+    Return the maximum number of reduced footprints kept in memory, so
+    footprints are only rounded and simplified once per dataset revision.
+    """
+    return int(
+        os.environ.get(
+            "CKANEXT__OPENSEARCH__FOOTPRINT_CACHE_SIZE",
+            config.get("ckanext.opensearch.footprint_cache_size", 10000),
+        )
+    )
+
+
+def get_index_georss_enabled():
+    """
+    Return True if the GeoRSS values of each dataset's footprint should be
+    stored in the index when the dataset is indexed.
+    """
+    return toolkit.asbool(
+        os.environ.get(
+            "CKANEXT__OPENSEARCH__INDEX_GEORSS",
+            config.get("ckanext.opensearch.index_georss", False),
+        )
+    )
+
+
+def get_filter_cache_hints_enabled():
+    """
+    Return True if the filter queries of parameters marked with
+    filter_cache = false should bypass Solr's filterCache.
+    """
+    return toolkit.asbool(
+        os.environ.get(
+            "CKANEXT__OPENSEARCH__FILTER_CACHE_HINTS",
+            config.get("ckanext.opensearch.filter_cache_hints", False),
+        )
+    )
+
+
+def get_count_cache_ttl():
+    """
+    Return the number of seconds that the totals of count-only searches for a
+    whole collection are cached, or 0 if they aren't cached.
+    """
+    return int(
+        os.environ.get(
+            "CKANEXT__OPENSEARCH__COUNT_CACHE_TTL",
+            config.get("ckanext.opensearch.count_cache_ttl", 0),
+        )
+    )
+
+
+def get_entry_cache_size():
+    """
+    Return the maximum number of rendered search result entries that are
+    cached, or 0 if they aren't cached.
+    """
+    return int(
+        os.environ.get(
+            "CKANEXT__OPENSEARCH__ENTRY_CACHE_SIZE",
+            config.get("ckanext.opensearch.entry_cache_size", 0),
+        )
+    )
+
+
+def get_client_rate():
+    """
+    Return the number of searches per second that each client may send on
+    average, or 0 if the rate isn't limited.
+    """
+    return float(
+        os.environ.get(
+            "CKANEXT__OPENSEARCH__CLIENT_RATE",
+            config.get("ckanext.opensearch.client_rate", 0),
+        )
+    )
+
+
+def get_client_burst():
+    """Return the number of searches that a client may send at once."""
+    return int(
+        os.environ.get(
+            "CKANEXT__OPENSEARCH__CLIENT_BURST",
+            config.get("ckanext.opensearch.client_burst", 10),
+        )
+    )
+
+
+def get_client_max_concurrent():
+    """
+    Return the number of searches of a client that may run at the same time,
+    or 0 if there's no limit.
+    """
+    return int(
+        os.environ.get(
+            "CKANEXT__OPENSEARCH__CLIENT_MAX_CONCURRENT",
+            config.get("ckanext.opensearch.client_max_concurrent", 0),
+        )
+    )
+
+
+def get_max_concurrent():
+    """
+    Return the number of searches that may run at the same time in a process,
+    or 0 if there's no limit.
+    """
+    return int(
+        os.environ.get(
+            "CKANEXT__OPENSEARCH__MAX_CONCURRENT",
+            config.get("ckanext.opensearch.max_concurrent", 0),
+        )
+    )
+
+
+def get_address_clients():
+    """
+    Return the number of clients whose limits are shared by all the clientIds
+    of an address.
+    """
+    return int(
+        os.environ.get(
+            "CKANEXT__OPENSEARCH__ADDRESS_CLIENTS",
+            config.get("ckanext.opensearch.address_clients", 4),
+        )
+    )
+
+
+def get_trusted_proxies():
+    """
+    Return the addresses of the reverse proxies whose X-Forwarded-For headers
+    are trusted.
+    """
+    return toolkit.aslist(
+        os.environ.get(
+            "CKANEXT__OPENSEARCH__TRUSTED_PROXIES",
+            config.get("ckanext.opensearch.trusted_proxies", ""),
+        )
+    )
+
+
+def get_admission_max_clients():
+    """Return the number of clients whose limits and counters are kept."""
+    return int(
+        os.environ.get(
+            "CKANEXT__OPENSEARCH__ADMISSION_MAX_CLIENTS",
+            config.get("ckanext.opensearch.admission_max_clients", 10000),
+        )
+    )
+
+
+def get_export_page_size():
+    """
+    Return the number of products fetched from Solr at a time by a bulk
+    export, no more than package_search returns at once (ckan.search.rows_max).
+    """
+    page_size = int(
+        os.environ.get(
+            "CKANEXT__OPENSEARCH__EXPORT_PAGE_SIZE",
+            config.get("ckanext.opensearch.export_page_size", 500),
+        )
+    )
+
+    return min(page_size, get_rows_max())
+
+
+def get_rows_max():
+    """
+    Return the highest number of rows that package_search returns at once.
+    CKAN 2.7 always caps them at 1000; later versions read ckan.search.rows_max.
+    """
+    return int(config.get("ckan.search.rows_max", 1000))
+
+
+def get_query_cost_budget():
+    """
+    Return the highest cost of a query that is searched as it is, or 0 if the
+    cost of queries isn't limited.
+    """
+    return float(
+        os.environ.get(
+            "CKANEXT__OPENSEARCH__QUERY_COST_BUDGET",
+            config.get("ckanext.opensearch.query_cost_budget", 0),
+        )
+    )
+
+
+def get_query_cost_action():
+    """
+    Return what happens to queries over the budget: "reject" or "degrade"
+    (simplify the geometry and reduce the page size, if that's enough).
+    """
+    return six.text_type(
+        os.environ.get(
+            "CKANEXT__OPENSEARCH__QUERY_COST_ACTION",
+            config.get("ckanext.opensearch.query_cost_action", "reject"),
+        )
+    ).strip().lower()
+
+
+def get_query_cost_degraded_rows():
+    """
+    Return the page size that first pages over the budget are reduced to if
+    queries are degraded.
+    """
+    return max(
+        int(
+            os.environ.get(
+                "CKANEXT__OPENSEARCH__QUERY_COST_DEGRADED_ROWS",
+                config.get("ckanext.opensearch.query_cost_degraded_rows", 100),
+            )
+        ),
+        1,
+    )
+
+
+def get_reload_interval():
+    """
+    Return the number of seconds between checks for modified settings files.
+
+    0 (the default) disables reloading, so changes require a restart.
+    """
+    return float(
+        os.environ.get(
+            "CKANEXT__OPENSEARCH__RELOAD_INTERVAL",
+            config.get("ckanext.opensearch.reload_interval", 0),
+        )
+    )
+
+
+class FrozenDict(Mapping):
+    """A read-only, ordered mapping used for the precomputed settings."""
+
+    def __init__(self, *args, **kwargs):
+        self._data = OrderedDict(*args, **kwargs)
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return "{}({!r})".format(type(self).__name__, list(self._data.items()))
+
+
+class ParameterRegistry(object):
+    """
+    The collections, namespaces and parameters of every description document.
+
+    The registry is built once from the TOML files and never modified afterwards,
+    so it can be shared by all requests without copying or re-reading the
+    settings. When the files change, a new registry is built and swapped in by
+    reload_registry().
+    """
+
+    def __init__(self):
+        self.sources = {}
+        self._loaded = {}
+
+        try:
+            collections = self._load("collections_list")
+        except IOError:
+            log.debug("No OpenSearch collections are configured.")
+            collections = OrderedDict()
+
+        parameters = OrderedDict()
+        parameters["dataset"] = self._load("dataset_parameters")
+        parameters["collection"] = self._load("collection_parameters")
+
+        for _id, details in collections.items():
+            parameters[_id] = OrderedDict(parameters["dataset"])
+            additional_parameters = details.get("additional_parameters", [])
+            for parameters_file in additional_parameters:
+                parameters[_id].update(self._load(parameters_file))
+
+        self.collections = FrozenDict(
+            (_id, FrozenDict(details)) for _id, details in collections.items()
+        )
+        self.parameters = FrozenDict(
+            (document_type, FrozenDict(
+                (name, FrozenDict(details)) for name, details in params.items()
+            ))
+            for document_type, params in parameters.items()
+        )
+        self.namespaces = FrozenDict(self._load("namespaces"))
+        self._validators = {}
+
+    def _load(self, settings_name):
+        """
+        Load the named settings and remember the file's modification time.
+
+        Each file is only parsed once, even if several collections add the
+        same additional parameters.
+        """
+        path = get_settings_path(settings_name)
+        if path not in self._loaded:
+            self.sources[path] = os.path.getmtime(path)
+            self._loaded[path] = load_settings(settings_name)
+
+        return self._loaded[path]
+
+    def get_parameters(self, document_type):
+        """
+        Return the parameters of a description document, i.e. "dataset",
+        "collection" or a collection ID.
+
+        Raises a KeyError if the document type is unknown.
+        """
+        return self.parameters[document_type]
+
+    def get_validators(self, document_type):
+        """
+        Return the compiled validators of a description document's parameters.
+
+        The validators are compiled the first time they're needed, because the
+        validators module depends on the plugin, which imports this module.
+        """
+        try:
+            return self._validators[document_type]
+        except KeyError:
+            from ckanext.opensearch.validators import compile_validators
+
+            compiled = compile_validators(self.get_parameters(document_type))
+            self._validators[document_type] = compiled
+
+            return compiled
+
+    def is_stale(self):
+        """Return True if any of the settings files changed after loading."""
+        for path, mtime in self.sources.items():
+            try:
+                if os.path.getmtime(path) != mtime:
+                    return True
+            except OSError:
+                return True
+
+        return False
+
+
+_registry = None
+_registry_lock = threading.Lock()
+_watcher = None
+
+
+def get_registry():
+    """Return the current parameter registry, building it on first use."""
+    if _registry is None:
+        return reload_registry()
+
+    return _registry
+
+
+def reload_registry(force=False):
+    """
+    Rebuild the parameter registry if any of its settings files changed.
+
+    Returns the current registry. If the new settings can't be loaded, the
+    previous registry stays in place.
+    """
+    global _registry
+
+    with _registry_lock:
+        if force or _registry is None or _registry.is_stale():
+            try:
+                _registry = ParameterRegistry()
+                log.debug("Loaded the OpenSearch parameter registry.")
+            except Exception:
+                if _registry is None:
+                    raise
+                log.exception("Could not reload the OpenSearch settings.")
+
+    return _registry
+
+
+def _watch_settings(interval):
+    """Periodically reload the registry when the settings files change."""
+    while True:
+        time.sleep(interval)
+        reload_registry()
+
+
+def start_registry_watcher(interval=None):
+    """
+    Start a background thread that reloads the registry when a settings file
+    changes. The request path only ever reads the current registry, so it
+    never has to touch the file system.
+    """
+    global _watcher
+
+    if interval is None:
+        interval = get_reload_interval()
+    if interval <= 0 or _watcher is not None:
+        return
+
+    _watcher = threading.Thread(
+        target=_watch_settings, args=(interval,), name="opensearch-settings"
+    )
+    _watcher.daemon = True
+    _watcher.start()
+
+
+class memoized_property(object):
+    """A property whose value is computed on first access and then kept."""
+
+    def __init__(self, function):
+        self.function = function
+        self.__doc__ = function.__doc__
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        value = self.function(instance)
+        # The instance attribute takes precedence from now on.
+        instance.__dict__[self.function.__name__] = value
+
+        return value
+
+
+class Settings(object):
+    """
+    The OpenSearch settings, read when they're first used.
+
+    The site settings are read from the CKAN config once. The collections,
+    parameters and namespaces always come from the current parameter
+    registry, so they reflect reloaded settings files.
+    """
+
+    @memoized_property
+    def site_url(self):
+        return get_site_url()
+
+    @memoized_property
+    def site_title(self):
+        return get_site_title()
+
+    @memoized_property
+    def short_name(self):
+        return get_short_name()
+
+    @property
+    def collections(self):
+        return get_registry().collections
+
+    @property
+    def parameters(self):
+        return get_registry().parameters
+
+    @property
+    def namespaces(self):
+        return get_registry().namespaces
+
+
+settings = Settings()
@@ -1,18 +1,115 @@
 # -*- coding: utf-8 -*-
 """Contains the OpenSearch controller and methods for transforming queries."""
 
+import json
+
+import six
+
 from ckan.lib.base import abort, BaseController
 from ckan.common import _, c, config, request, response
+import ckan.authz as authz
 import ckan.logic as logic
 import ckan.model as model
 
-from .description_document import make_description_document
-from .search import make_results_feed
+from . import batch, encoders, export
+from .admission import (
+    AdmissionError,
+    ReleasingIterable,
+    get_admission,
+    get_client_keys,
+)
+from .caching import (
+    cache_stream,
+    etag_matches,
+    get_result_cache,
+    make_page_key,
+    not_modified_since,
+)
+from .compression import compress, compress_stream, negotiate_encoding
+from .config import (
+    get_compression_enabled,
+    get_conditional_get_enabled,
+    get_description_document_max_age,
+    get_server_timing_enabled,
+)
+from .description_document import get_description_document
+from .instrumentation import finish_stream, get_timer, start_request
+from .search import (
+    get_results_version,
+    is_chunked,
+    make_results_feed,
+    make_search_query,
+)
+
+
+# The content types of the output formats of search results.
+OUTPUT_FORMATS = {
+    "atom": "application/atom+xml",
+    "geojson": encoders.CONTENT_TYPE,
+    "jsonld": encoders.JSONLD_CONTENT_TYPE,
+}
+
+# The actions whose requests are subject to admission control.
+ADMITTED_ACTIONS = {"return_search_results", "return_batch_results", "return_export"}
+
+# The output formats of the media types that the httpAccept parameter accepts.
+ACCEPTED_MEDIA_TYPES = {
+    "application/atom+xml": "atom",
+    "application/geo+json": "geojson",
+    "application/json": "geojson",
+    "application/ld+json": "jsonld",
+}
+
+
+def get_output_format(http_accept, default):
+    """
+    Return the output format requested by the httpAccept parameter or the
+    default format of the endpoint if there's none.
+    """
+    if not http_accept:
+        return default
+
+    output_format = ACCEPTED_MEDIA_TYPES.get(http_accept.strip())
+    if output_format is None:
+        abort(400, "Unsupported httpAccept value ({})".format(http_accept))
+
+    return output_format
 
 
 class OpenSearchController(BaseController):
     """Controller for OpenSearch queries."""
 
+    def __call__(self, environ, start_response):
+        """
+        Admit searches before they're dispatched.
+
+        A search over its client's limits or the process's limit is rejected
+        without any validation or search. An admitted search is released once
+        its response has been written, or if it fails.
+        """
+        action = environ.get("wsgiorg.routing_args", ((), {}))[1].get("action")
+        admission = get_admission()
+        if action not in ADMITTED_ACTIONS or not admission.enabled:
+            return super(OpenSearchController, self).__call__(environ, start_response)
+
+        client, address = get_client_keys(environ)
+        try:
+            admission.admit(client, address=address)
+        except AdmissionError as e:
+            return e.make_response()(environ, start_response)
+
+        try:
+            app_iter = super(OpenSearchController, self).__call__(
+                environ, start_response
+            )
+        except Exception:
+            admission.release(client, address=address)
+            raise
+
+        return ReleasingIterable(
+            app_iter, lambda: admission.release(client, address=address)
+        )
+
     def check_auth_context(self):
         try:
             context = {"model": model, "user": c.user, "auth_user_obj": c.userobj}
@@ -24,19 +121,53 @@ class OpenSearchController(BaseController):
         return context
 
     def return_description_document(self):
-        """Return a description document based on the query."""
+        """
+        Return a description document based on the query.
+
+        The documents are pre-rendered, so a client that already has the
+        current version gets a 304 response without any rendering.
+        """
+        start_request(request.url)
         self.check_auth_context()
 
-        request_url = request.url
         params = request.params
 
-        description_document = make_description_document(params, request_url)
+        description_document = get_description_document(params)
         content_type = "application/opensearchdescription+xml"
 
-        return self._finish(200, description_document, content_type)
+        encoding = negotiate_encoding(request.headers.get("Accept-Encoding"))
+        etag = description_document.get_etag(encoding)
+
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = "public, max-age={}".format(
+            get_description_document_max_age()
+        )
+
+        if_none_match = request.headers.get("If-None-Match")
+        if etag_matches(if_none_match, etag):
+            return self._finish(304, "", content_type)
 
-    def return_search_results(self, search_type):
-        """Execute a search and return the results as an Atom feed."""
+        return self._finish(
+            200, description_document.get_body(encoding), content_type, encoding
+        )
+
+    def return_search_results(self, search_type, output_format="atom"):
+        """
+        Execute a search and return the results as an Atom feed or, for the
+        .geojson and .jsonld endpoints or an httpAccept parameter asking for
+        them, as GeoJSON or JSON-LD.
+
+        The feed is streamed, i.e. it's written to the client while the entries
+        are rendered, and compressed on the fly if the client accepts it. If
+        the result cache is enabled, pages that aren't fetched in chunks are
+        cached as they were sent, i.e., already compressed. Unless
+        conditional requests are disabled, pages that aren't fetched in chunks
+        have an ETag and a Last-Modified header based on their results. If the
+        request is conditional, a cheap probe of the matching datasets comes
+        first, so a client whose copy of the feed is still current gets a 304
+        response without any search.
+        """
+        start_request(request.url)
         context = self.check_auth_context()
 
         request_url = request.url
@@ -45,15 +176,183 @@ class OpenSearchController(BaseController):
         if search_type != "collection":
             search_type = params.get("collection_id", search_type)
 
-        results_feed = make_results_feed(search_type, params, request_url, context)
-        content_type = "application/atom+xml"
+        output_format = get_output_format(params.get("httpAccept"), output_format)
+        param_dict = make_search_query(search_type, params)
+        content_type = OUTPUT_FORMATS[output_format]
+
+        probe = None
+        conditional = request.headers.get("If-None-Match") or request.headers.get(
+            "If-Modified-Since"
+        )
+        if conditional and get_conditional_get_enabled():
+            probe = get_results_version(search_type, param_dict, request_url, context)
+            if self._is_not_modified(None, None, probe):
+                return self._finish(304, "", content_type)
+
+        encoding = negotiate_encoding(request.headers.get("Accept-Encoding"))
+        cache = get_result_cache()
+        collection_id = param_dict.get("productType")
+        page_key = None
+        if cache.max_entries and not is_chunked(search_type, param_dict):
+            page_key = make_page_key(request_url, output_format, encoding)
+            page = cache.get(page_key, collection_id)
+            if page is not None:
+                etag, last_modified, body = page
+                if self._is_not_modified(etag, last_modified, probe):
+                    return self._finish(304, "", content_type)
+                return self._finish(200, body, content_type, encoding)
+            generation = cache.get_generation(collection_id)
+
+        etag, last_modified, results_feed = make_results_feed(
+            search_type, params, request_url, context, param_dict, output_format
+        )
+        if self._is_not_modified(etag, last_modified, probe):
+            return self._finish(304, "", content_type)
+
+        if encoding:
+            results_feed = compress_stream(results_feed, encoding)
+        if page_key:
+            results_feed = cache_stream(
+                cache,
+                page_key,
+                collection_id,
+                results_feed,
+                generation,
+                etag,
+                last_modified,
+            )
 
-        return self._finish(200, results_feed, content_type)
+        return self._finish(200, results_feed, content_type, encoding)
 
-    def _finish(self, status_int, response_data, content_type):
+    def return_jsonld_context(self):
+        """Return the context of the JSON-LD search results."""
+        start_request(request.url)
+        response.headers["Cache-Control"] = "public, max-age={}".format(
+            get_description_document_max_age()
+        )
+
+        return self._finish(
+            200, encoders.get_jsonld_context(), encoders.JSONLD_CONTENT_TYPE
+        )
+
+    def return_batch_results(self):
+        """
+        Execute the queries of a batch search concurrently and return their
+        results as GeoJSON feature collections in a JSON object.
+        """
+        start_request(request.url)
+        context = self.check_auth_context()
+
+        queries = batch.parse_batch(request.body)
+        batch.validate_batch(queries)
+
+        # The request was admitted as one search, so the batch's other
+        # queries are charged to the client before they run.
+        admission = get_admission()
+        client, address = get_client_keys(request.environ)
+        searches = len(queries) - 1
+        if admission.enabled and searches:
+            try:
+                admission.admit(client, searches, address)
+            except AdmissionError as e:
+                response.headers["Retry-After"] = str(e.retry_after)
+                return self._finish(e.status, e.message, "text/plain")
+        try:
+            results = batch.run_batch(queries, context)
+        finally:
+            if admission.enabled and searches:
+                admission.release(client, searches, address)
+        body = batch.make_batch_response(queries, results)
+
+        encoding = negotiate_encoding(request.headers.get("Accept-Encoding"))
+        if encoding:
+            body = compress(body, encoding)
+
+        return self._finish(200, body, batch.CONTENT_TYPE, encoding)
+
+    def return_export(self, output_format="ndjson"):
+        """
+        Export every product that matches the query as NDJSON or as one Atom
+        feed, streamed while the products are fetched from Solr page by page.
+
+        Exports are never cached. An export continues after the product
+        whose cursor is given in the cursor parameter.
+        """
+        start_request(request.url)
+        context = self.check_auth_context()
+
+        params = request.params
+        search_type = params.get("collection_id", "dataset")
+        param_dict = make_search_query(search_type, params)
+        results_dict = export.start_export(
+            search_type, param_dict, request.url, context
+        )
+        body = export.stream_export(results_dict, output_format)
+
+        encoding = negotiate_encoding(request.headers.get("Accept-Encoding"))
+        if encoding:
+            body = compress_stream(body, encoding)
+
+        return self._finish(200, body, export.CONTENT_TYPES[output_format], encoding)
+
+    def return_admission_counters(self):
+        """Return the admission counters of this process to sysadmins."""
+        start_request(request.url)
+        self.check_auth_context()
+        if not authz.is_sysadmin(c.user):
+            abort(403, _("Not authorized to see this page"))
+
+        body = json.dumps(get_admission().get_counters(), indent=2)
+
+        return self._finish(200, body, "application/json")
+
+    def _is_not_modified(self, etag, last_modified, probe=None):
+        """
+        Add the ETag and Last-Modified header of a feed to the response and
+        return True if the client's copy of the feed is still current.
+
+        probe is the ETag and last modification from the probe, if the
+        request is conditional. They're sent instead of the feed's, so the
+        client's next conditional request can be answered by the probe alone.
+        If-Modified-Since is only used if there's no If-None-Match.
+        """
+        etags = [etag]
+        if probe is not None:
+            etag, last_modified = probe
+            etags.append(etag)
+
+        if etag is not None:
+            response.headers["ETag"] = etag
+        if last_modified is not None:
+            response.last_modified = last_modified
+
+        if_none_match = request.headers.get("If-None-Match")
+        if if_none_match:
+            return any(etag_matches(if_none_match, value) for value in etags if value)
+
+        return not_modified_since(
+            request.headers.get("If-Modified-Since"), last_modified
+        )
+
+    def _finish(self, status_int, response_data, content_type, encoding=None):
         """Prepare the response once the controller method has finished."""
         response.charset = "UTF-8"
         response.status_int = status_int
         response.headers["Content-Type"] = content_type + "; charset=UTF-8"
+        if get_compression_enabled():
+            response.headers["Vary"] = "Accept-Encoding"
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+
+        # Streamed responses are still being produced, so their timers are
+        # finished once they have been written.
+        timer = get_timer()
+        if timer is not None:
+            if get_server_timing_enabled():
+                response.headers["Server-Timing"] = timer.server_timing()
+            if isinstance(response_data, (bytes, six.text_type)):
+                timer.finish()
+            else:
+                response_data = finish_stream(timer, response_data)
 
         return response_data
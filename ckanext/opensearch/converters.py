@@ -4,6 +4,17 @@
 Contains functions for converting OpenSearch parameters to CKAN/Solr parameters.
 """
 
+import base64
+import json
+
+import six
+
+from .temporal import make_now
+
+# The sort order that makes cursors stable: each dataset has a unique ID, so
+# the position of a dataset in the results is fully defined by the two values.
+CURSOR_SORT = "metadata_modified asc, id asc"
+
 
 def range_array_to_solr_range(range_array):
     """
@@ -43,13 +54,13 @@ def solr_timerange_start(start_time):
     if not start_time:
         start_time = "*"
 
-    return "[{} TO {}]".format(start_time, "NOW")
+    return "[{} TO {}]".format(start_time, make_now())
 
 
 def solr_timerange_stop(stop_time):
     """Convert a single stop time into a timerange for Solr."""
     if not stop_time:
-        stop_time = "NOW"
+        stop_time = make_now()
 
     return "[{} TO {}]".format("*", stop_time)
 
@@ -61,3 +72,82 @@ def solr_timerange(start_time, stop_time):
 def intersects_spatial(geometry):
     """Convert a geometry parameter into Solr Intersects query."""
     return '"Intersects({})"'.format(geometry)
+
+
+def bbox_to_solr_spatial(bbox):
+    """
+    Convert a bbox parameter like 'west,south,east,north' into a filter on the
+    spatial field that ckanext-spatial's Solr backend indexes.
+    """
+    west, south, east, north = [coordinate.strip() for coordinate in bbox.split(",")]
+
+    return '+spatial_geom:"Intersects(ENVELOPE({}, {}, {}, {}))"'.format(
+        west, east, north, south
+    )
+
+
+def encode_cursor(metadata_modified, dataset_id):
+    """
+    Return a URL-safe cursor pointing after the dataset with the given
+    modification date and ID.
+
+    Solr stores dates with millisecond precision, so the date is truncated to
+    milliseconds to match the indexed value.
+    """
+    metadata_modified = metadata_modified.rstrip("Z")
+    if "." in metadata_modified:
+        seconds, fraction = metadata_modified.split(".", 1)
+        metadata_modified = "{}.{}".format(seconds, fraction[:3])
+    metadata_modified += "Z"
+
+    cursor = json.dumps([metadata_modified, dataset_id]).encode("utf-8")
+
+    return base64.urlsafe_b64encode(cursor).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    Return the modification date and ID encoded in a cursor.
+
+    Raises a ValueError if the cursor is malformed, i.e., if it doesn't encode
+    two non-empty strings.
+    """
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        values = json.loads(
+            base64.urlsafe_b64decode(str(cursor + padding)).decode("utf-8")
+        )
+        if not isinstance(values, list):
+            raise ValueError(cursor)
+        metadata_modified, dataset_id = values
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError("Invalid cursor: {}".format(cursor))
+
+    for value in (metadata_modified, dataset_id):
+        if not isinstance(value, six.string_types) or not value:
+            raise ValueError("Invalid cursor: {}".format(cursor))
+
+    return metadata_modified, dataset_id
+
+
+def cursor_filter(cursor):
+    """
+    Convert a cursor into a Solr filter for the results after it.
+
+    "*" is the cursor of the first page, which doesn't need a filter.
+    """
+    if cursor == "*":
+        return ""
+
+    metadata_modified, dataset_id = decode_cursor(cursor)
+    metadata_modified = quote_solr(metadata_modified)
+    dataset_id = quote_solr(dataset_id)
+
+    return "+(metadata_modified:{{{0} TO *] OR (metadata_modified:{0} AND id:{{{1} TO *]))".format(  # noqa: E501
+        metadata_modified, dataset_id
+    )
+
+
+def quote_solr(value):
+    """Return a value as a quoted Solr term."""
+    return '"{}"'.format(value.replace("\\", "\\\\").replace('"', '\\"'))
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the cost model of OpenSearch queries.
+
+Each validated query is scored before it's searched. The score is the sum of
+the costs of:
+
+* the offset: one point per 1000 results that Solr has to skip,
+* the page size: one point per 100 requested results,
+* the geometry: one point per 100 vertices of the geom parameter,
+* the search terms: 10 points for a term with a leading wildcard, which Solr
+  has to match against every term of the index, and 2 for other wildcards,
+* the selectivity: 2 points for a time range that's open on one side and
+  isn't restricted to a collection, which matches most of the index.
+
+A query whose score exceeds ckanext.opensearch.query_cost_budget is rejected
+or, if ckanext.opensearch.query_cost_action is "degrade", made cheaper by
+simplifying its geometry and then reducing its page size to
+ckanext.opensearch.query_cost_degraded_rows. Queries that are still over the
+budget afterwards are rejected.
+
+The page size is only reduced on first pages (and cursor pages), which have
+no offset. The links of the degraded page use the reduced page size, so a
+client that follows them gets the following pages with the same size. A
+deeper page with the original page size would skip a different number of
+results, so it's rejected instead.
+"""
+
+from collections import OrderedDict
+import re
+
+import shapely.wkt
+from shapely.errors import ReadingError, WKTReadingError
+from shapely.geometry import mapping
+
+from .config import (
+    get_query_cost_action,
+    get_query_cost_budget,
+    get_query_cost_degraded_rows,
+)
+from ckanext.opensearch.helpers import iter_positions
+from plugin import OpenSearchError
+
+OFFSET_WEIGHT = 1 / 1000.0
+ROWS_WEIGHT = 1 / 100.0
+VERTEX_WEIGHT = 1 / 100.0
+LEADING_WILDCARD_COST = 10.0
+WILDCARD_COST = 2.0
+OPEN_TIME_RANGE_COST = 2.0
+
+# Geometries are simplified until they have at most this many vertices.
+DEGRADED_VERTICES = 50
+
+LEADING_WILDCARD = re.compile(r"(^|[\s(:])[*?]\w")
+WILDCARD = re.compile(r"\w[*?]")
+
+
+class QueryCost(object):
+    """The score of a query and the cost of each of its parts."""
+
+    def __init__(self, costs):
+        self.costs = costs
+
+    @property
+    def total(self):
+        return sum(self.costs.values())
+
+    def describe(self):
+        """Return the costs as a string, e.g., for an error message."""
+        return ", ".join(
+            "{} {:.1f}".format(name, cost) for name, cost in self.costs.items() if cost
+        )
+
+
+def count_vertices(geometry):
+    """Return the number of vertices of a Shapely geometry."""
+    return sum(1 for _ in iter_positions(mapping(geometry)["coordinates"]))
+
+
+def parse_geometry(wkt):
+    """Return the Shapely geometry of a WKT string, or None if it's invalid."""
+    try:
+        return shapely.wkt.loads(wkt)
+    except (ReadingError, WKTReadingError, ValueError):
+        return None
+
+
+def get_q_cost(q):
+    """Return the cost of the wildcards of the search terms."""
+    if not q:
+        return 0.0
+    if LEADING_WILDCARD.search(q):
+        return LEADING_WILDCARD_COST
+    if WILDCARD.search(q):
+        return WILDCARD_COST
+
+    return 0.0
+
+
+def estimate_cost(search_type, param_dict, rows, offset, geometry=None):
+    """
+    Return the cost of a query, whose page size and offset have already been
+    computed from its parameters. A parsed geometry can be passed to avoid
+    parsing the geom parameter again.
+    """
+    if geometry is None and param_dict.get("geom"):
+        geometry = parse_geometry(param_dict["geom"])
+
+    open_time_range = bool(param_dict.get("timerange_start")) != bool(
+        param_dict.get("timerange_end")
+    )
+    unrestricted = search_type in ("dataset", "collection") and not param_dict.get(
+        "productType"
+    )
+
+    costs = OrderedDict()
+    costs["offset"] = offset * OFFSET_WEIGHT
+    costs["rows"] = rows * ROWS_WEIGHT
+    costs["geometry"] = (
+        count_vertices(geometry) * VERTEX_WEIGHT if geometry is not None else 0.0
+    )
+    costs["q"] = get_q_cost(param_dict.get("q"))
+    costs["selectivity"] = (
+        OPEN_TIME_RANGE_COST if open_time_range and unrestricted else 0.0
+    )
+
+    return QueryCost(costs)
+
+
+def simplify_geometry(geometry, max_vertices):
+    """
+    Return a geometry simplified to at most max_vertices vertices, doubling
+    the tolerance until it fits, or None if it can't be simplified enough.
+    """
+    tolerance = 0.001
+    while tolerance <= 10:
+        simplified = geometry.simplify(tolerance, preserve_topology=True)
+        if not simplified.is_empty and count_vertices(simplified) <= max_vertices:
+            return simplified
+        tolerance *= 2
+
+    return None
+
+
+def apply_cost_budget(search_type, param_dict, rows, offset):
+    """
+    Check a validated query against the cost budget.
+
+    Returns a list of the changes made to the query if it was degraded.
+    param_dict is changed in place. The page size is only reduced if the
+    query has no offset. Raises an OpenSearchError if the query is
+    over the budget and can't be degraded enough.
+    """
+    budget = get_query_cost_budget()
+    if budget <= 0:
+        return []
+
+    geometry = None
+    if param_dict.get("geom"):
+        geometry = parse_geometry(param_dict["geom"])
+
+    cost = estimate_cost(search_type, param_dict, rows, offset, geometry)
+    if cost.total <= budget:
+        return []
+
+    degraded = []
+    if get_query_cost_action() == "degrade":
+        if cost.costs["geometry"] and count_vertices(geometry) > DEGRADED_VERTICES:
+            simplified = simplify_geometry(geometry, DEGRADED_VERTICES)
+            if simplified is not None:
+                param_dict["geom"] = simplified.wkt
+                geometry = simplified
+                degraded.append("geometry")
+                cost = estimate_cost(search_type, param_dict, rows, offset, geometry)
+
+        degraded_rows = get_query_cost_degraded_rows()
+        if cost.total > budget and offset == 0 and rows > degraded_rows:
+            param_dict["rows"] = str(degraded_rows)
+            degraded.append("rows")
+            rows = degraded_rows
+            cost = estimate_cost(search_type, param_dict, rows, offset, geometry)
+
+    if cost.total > budget:
+        raise OpenSearchError(
+            "The query is too expensive (cost {:.1f}, budget {:.1f}: {}). Use a "
+            "smaller page, a simpler geometry, a cursor instead of a deep page "
+            "or more specific search terms.".format(
+                cost.total, budget, cost.describe()
+            )
+        )
+
+    return degraded
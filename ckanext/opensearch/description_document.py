@@ -2,10 +2,109 @@
 """Contains functions for building description documents."""
 
 from collections import OrderedDict
+import threading
 
 from ckan.lib.base import abort, render
 
-from .config import PARAMETERS, NAMESPACES, SHORT_NAME, SITE_URL
+from .caching import make_etag
+from .compression import BEST_LEVELS, compress
+from .config import get_registry, settings
+from .instrumentation import timed
+
+
+class DescriptionDocument(object):
+    """
+    A pre-rendered description document and its ETag.
+
+    The document is compressed the first time a client accepts a content
+    coding and the compressed body is kept for later requests.
+    """
+
+    def __init__(self, document_type, body):
+        self.document_type = document_type
+        self.body = body
+        self.etag = make_etag(body)
+        self._compressed = {}
+
+    def get_body(self, encoding=None):
+        """Return the body, compressed with the content coding if one is given."""
+        if not encoding:
+            return self.body
+
+        body = self._compressed.get(encoding)
+        if body is None:
+            body = compress(self.body, encoding, BEST_LEVELS[encoding])
+            self._compressed[encoding] = body
+
+        return body
+
+    def get_etag(self, encoding=None):
+        """
+        Return the ETag of the body with the content coding. Each coding is a
+        different representation, so it has a different strong ETag.
+        """
+        if not encoding:
+            return self.etag
+
+        return '{}-{}"'.format(self.etag[:-1], encoding)
+
+
+# The rendered documents belong to the registry they were built from and are
+# replaced when the registry is reloaded.
+_documents = (None, {})
+_documents_lock = threading.Lock()
+
+
+def get_description_document(params):
+    """Return the pre-rendered description document requested by the query."""
+    document_type = get_document_type_or_abort(params)
+
+    return get_description_documents()[document_type]
+
+
+def get_description_documents():
+    """
+    Return the description documents of every collection plus the dataset and
+    collection documents, rendering all of them the first time they're needed.
+
+    The documents only depend on the settings, so they are rendered once per
+    registry instead of once per request.
+    """
+    global _documents
+
+    registry = get_registry()
+    built_from, documents = _documents
+    if built_from is registry:
+        return documents
+
+    with _documents_lock:
+        built_from, documents = _documents
+        if built_from is not registry:
+            with timed("render"):
+                documents = make_all_documents(registry)
+            _documents = (registry, documents)
+
+    return documents
+
+
+def make_all_documents(registry):
+    """Render the description documents of a registry."""
+    documents = {}
+    for document_type in registry.parameters:
+        self_url = make_self_url(document_type)
+        body = make_description_document({"osdd": document_type}, self_url).encode(
+            "utf-8"
+        )
+        documents[document_type] = DescriptionDocument(document_type, body)
+
+    return documents
+
+
+def make_self_url(document_type):
+    """Return the canonical URL of a description document."""
+    return "{}/opensearch/description.xml?osdd={}".format(
+        settings.site_url, document_type
+    )
 
 
 def make_description_document(params, request_url):
@@ -14,15 +113,16 @@ def make_description_document(params, request_url):
 
     osdd_dict = {}
     osdd_dict["namespaces"] = {
-        "xmlns:{0}".format(key): value for key, value in NAMESPACES.items()
+        "xmlns:{0}".format(key): value
+        for key, value in get_registry().namespaces.items()
     }
-    osdd_dict["short_name"] = SHORT_NAME
+    osdd_dict["short_name"] = settings.short_name
     osdd_dict["description"] = make_osdd_description(document_type)
     osdd_dict["tags"] = make_osdd_tags()
     osdd_dict["syndication"] = make_syndication()
     osdd_dict["self_url"] = request_url
     osdd_dict["search_rel"] = make_search_rel(document_type)
-    osdd_dict["search_url"] = make_search_template(document_type)
+    osdd_dict["search_urls"] = make_search_urls(document_type)
     osdd_dict["parameters"] = make_parameters(document_type)
 
     return render("opensearch/description_document.xml", extra_vars=osdd_dict)
@@ -33,7 +133,7 @@ def get_document_type_or_abort(params):
     document_type = params.get("osdd")
 
     try:
-        PARAMETERS[document_type]
+        get_registry().get_parameters(document_type)
     except KeyError:
         abort(400, "Invalid osdd name (osdd={})".format(document_type))
 
@@ -77,6 +177,23 @@ def make_search_rel(document_type):
         return "results"
 
 
+def make_search_urls(document_type):
+    """Return the type and template of each search results format."""
+    template = make_search_template(document_type)
+
+    return [
+        {"type": "application/atom+xml", "template": template},
+        {
+            "type": "application/geo+json",
+            "template": template.replace("/search.atom?", "/search.geojson?", 1),
+        },
+        {
+            "type": "application/ld+json",
+            "template": template.replace("/search.atom?", "/search.jsonld?", 1),
+        },
+    ]
+
+
 def make_search_template(document_type):
     """Create the OpenSearch template based on the various parameters."""
     terms = []
@@ -86,7 +203,7 @@ def make_search_template(document_type):
         terms.append("productType={}".format(document_type))
         skip.append('productType')
 
-    for param, details in PARAMETERS[document_type].items():
+    for param, details in get_registry().get_parameters(document_type).items():
         if param not in skip:
             name = param
             value = details["os_name"]
@@ -100,7 +217,7 @@ def make_search_template(document_type):
             terms.append(term)
     terms = "&".join(terms)
 
-    search_template = "{}/opensearch/search.atom?{}".format(SITE_URL, terms)
+    search_template = "{}/opensearch/search.atom?{}".format(settings.site_url, terms)
     return search_template
 
 
@@ -108,7 +225,7 @@ def make_parameters(document_type):
     """Convert parameters settings into a usable format for making XML."""
     param_dicts = []
 
-    for param, details in PARAMETERS[document_type].items():
+    for param, details in get_registry().get_parameters(document_type).items():
         attrs = OrderedDict()
         attrs["name"] = param
         attrs["value"] = "{%s:%s}" % (details["namespace"], details["os_name"])
@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+"""
+Contains functions for encoding search results in the GeoJSON and JSON-LD
+encodings of OpenSearch responses (OGC 17-047).
+
+The results are streamed like the Atom feeds: the feature collection's
+properties come first and each feature is encoded as it's read from the
+results, so the features of a page never exist as a single string. The
+JSON-LD encoding is the GeoJSON encoding with a context that maps its
+members to the OpenSearch, Dublin Core and GeoJSON vocabularies.
+"""
+
+from collections import OrderedDict
+import json
+
+import six
+
+from .config import load_config_file, settings
+from .fragments import BASE_URL, get_fragment
+from ckanext.opensearch import helpers
+
+CONTENT_TYPE = "application/geo+json"
+JSONLD_CONTENT_TYPE = "application/ld+json"
+
+JSONLD_CONTEXT_FILE = "ckanext.opensearch.defaults:jsonld_context.json"
+
+# The global box that the Atom feeds use for entries without a footprint.
+WORLD_GEOMETRY = (
+    '{"type":"Polygon","coordinates":'
+    "[[[-180.0,-90.0],[-180.0,90.0],[180.0,90.0],[180.0,-90.0],[-180.0,-90.0]]]}"
+)
+
+# Values that JSON has no type for, e.g., datetimes, are written as strings.
+encode = json.JSONEncoder(separators=(",", ":"), default=six.text_type).encode
+
+
+def stream_geojson(results_dict, search_type, buffer_size=16384, jsonld=False):
+    """
+    Yield a results_dict as a GeoJSON feature collection in UTF-8 chunks, or
+    as a JSON-LD document if jsonld is True.
+    """
+    if search_type == "collection":
+        make_feature = make_collection_feature
+    else:
+        make_feature = make_cached_product_feature
+
+    collection = make_feature_collection(results_dict, jsonld)
+    header = encode(collection)
+    # The features are written after the other members of the collection.
+    buffered = [header[:-1], ',"features":[']
+    buffered_size = len(header)
+    separator = ""
+
+    for entry in results_dict["results"]:
+        feature = make_feature(entry, results_dict)
+        buffered.append(separator)
+        buffered.append(feature)
+        buffered_size += len(feature)
+        separator = ","
+        if buffered_size >= buffer_size:
+            yield "".join(buffered).encode("utf-8")
+            buffered = []
+            buffered_size = 0
+
+    buffered.append("]}")
+    yield "".join(buffered).encode("utf-8")
+
+
+def make_feature_collection(results_dict, jsonld=False):
+    """Return the members of the feature collection except the features."""
+    content_type = JSONLD_CONTENT_TYPE if jsonld else CONTENT_TYPE
+    query = OrderedDict(
+        (key, value)
+        for key, value in results_dict["query_attrs"].items()
+        if key != "role"
+    )
+
+    links = OrderedDict()
+    links["alternates"] = [
+        make_link(
+            make_atom_url(results_dict["self_url"]),
+            "application/atom+xml",
+            "Atom format",
+        )
+    ]
+    links["search"] = [
+        make_link(
+            "{}/opensearch/description.xml?osdd={}".format(
+                settings.site_url, results_dict["osdd"]
+            ),
+            "application/opensearchdescription+xml",
+            "{} description document".format(results_dict["osdd"].title()),
+        )
+    ]
+    for rel, key in (
+        ("first", "first_url"),
+        ("previous", "prev_url"),
+        ("next", "next_url"),
+        ("last", "last_url"),
+    ):
+        if results_dict.get(key):
+            links[rel] = [make_link(results_dict[key], content_type, rel)]
+
+    properties = OrderedDict()
+    properties["title"] = results_dict["feed_title"]
+    properties["subtitle"] = results_dict["feed_subtitle"]
+    properties["updated"] = results_dict["feed_updated"]
+    properties["lang"] = "en"
+    properties["creator"] = results_dict["feed_generator_content"]
+    properties["links"] = links
+
+    collection = OrderedDict()
+    if jsonld:
+        collection["@context"] = make_jsonld_context_url()
+    collection["type"] = "FeatureCollection"
+    collection["id"] = results_dict["self_url"]
+    collection["totalResults"] = results_dict["count"]
+    collection["startIndex"] = results_dict["start_index"]
+    collection["itemsPerPage"] = results_dict["items_per_page"]
+    collection["queries"] = {"request": [query]}
+    collection["properties"] = properties
+
+    return collection
+
+
+def make_product_feature(entry, results_dict):
+    """
+    Return the GeoJSON of a dataset's feature.
+
+    The dataset's GeoJSON geometry is written to the feature as it is, so it
+    isn't decoded or encoded again.
+    """
+    identifier = entry.get("identifier")
+    atom_url = make_atom_url(results_dict["base_url"])
+    links = OrderedDict()
+    links["alternates"] = [
+        make_link(
+            "{}&identifier={}".format(atom_url, identifier),
+            "application/atom+xml",
+            "self",
+        )
+    ]
+    links["describedby"] = [
+        make_link(
+            "{}/dataset/{}".format(settings.site_url, entry["id"]),
+            "text/html",
+            "CKAN page of the dataset",
+        )
+    ]
+    if entry.get("collection_id"):
+        links["search"] = [
+            make_link(
+                "{}/opensearch/description.xml?osdd={}".format(
+                    settings.site_url, entry["collection_id"]
+                ),
+                "application/opensearchdescription+xml",
+            )
+        ]
+    for resource in entry.get("resources") or []:
+        link = helpers.make_entry_resource(resource)
+        rel = link.pop("rel")
+        links.setdefault(rel, []).append(link)
+
+    organization = entry.get("organization") or {}
+    properties = {
+        "title": entry.get("title"),
+        "identifier": identifier,
+        "publisher": organization.get("title") or "No publisher information provided.",
+        "published": entry.get("metadata_created"),
+        "updated": entry.get("metadata_modified"),
+        "summary": entry.get("notes") or "No summary available.",
+        "date": "{}/{}".format(
+            entry.get("StartTime") or entry.get("timerange_start"),
+            entry.get("StopTime") or entry.get("timerange_end"),
+        ),
+        "categories": [{"term": tag["name"]} for tag in entry.get("tags") or []],
+        "links": links,
+    }
+
+    collection_id = entry.get("collection_id") or ""
+    if "SENTINEL" in collection_id:
+        properties["acquisitionInformation"] = [
+            {
+                "acquisitionParameters": {
+                    "swathIdentifier": entry.get("Swath"),
+                    "orbitDirection": entry.get("OrbitDirection"),
+                    "polarisationChannels": entry.get(
+                        "TransmitterReceiverPolarisation"
+                    ),
+                }
+            }
+        ]
+    if "SENTINEL2" in collection_id:
+        properties["productInformation"] = {"cloudCover": entry.get("CloudCoverage")}
+
+    return make_feature(
+        "{}/opensearch/search.geojson?identifier={}".format(
+            settings.site_url, identifier
+        ),
+        get_geometry(entry),
+        properties,
+    )
+
+
+def make_cached_product_feature(entry, results_dict):
+    """
+    Return the GeoJSON of a dataset's feature from the entry fragment cache,
+    with links based on the Atom version of the results' base URL.
+    """
+    fragment = get_fragment(entry, "geojson", render_product_feature)
+    base_url = make_atom_url(results_dict["base_url"])
+
+    return fragment.replace(BASE_URL, encode(base_url)[1:-1])
+
+
+def render_product_feature(entry):
+    """Return the GeoJSON of a dataset's feature with the base URL placeholder."""
+    return make_product_feature(entry, {"base_url": BASE_URL})
+
+
+def make_collection_feature(entry, results_dict):
+    """Return the GeoJSON of a collection's feature."""
+    via = helpers.make_collection_via(entry)
+    links = OrderedDict()
+    links["search"] = [
+        make_link(
+            "{}/opensearch/description.xml?osdd={}".format(
+                settings.site_url, entry["id"]
+            ),
+            "application/opensearchdescription+xml",
+        )
+    ]
+    links["via"] = [make_link(via["href"], via["type"])]
+
+    properties = {
+        "title": entry["name"],
+        "identifier": entry["id"],
+        "published": entry.get("published"),
+        "updated": entry.get("updated"),
+        "summary": "{} matching products found in the {} collection.".format(
+            entry["count"], entry["name"]
+        ),
+        "content": entry.get("description") or "No description available",
+        "date": "{}/{}".format(
+            entry.get("temporal_start") or "1900-01-01T00:00:00.000Z",
+            entry.get("temporal_end") or entry.get("updated"),
+        ),
+        "links": links,
+    }
+
+    return make_feature(
+        "{}/opensearch/search.geojson?productType={}".format(
+            settings.site_url, entry["id"]
+        ),
+        make_box_geometry(entry.get("polygon")),
+        properties,
+    )
+
+
+def make_feature(feature_id, geometry, properties):
+    """Return the GeoJSON of a feature with a geometry that's already encoded."""
+    return '{{"type":"Feature","id":{},"geometry":{},"properties":{}}}'.format(
+        encode(feature_id), geometry, encode(properties)
+    )
+
+
+def make_link(href, content_type=None, title=None):
+    """Return a link object."""
+    link = {"href": href}
+    if content_type:
+        link["type"] = content_type
+    if title:
+        link["title"] = title
+
+    return link
+
+
+def get_geometry(entry):
+    """
+    Return the encoded GeoJSON geometry of an entry.
+
+    The geometry was validated when the dataset was indexed, so it's only
+    checked for being an object. If footprints are rounded or simplified, the
+    reduced geometry is used. Entries without one get the world's box.
+    """
+    if entry.get("output_geometry"):
+        return entry["output_geometry"]
+
+    spatial = (entry.get("spatial") or "").strip()
+    if spatial.startswith("{") and spatial.endswith("}"):
+        return spatial
+
+    return WORLD_GEOMETRY
+
+
+def make_box_geometry(polygon):
+    """
+    Return the encoded GeoJSON polygon of a collection's "lon lat" polygon
+    string, or the world's box if the collection has none.
+    """
+    if not polygon:
+        return WORLD_GEOMETRY
+
+    values = [float(value) for value in polygon.split()]
+    positions = [list(position) for position in zip(values[::2], values[1::2])]
+
+    return encode({"type": "Polygon", "coordinates": [positions]})
+
+
+def make_atom_url(url):
+    """Return the URL of the Atom version of a GeoJSON or JSON-LD search URL."""
+    for extension in (".geojson?", ".jsonld?"):
+        url = url.replace("/search" + extension, "/search.atom?").replace(
+            "/collection_search" + extension, "/collection_search.atom?"
+        )
+    for accept in (
+        "application/geo%2Bjson",
+        "application/geo+json",
+        "application/ld%2Bjson",
+        "application/ld+json",
+    ):
+        url = url.replace(
+            "httpAccept=" + accept, "httpAccept=application/atom%2Bxml"
+        )
+
+    return url
+
+
+def make_jsonld_context_url():
+    """Return the URL of the context of the JSON-LD search results."""
+    return "{}/opensearch/context.jsonld".format(settings.site_url)
+
+
+_jsonld_context = None
+
+
+def get_jsonld_context():
+    """Return the JSON-LD context document, which is read once."""
+    global _jsonld_context
+
+    if _jsonld_context is None:
+        with load_config_file(JSONLD_CONTEXT_FILE) as context_file:
+            _jsonld_context = context_file.read()
+
+    return _jsonld_context
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the bulk export of OpenSearch search results.
+
+An export streams every product that matches a query, either as GeoJSON
+features separated by newlines (NDJSON) or as a single Atom feed. The
+products are read from Solr in pages of ckanext.opensearch.export_page_size
+(at most ckan.search.rows_max, since a shorter page ends the export), sorted
+and filtered like cursor pages, so every page costs the same as the first one
+and only one page is held in memory at a time.
+
+Each product is written with the cursor that points after it: a "cursor"
+member of its GeoJSON feature or a custom:cursor element of its Atom entry.
+An interrupted export is resumed by repeating the request with the cursor of
+the last product that was received.
+"""
+
+from datetime import datetime
+
+from markupsafe import Markup
+from six.moves.urllib.parse import quote
+
+import ckan.model as model
+
+from . import converters
+from .config import get_export_page_size, get_registry, settings
+from .encoders import encode, make_cached_product_feature
+from .feeds import stream_template
+from .fragments import make_atom_entry
+from .instrumentation import annotate, timed, timed_iterator
+from .search import make_cursor_filter, search, translate_os_query
+
+CONTENT_TYPES = {"ndjson": "application/x-ndjson", "atom": "application/atom+xml"}
+
+EXPORT_TEMPLATE = "opensearch/export_results.xml"
+
+# The parameters of a search page that an export doesn't use.
+PAGING_PARAMS = ("rows", "page", "start_index", "cursor")
+
+
+def start_export(search_type, param_dict, request_url, context):
+    """
+    Start the export of the products matching a validated query and return
+    its results_dict. The results are an iterator that fetches the pages of
+    products from Solr while they're written.
+
+    Only the first page is fetched right away, since it also returns the
+    number of products from the query's cursor onward.
+    """
+    cursor = param_dict.get("cursor") or "*"
+    client_id = param_dict.pop("clientId", None)
+    for param in PAGING_PARAMS:
+        param_dict.pop(param, None)
+
+    page_size = get_export_page_size()
+    with timed("translate"):
+        data_dict = translate_os_query(param_dict, search_type)
+    data_dict.pop("start_index")
+    data_dict["sort"] = converters.CURSOR_SORT
+    data_dict["start"] = 0
+    data_dict["rows"] = page_size
+    annotate(fq=data_dict["fq_list"], rows=page_size, cursor=cursor, client=client_id)
+
+    first_page = search_page(data_dict, search_type, context, cursor)
+    annotate(count=first_page["count"])
+
+    osdd = param_dict.get("productType", "dataset")
+    results_dict = {
+        "count": first_page["count"],
+        "results": iter_export(
+            data_dict, search_type, context, first_page["results"]
+        ),
+        "namespaces": {
+            "xmlns:{0}".format(key): value
+            for key, value in get_registry().namespaces.items()
+        },
+        "feed_title": "{} OpenSearch Export".format(settings.short_name),
+        "feed_subtitle": "{} results for your search".format(first_page["count"]),
+        "feed_generator_attrs": {
+            "version": "0.1",
+            "uri": request_url.replace("&", "&amp;"),
+        },
+        "feed_generator_content": "{} search results".format(settings.short_name),
+        "feed_updated": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "osdd": osdd,
+        "site_url": settings.site_url,
+        "self_url": request_url,
+        "base_url": make_export_base_url(osdd),
+    }
+
+    return results_dict
+
+
+def search_page(data_dict, search_type, context, cursor):
+    """Return the page of products after a cursor."""
+    fq_list = list(data_dict["fq_list"])
+    cursor_fq = make_cursor_filter(cursor)
+    if cursor_fq:
+        fq_list.append(cursor_fq)
+
+    return search(dict(data_dict, fq_list=fq_list), search_type, context)
+
+
+def iter_export(data_dict, search_type, context, first_page):
+    """Yield the products of an export, fetching the next page when necessary."""
+    results = first_page
+    for entry in results:
+        yield entry
+
+    if len(results) < data_dict["rows"]:
+        return
+
+    # The following pages are fetched after the controller has returned and
+    # removed its database session, so the session opened here must be
+    # removed once the export is finished.
+    try:
+        while len(results) == data_dict["rows"]:
+            cursor = make_entry_cursor(results[-1])
+            results = search_page(data_dict, search_type, context, cursor)["results"]
+            for entry in results:
+                yield entry
+    finally:
+        model.Session.remove()
+
+
+def make_entry_cursor(entry):
+    """Return the cursor that points after a product."""
+    return converters.encode_cursor(entry["metadata_modified"], entry["id"])
+
+
+def make_export_base_url(osdd):
+    """
+    Return the search URL that the self links of the exported products are
+    based on.
+    """
+    base_url = "{}/opensearch/search.atom?".format(settings.site_url)
+    if osdd != "dataset":
+        base_url += "productType={}".format(quote(osdd))
+
+    return base_url
+
+
+def stream_export(results_dict, output_format):
+    """Return the export in the output format, "ndjson" or "atom", as chunks."""
+    if output_format == "ndjson":
+        return timed_iterator("render", stream_ndjson(results_dict))
+
+    template_vars = dict(results_dict, entries=make_atom_entries(results_dict))
+
+    return timed_iterator("render", stream_template(EXPORT_TEMPLATE, template_vars))
+
+
+def stream_ndjson(results_dict, buffer_size=16384):
+    """Yield the products as GeoJSON features, one per line, in UTF-8 chunks."""
+    buffered = []
+    buffered_size = 0
+
+    for entry in results_dict["results"]:
+        feature = make_cached_product_feature(entry, results_dict)
+        # The cursor is a foreign member of the feature, written first.
+        line = '{{"cursor":{},{}\n'.format(
+            encode(make_entry_cursor(entry)), feature[1:]
+        )
+        buffered.append(line)
+        buffered_size += len(line)
+        if buffered_size >= buffer_size:
+            yield "".join(buffered).encode("utf-8")
+            buffered = []
+            buffered_size = 0
+
+    if buffered:
+        yield "".join(buffered).encode("utf-8")
+
+
+def make_atom_entries(results_dict):
+    """Yield the Atom entries of the products, each with its cursor."""
+    for entry in results_dict["results"]:
+        atom_entry = make_atom_entry(entry, results_dict["base_url"])
+        cursor = Markup("<custom:cursor>{}</custom:cursor>\n  </atom:entry>").format(
+            make_entry_cursor(entry)
+        )
+        yield atom_entry.replace(Markup("</atom:entry>"), cursor, 1)
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""Contains functions for streaming OpenSearch responses."""
+
+from pylons.templating import pylons_globals
+
+from ckan.common import config
+
+
+def get_template(template_name, extra_vars):
+    """
+    Return a template and its variables, with the same globals as
+    ckan.lib.base.render.
+    """
+    template_vars = dict(extra_vars)
+    template_vars.update(pylons_globals())
+    # render() hides these from templates as well.
+    template_vars.pop("url", None)
+    template_vars.pop("config", None)
+
+    env = config["pylons.app_globals"].jinja_env
+
+    return env.get_template(template_name), template_vars
+
+
+def render_fragment(template_name, extra_vars):
+    """Render a template, e.g., a snippet of a feed, to a string."""
+    template, template_vars = get_template(template_name, extra_vars)
+
+    return template.render(**template_vars)
+
+
+def stream_template(template_name, extra_vars, buffer_size=16384):
+    """
+    Render a template incrementally and yield it as UTF-8 encoded chunks.
+
+    The template is rendered with the same globals as ckan.lib.base.render,
+    so the concatenated chunks are identical to the rendered template. Jinja
+    renders the template lazily, so a feed never exists as a single string
+    and the results can be an iterator that fetches entries on demand.
+    """
+    template, template_vars = get_template(template_name, extra_vars)
+
+    buffered = []
+    buffered_size = 0
+    for chunk in template.generate(**template_vars):
+        buffered.append(chunk)
+        buffered_size += len(chunk)
+        if buffered_size >= buffer_size:
+            yield u"".join(buffered).encode("utf-8")
+            buffered = []
+            buffered_size = 0
+
+    if buffered:
+        yield u"".join(buffered).encode("utf-8")
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the cache of rendered search result entries.
+
+Most products never change after they're harvested, so each entry is only
+rendered once per revision of its dataset and output format and the feeds are
+assembled from the cached fragments. The key includes metadata_modified, so
+an updated dataset is rendered again and its old fragments are evicted as the
+least recently used.
+
+An entry also depends on things that don't change its dataset's revision: the
+title of its organization, the settings that shape the output (coordinate
+precision, simplification, projection and search engine) and the host and
+language of the request, which links are built from. These are part of the
+key too.
+
+The base URL of an entry's self link depends on the whole request URL, so
+fragments are rendered with a placeholder in its place, which is replaced with
+the request's (escaped) base URL when the fragment is used.
+"""
+
+from collections import OrderedDict
+import threading
+
+from ckan.common import request
+from markupsafe import Markup, escape
+
+from .config import (
+    get_coordinate_precision,
+    get_entry_cache_size,
+    get_projection_enabled,
+    get_projection_extras,
+    get_search_engine,
+    get_simplify_tolerance,
+    settings,
+)
+from .feeds import render_fragment
+
+BASE_URL = "__opensearch_base_url__"
+
+ENTRY_TEMPLATE = "opensearch/snippets/search_result_entry.xml"
+
+_fragments = OrderedDict()
+_fragments_lock = threading.Lock()
+
+
+def get_request_host():
+    """
+    Return the host URL and the language of the current request, or None
+    outside of one.
+    """
+    try:
+        return request.host_url, request.environ.get("CKAN_LANG")
+    except (AttributeError, RuntimeError, TypeError):
+        return None
+
+
+def get_output_fingerprint():
+    """
+    Return the settings and the request host that rendered entries depend on
+    besides their datasets.
+    """
+    return (
+        get_request_host() or settings.site_url,
+        get_coordinate_precision(),
+        get_simplify_tolerance(),
+        get_projection_enabled(),
+        tuple(get_projection_extras()),
+        get_search_engine(),
+    )
+
+
+def get_organization_title(entry):
+    """Return the title of an entry's organization, if it has one."""
+    organization = entry.get("organization")
+    if isinstance(organization, dict):
+        return organization.get("title")
+
+    return organization
+
+
+def make_fragment_key(entry, output_format):
+    """Return the key of an entry's fragment in an output format."""
+    return (
+        entry.get("id"),
+        entry.get("metadata_modified"),
+        output_format,
+        get_organization_title(entry),
+        get_output_fingerprint(),
+    )
+
+
+def get_fragment(entry, output_format, render):
+    """
+    Return the cached fragment of an entry in an output format, rendering it
+    with render(entry) if it isn't cached.
+    """
+    max_entries = get_entry_cache_size()
+    cacheable = (
+        max_entries > 0
+        and entry.get("id") is not None
+        and entry.get("metadata_modified") is not None
+    )
+    if cacheable:
+        key = make_fragment_key(entry, output_format)
+        with _fragments_lock:
+            fragment = _fragments.pop(key, None)
+            if fragment is not None:
+                # Re-insert the fragment to mark it as the most recently used.
+                _fragments[key] = fragment
+                return fragment
+
+    fragment = render(entry)
+
+    if cacheable:
+        with _fragments_lock:
+            _fragments[key] = fragment
+            while len(_fragments) > max_entries:
+                _fragments.popitem(last=False)
+
+    return fragment
+
+
+def render_atom_entry(entry):
+    """Render the Atom entry of a dataset with the base URL placeholder."""
+    return render_fragment(
+        ENTRY_TEMPLATE,
+        {"entry": entry, "base_url": BASE_URL, "site_url": settings.site_url},
+    )
+
+
+def make_atom_entry(entry, base_url):
+    """
+    Return the Atom entry of a dataset in a feed whose links are based on
+    base_url. This is the os_render_entry template helper.
+    """
+    fragment = get_fragment(entry, "atom", render_atom_entry)
+
+    return Markup(fragment.replace(BASE_URL, escape(base_url)))
@@ -1,9 +1,20 @@
 # -*- coding: utf-8 -*-
+from collections import OrderedDict
 import json
 import ast
+import math
+import threading
+
+from shapely.geometry import mapping, shape
+
 import ckan.logic as logic
 
 from ckan.lib.helpers import get_pkg_dict_extra
+from ckanext.opensearch.config import (
+    get_coordinate_precision,
+    get_footprint_cache_size,
+    get_simplify_tolerance,
+)
 
 def make_collection_via(entry):
     """URL pointing to the source's metadata about the collection."""
@@ -42,8 +53,249 @@ def string_extras_to_extras_list(pkg_dict):
     return pkg_dict
 
 
+# The GeoRSS values of an entry that are computed once from its GeoJSON
+# geometry, either when the dataset is indexed or when the results are
+# processed.
+GEORSS_FIELDS = ["spatial_type", "georss_polygon", "georss_point", "georss_box"]
+
+# The prefix of the index fields that hold the precomputed GeoRSS values. The
+# Solr schema must store them without indexing them (see the README).
+GEORSS_INDEX_PREFIX = "opensearch_"
+
+DEFAULT_BOX = "-90.0 -180.0 90.0 180.0"
+
+
+def make_georss(spatial, precision=None, tolerance=0):
+    """
+    Return the GeoRSS values of a GeoJSON geometry string: the geometry type,
+    the coordinates of the polygon and point elements and the bounding box in
+    the 'south west north east' form of the box element.
+
+    If a precision is given, coordinates are rounded to that many decimals,
+    and if a tolerance is given, lines and polygons are simplified to it. The
+    box is always computed from the original coordinates and rounded outward,
+    so it encloses the footprint.
+
+    Returns an empty dict if the geometry can't be parsed.
+    """
+    georss = make_footprint(spatial, precision, tolerance)
+    georss.pop("geometry", None)
+
+    return georss
+
+
+def make_footprint(spatial, precision=None, tolerance=0):
+    """
+    Return the GeoRSS values of a GeoJSON geometry string, like make_georss,
+    plus the rounded and simplified GeoJSON geometry as "geometry".
+    """
+    try:
+        geometry = json.loads(spatial)
+        geometry_type = geometry.get("type")
+    except (TypeError, ValueError, AttributeError):
+        return {}
+
+    box = make_box(geometry.get("coordinates"), precision)
+    original = geometry
+    geometry = reduce_geometry(geometry, precision, tolerance)
+    coordinates = geometry.get("coordinates")
+    polygon = ""
+    point = ""
+
+    try:
+        if geometry_type == "Polygon":
+            polygon = " ".join(
+                "{} {}".format(
+                    format_coordinate(position[0], precision),
+                    format_coordinate(position[1], precision),
+                )
+                for position in coordinates[0]
+            )
+        elif geometry_type == "Point":
+            point = " ".join(format_coordinate(i, precision) for i in coordinates)
+    except (TypeError, ValueError, IndexError, KeyError):
+        # The coordinates are malformed, so the geometry is kept as it is.
+        geometry = original
+
+    return {
+        "spatial_type": geometry_type,
+        "georss_polygon": polygon,
+        "georss_point": point,
+        "georss_box": box,
+        "geometry": geometry,
+    }
+
+
+def make_box(coordinates, precision=None):
+    """Return the GeoRSS box enclosing the coordinates of a GeoJSON geometry."""
+    positions = list(iter_positions(coordinates))
+    if not positions:
+        return DEFAULT_BOX
+
+    longitudes = [position[0] for position in positions]
+    latitudes = [position[1] for position in positions]
+    box = [min(latitudes), min(longitudes), max(latitudes), max(longitudes)]
+
+    if precision is not None:
+        factor = 10 ** precision
+        box = [
+            math.floor(box[0] * factor) / factor,
+            math.floor(box[1] * factor) / factor,
+            math.ceil(box[2] * factor) / factor,
+            math.ceil(box[3] * factor) / factor,
+        ]
+
+    return " ".join(format_coordinate(value, precision) for value in box)
+
+
+def iter_positions(coordinates):
+    """
+    Yield each position of arbitrarily nested GeoJSON coordinates. Values
+    that aren't lists, e.g., strings in a malformed geometry, are skipped.
+    """
+    if not isinstance(coordinates, (list, tuple)) or not coordinates:
+        return
+    if isinstance(coordinates[0], (int, float)):
+        yield coordinates
+    else:
+        for nested in coordinates:
+            for position in iter_positions(nested):
+                yield position
+
+
+def format_coordinate(value, precision=None):
+    """
+    Format a coordinate for GeoRSS, with at most the given number of decimals
+    if there is a precision.
+    """
+    if precision is None:
+        return str(value)
+
+    formatted = "{:.{}f}".format(value, precision)
+    if "." in formatted:
+        formatted = formatted.rstrip("0").rstrip(".")
+
+    return formatted
+
+
+SIMPLIFIED_TYPES = {"LineString", "MultiLineString", "Polygon", "MultiPolygon"}
+
+
+def reduce_geometry(geometry, precision=None, tolerance=0):
+    """
+    Return a GeoJSON geometry simplified to the tolerance without changing
+    its topology and with its coordinates rounded to the precision.
+    """
+    if tolerance > 0 and geometry.get("type") in SIMPLIFIED_TYPES:
+        try:
+            simplified = shape(geometry).simplify(tolerance, preserve_topology=True)
+            if not simplified.is_empty:
+                geometry = mapping(simplified)
+        except (ValueError, TypeError, AttributeError, IndexError, KeyError):
+            pass
+
+    if precision is not None:
+        geometry = dict(
+            geometry,
+            coordinates=round_coordinates(geometry.get("coordinates"), precision),
+        )
+
+    return geometry
+
+
+def round_coordinates(coordinates, precision):
+    """
+    Round each number of arbitrarily nested GeoJSON coordinates.
+
+    Consecutive positions that become identical are merged, as long as a
+    sequence keeps enough positions for a polygon ring.
+    """
+    if isinstance(coordinates, (int, float)):
+        return round(coordinates, precision)
+    if not isinstance(coordinates, (list, tuple)):
+        # None or a malformed value, which is kept as it is.
+        return coordinates
+
+    rounded = [round_coordinates(nested, precision) for nested in coordinates]
+
+    if rounded and isinstance(rounded[0], list) and rounded[0]:
+        if isinstance(rounded[0][0], (int, float)):
+            merged = [
+                position
+                for i, position in enumerate(rounded)
+                if i == 0 or position != rounded[i - 1]
+            ]
+            if len(merged) >= 4:
+                return merged
+
+    return rounded
+
+
+# The reduced footprints of the datasets in the results, by dataset revision
+# and output settings, so each product is only simplified once.
+_footprints = OrderedDict()
+_footprints_lock = threading.Lock()
+
+
+def get_output_footprint(entry, precision, tolerance):
+    """
+    Return the GeoRSS values and the GeoJSON geometry (as "geometry") of an
+    entry's footprint, reduced to the output precision and tolerance.
+    """
+    key = (entry.get("id"), entry.get("metadata_modified"), precision, tolerance)
+
+    with _footprints_lock:
+        footprint = _footprints.pop(key, None)
+        if footprint is not None:
+            # Re-insert the footprint to mark it as the most recently used.
+            _footprints[key] = footprint
+            return footprint
+
+    footprint = make_footprint(entry["spatial"], precision, tolerance)
+    if footprint:
+        footprint["geometry"] = json.dumps(footprint["geometry"], separators=(",", ":"))
+
+    max_entries = get_footprint_cache_size()
+    if key[0] is not None and max_entries > 0:
+        with _footprints_lock:
+            _footprints[key] = footprint
+            while len(_footprints) > max_entries:
+                _footprints.popitem(last=False)
+
+    return footprint
+
+
+def add_georss(entry):
+    """
+    Add the GeoRSS values to an entry unless they were already precomputed
+    when the dataset was indexed.
+
+    If the coordinate precision or simplification are configured, the
+    precomputed values are replaced by the reduced footprint, whose GeoJSON
+    geometry is added as "output_geometry".
+    """
+    if not entry.get("spatial"):
+        return entry
+
+    precision = get_coordinate_precision()
+    tolerance = get_simplify_tolerance()
+    if precision is not None or tolerance > 0:
+        footprint = get_output_footprint(entry, precision, tolerance)
+        entry.update((key, footprint[key]) for key in GEORSS_FIELDS if key in footprint)
+        if "geometry" in footprint:
+            entry["output_geometry"] = footprint["geometry"]
+    elif "georss_box" not in entry:
+        entry.update(make_georss(entry["spatial"]))
+
+    return entry
+
+
 def spatial_type(entry):
+    if "spatial_type" in entry:
+        return entry["spatial_type"]
+
     spatial = entry['spatial'] if 'spatial' in entry else None
+    spatial_type = None
 
     if spatial is not None:
         spatial = json.loads(spatial)
@@ -52,8 +304,19 @@ def spatial_type(entry):
     return spatial_type
 
 
+def make_entry_box(entry):
+    """Define a GEORSS box element based on an entry's spatial value."""
+    if "georss_box" in entry:
+        return entry["georss_box"]
+
+    return make_georss(entry.get("spatial")).get("georss_box", DEFAULT_BOX)
+
+
 def make_entry_polygon(entry):
     """Define a GEORSS polygon element based on an entry's spatial value."""
+    if "georss_polygon" in entry:
+        return entry["georss_polygon"]
+
     #spatial = get_pkg_dict_extra(entry, "noa_expiration_date", "")
     spatial = entry['spatial'] if 'spatial' in entry else None
 
@@ -77,6 +340,9 @@ def make_entry_polygon(entry):
 
 def make_entry_point(entry):
     """Define a GEORSS polygon element based on an entry's spatial value."""
+    if "georss_point" in entry:
+        return entry["georss_point"]
+
     #spatial = get_pkg_dict_extra(entry, "noa_expiration_date", "")
     spatial = entry['spatial'] if 'spatial' in entry else None
 
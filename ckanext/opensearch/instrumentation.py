@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the timing of the stages of OpenSearch requests.
+
+The controller starts a timer for each request, which is kept for the thread
+that handles the request. The stages record their durations with timed(),
+which does nothing if there's no timer, e.g., in the worker threads of a
+batch search. The durations of the stages that ran before the response is
+sent are returned in the Server-Timing header. Once the response has been
+written, requests that took longer than the slow query threshold are logged
+to the ckanext.opensearch.slow_queries logger as a JSON object.
+"""
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import json
+import logging
+import threading
+from timeit import default_timer
+
+import six
+
+from .config import get_slow_query_threshold
+
+slow_query_log = logging.getLogger("ckanext.opensearch.slow_queries")
+
+_local = threading.local()
+
+
+class RequestTimer(object):
+    """The durations of the stages of a request and details about its query."""
+
+    def __init__(self, url):
+        self.url = url
+        self.started = default_timer()
+        self.stages = OrderedDict()
+        self.details = OrderedDict()
+        self.finished = False
+
+    def record(self, stage, duration):
+        """Add the duration of a stage, which may run more than once."""
+        self.stages[stage] = self.stages.get(stage, 0.0) + duration
+
+    def annotate(self, **details):
+        """Add details about the request to its slow query log entry."""
+        self.details.update(details)
+
+    def elapsed(self):
+        return default_timer() - self.started
+
+    def server_timing(self):
+        """Return the value of the Server-Timing header."""
+        metrics = [
+            "{};dur={:.1f}".format(stage, duration * 1000.0)
+            for stage, duration in self.stages.items()
+        ]
+        metrics.append("total;dur={:.1f}".format(self.elapsed() * 1000.0))
+
+        return ", ".join(metrics)
+
+    def finish(self):
+        """Log the request if it was slow and stop timing it."""
+        if self.finished:
+            return
+        self.finished = True
+
+        if getattr(_local, "timer", None) is self:
+            _local.timer = None
+
+        total = self.elapsed() * 1000.0
+        threshold = get_slow_query_threshold()
+        if threshold > 0 and total >= threshold:
+            entry = OrderedDict()
+            entry["url"] = self.url
+            entry["total_ms"] = round(total, 1)
+            entry["stages_ms"] = OrderedDict(
+                (stage, round(duration * 1000.0, 1))
+                for stage, duration in self.stages.items()
+            )
+            entry.update(self.details)
+            slow_query_log.warning(json.dumps(entry, default=six.text_type))
+
+
+def start_request(url):
+    """Start timing a request in the current thread and return its timer."""
+    timer = RequestTimer(url)
+    _local.timer = timer
+
+    return timer
+
+
+def get_timer():
+    """Return the timer of the current thread's request, if there is one."""
+    return getattr(_local, "timer", None)
+
+
+def record(stage, duration):
+    """Add the duration of a stage to the current request's timer."""
+    timer = get_timer()
+    if timer is not None:
+        timer.record(stage, duration)
+
+
+def annotate(**details):
+    """Add details to the current request's slow query log entry."""
+    timer = get_timer()
+    if timer is not None:
+        timer.annotate(**details)
+
+
+@contextmanager
+def timed(stage):
+    """Record the duration of the enclosed code as a stage of the request."""
+    timer = get_timer()
+    if timer is None:
+        yield
+        return
+
+    start = default_timer()
+    try:
+        yield
+    finally:
+        timer.record(stage, default_timer() - start)
+
+
+def timed_iterator(stage, chunks):
+    """
+    Return an iterator of the chunks of a streamed response that records the
+    time spent producing them as a stage of the request.
+    """
+    timer = get_timer()
+    if timer is None:
+        return chunks
+
+    return _timed_chunks(timer, stage, chunks)
+
+
+def _timed_chunks(timer, stage, chunks):
+    iterator = iter(chunks)
+    while True:
+        start = default_timer()
+        try:
+            chunk = next(iterator)
+        except StopIteration:
+            timer.record(stage, default_timer() - start)
+            return
+        timer.record(stage, default_timer() - start)
+        yield chunk
+
+
+def finish_stream(timer, chunks):
+    """Yield the chunks of a streamed response and finish its timer afterwards."""
+    try:
+        for chunk in chunks:
+            yield chunk
+    finally:
+        timer.finish()
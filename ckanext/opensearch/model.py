@@ -0,0 +1,463 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the collection summary table.
+
+Each collection has one row with its number of products, its temporal and
+spatial extents and the times it was first published and last updated. The
+rows are updated as datasets are created, updated and deleted, so collection
+searches don't have to facet over the whole index. Extents can only grow
+incrementally, so `paster opensearch rebuild-summaries` recomputes them from
+the datasets.
+
+The collection that each counted product was counted in is kept in a second
+table, so a product is only counted once, uncounted from the collection it
+was counted in and never uncounted if it wasn't counted.
+"""
+
+import ast
+from datetime import datetime
+from itertools import groupby
+import json
+import logging
+import re
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Float,
+    Integer,
+    Table,
+    UnicodeText,
+    and_,
+    func,
+    select,
+)
+from sqlalchemy.exc import IntegrityError
+
+import ckan.model as model
+from ckan.model.meta import Session, mapper, metadata
+
+from ckanext.opensearch.helpers import iter_positions
+
+log = logging.getLogger(__name__)
+
+# The extras that the summaries are computed from.
+START_KEYS = ["StartTime", "timerange_start"]
+END_KEYS = ["StopTime", "timerange_end"]
+SUMMARY_KEYS = ["collection_id", "spatial", "dataset_extra"] + START_KEYS + END_KEYS
+
+DATETIME_PATTERN = re.compile(
+    r"^(\d{4})-(\d{2})-(\d{2})(?:[T ](\d{2}):(\d{2}):(\d{2})(?:\.(\d{1,6}))?)?"
+)
+
+collection_summary_table = Table(
+    "opensearch_collection_summary",
+    metadata,
+    Column("collection_id", UnicodeText, primary_key=True),
+    Column("count", Integer, nullable=False, default=0),
+    Column("temporal_start", DateTime),
+    Column("temporal_end", DateTime),
+    Column("west", Float),
+    Column("south", Float),
+    Column("east", Float),
+    Column("north", Float),
+    Column("published", DateTime),
+    Column("updated", DateTime),
+)
+
+# The collection that each counted product is counted in.
+collection_product_table = Table(
+    "opensearch_collection_product",
+    metadata,
+    Column("package_id", UnicodeText, primary_key=True),
+    Column("collection_id", UnicodeText, nullable=False, index=True),
+)
+
+
+class CollectionSummary(object):
+    """The summary of the products in a collection."""
+
+    def __init__(self, collection_id):
+        self.collection_id = collection_id
+        self.count = 0
+        self.temporal_start = None
+        self.temporal_end = None
+        self.west = None
+        self.south = None
+        self.east = None
+        self.north = None
+        self.published = None
+        self.updated = None
+
+    def add_product(self, extent):
+        """Count a product and extend the summary by its extent."""
+        self.count += 1
+        self.temporal_start = earliest(self.temporal_start, extent["temporal_start"])
+        self.temporal_end = latest(self.temporal_end, extent["temporal_end"])
+        self.west = earliest(self.west, extent["west"])
+        self.south = earliest(self.south, extent["south"])
+        self.east = latest(self.east, extent["east"])
+        self.north = latest(self.north, extent["north"])
+        self.published = earliest(self.published, extent["published"])
+        self.updated = latest(self.updated, extent["updated"])
+
+    def as_entry(self):
+        """Return the values used by the collection search results feed."""
+        entry = {
+            "count": self.count,
+            "published": format_time(self.published),
+            "updated": format_time(self.updated),
+            "temporal_start": format_product_time(self.temporal_start),
+            "temporal_end": format_product_time(self.temporal_end),
+            "box": None,
+            "polygon": None,
+        }
+
+        if None not in (self.west, self.south, self.east, self.north):
+            entry["box"] = "{} {} {} {}".format(
+                self.south, self.west, self.north, self.east
+            )
+            # The same lon/lat order as the polygons of the products.
+            entry["polygon"] = " ".join(
+                "{} {}".format(lon, lat)
+                for lon, lat in (
+                    (self.west, self.south),
+                    (self.west, self.north),
+                    (self.east, self.north),
+                    (self.east, self.south),
+                    (self.west, self.south),
+                )
+            )
+
+        return entry
+
+
+mapper(CollectionSummary, collection_summary_table)
+
+
+def setup():
+    """Create the collection summary tables if they don't exist yet."""
+    for table in (collection_summary_table, collection_product_table):
+        if not table.exists():
+            table.create()
+            log.info("Created the OpenSearch table %s.", table.name)
+
+
+def earliest(current, value):
+    """Return the smaller of two values, ignoring missing values."""
+    if value is None:
+        return current
+    if current is None:
+        return value
+
+    return min(current, value)
+
+
+def latest(current, value):
+    """Return the larger of two values, ignoring missing values."""
+    if value is None:
+        return current
+    if current is None:
+        return value
+
+    return max(current, value)
+
+
+def parse_datetime(value):
+    """
+    Return the date and time at the start of an ISO 8601 string as a naive
+    datetime, or None if the string doesn't start with a date.
+
+    Time zones are ignored, since the products' times are in UTC.
+    """
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None)
+
+    match = DATETIME_PATTERN.match(value or "")
+    if match is None:
+        return None
+
+    parts = [int(part) if part else 0 for part in match.groups()[:6]]
+    microseconds = int((match.group(7) or "0").ljust(6, "0"))
+
+    try:
+        return datetime(*parts, microsecond=microseconds)
+    except ValueError:
+        return None
+
+
+def format_time(value):
+    """Format the time of an Atom published or updated element."""
+    if value is None:
+        return None
+
+    return value.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def format_product_time(value):
+    """Format a time with milliseconds, like the times of the products."""
+    if value is None:
+        return None
+
+    return "{}.{:03d}Z".format(
+        value.strftime("%Y-%m-%dT%H:%M:%S"), value.microsecond // 1000
+    )
+
+
+def get_product_extent(product):
+    """
+    Return the temporal and spatial extents and the publication times of a
+    product, a dict of its extras and metadata fields.
+    """
+    extent = {
+        "temporal_start": None,
+        "temporal_end": None,
+        "west": None,
+        "south": None,
+        "east": None,
+        "north": None,
+        "published": parse_datetime(product.get("metadata_created")),
+        "updated": parse_datetime(product.get("metadata_modified")),
+    }
+
+    for key in START_KEYS:
+        extent["temporal_start"] = parse_datetime(product.get(key))
+        if extent["temporal_start"] is not None:
+            break
+
+    for key in END_KEYS:
+        extent["temporal_end"] = parse_datetime(product.get(key))
+        if extent["temporal_end"] is not None:
+            break
+
+    try:
+        geometry = json.loads(product.get("spatial") or "null")
+        positions = list(iter_positions(geometry.get("coordinates")))
+        longitudes = [float(position[0]) for position in positions]
+        latitudes = [float(position[1]) for position in positions]
+    except (TypeError, ValueError, AttributeError, IndexError):
+        positions = []
+
+    if positions:
+        extent["west"] = min(longitudes)
+        extent["south"] = min(latitudes)
+        extent["east"] = max(longitudes)
+        extent["north"] = max(latitudes)
+
+    return extent
+
+
+def flatten_extras(extras):
+    """
+    Return a dict of a list of extras, including the extras that are stored
+    as a string in a dataset_extra extra.
+    """
+    flat = {}
+
+    for extra in extras:
+        if extra["key"] == "dataset_extra":
+            try:
+                flat.update(flatten_extras(ast.literal_eval(extra["value"])))
+            except (ValueError, SyntaxError, TypeError, KeyError):
+                log.warning("Could not read the dataset_extra extra.")
+        else:
+            flat[extra["key"]] = extra["value"]
+
+    return flat
+
+
+def make_product(context, pkg_dict):
+    """
+    Return the dict used to compute a product's extent from the dataset dict
+    passed to the IPackageController hooks.
+
+    The hooks run before the dataset is committed, so the times may only be
+    set on the dataset object.
+    """
+    product = dict(pkg_dict)
+    product.update(flatten_extras(pkg_dict.get("extras") or []))
+
+    package = context.get("package")
+    if package is not None:
+        product.setdefault("metadata_created", package.metadata_created)
+        product.setdefault("metadata_modified", package.metadata_modified)
+
+    now = datetime.utcnow()
+    product["metadata_created"] = product.get("metadata_created") or now
+    product["metadata_modified"] = product.get("metadata_modified") or now
+
+    return product
+
+
+def update_product(package_id, collection_id, product=None):
+    """
+    Update the summaries after a product was created, updated or deleted.
+
+    collection_id is the collection that the product should be counted in, or
+    None if it shouldn't be counted, i.e., if it's private, not active or
+    deleted. product is used to extend the collection's summary.
+
+    A product is counted when it's first counted in a collection, uncounted
+    when it's no longer counted and moved when its collection changes, by
+    comparing the collection with the one it was counted in. The summaries
+    are updated in the database, not read and written back, so concurrent
+    updates don't overwrite each other. The updates are part of the
+    transaction that saves the dataset.
+    """
+    table = collection_product_table
+    previous_id = Session.execute(
+        select([table.c.collection_id])
+        .where(table.c.package_id == package_id)
+        .with_for_update()
+    ).scalar()
+
+    if previous_id != collection_id:
+        if previous_id is not None:
+            change_count(previous_id, -1)
+        if collection_id is None:
+            Session.execute(table.delete().where(table.c.package_id == package_id))
+        elif previous_id is None:
+            insert_missing(table, package_id=package_id, collection_id=collection_id)
+        else:
+            Session.execute(
+                table.update()
+                .where(table.c.package_id == package_id)
+                .values(collection_id=collection_id)
+            )
+
+    if collection_id is not None:
+        count = 0 if previous_id == collection_id else 1
+        extend_summary(collection_id, get_product_extent(product), count)
+
+
+def extend_summary(collection_id, extent, count):
+    """
+    Extend a collection's summary by a product's extent and add count to its
+    number of products. The summary is created if it doesn't exist yet.
+    """
+    table = collection_summary_table
+    insert_missing(table, collection_id=collection_id, count=0)
+
+    # least and greatest ignore NULLs, so a new summary takes the extent.
+    Session.execute(
+        table.update()
+        .where(table.c.collection_id == collection_id)
+        .values(
+            count=table.c.count + count,
+            temporal_start=func.least(table.c.temporal_start, extent["temporal_start"]),
+            temporal_end=func.greatest(table.c.temporal_end, extent["temporal_end"]),
+            west=func.least(table.c.west, extent["west"]),
+            south=func.least(table.c.south, extent["south"]),
+            east=func.greatest(table.c.east, extent["east"]),
+            north=func.greatest(table.c.north, extent["north"]),
+            published=func.least(table.c.published, extent["published"]),
+            updated=func.greatest(table.c.updated, extent["updated"]),
+        )
+    )
+
+
+def insert_missing(table, **values):
+    """
+    Insert a row unless the table already has a row with its primary key,
+    e.g., one inserted by a concurrent transaction.
+
+    INSERT ... ON CONFLICT needs PostgreSQL 9.5, so the row is looked up
+    first and inserted in a savepoint, which is rolled back if a concurrent
+    transaction inserted the same key in the meantime.
+    """
+    key = and_(*[column == values[column.name] for column in table.primary_key])
+    exists = Session.execute(
+        select([func.count()]).select_from(table).where(key)
+    ).scalar()
+    if exists:
+        return
+
+    savepoint = Session.begin_nested()
+    try:
+        Session.execute(table.insert().values(**values))
+    except IntegrityError:
+        savepoint.rollback()
+    else:
+        savepoint.commit()
+
+
+def change_count(collection_id, count):
+    """
+    Add count to a collection's number of products, e.g., -1 for a product
+    that was removed. The extents are kept until the next rebuild.
+    """
+    table = collection_summary_table
+    Session.execute(
+        table.update()
+        .where(table.c.collection_id == collection_id)
+        .values(
+            count=func.greatest(table.c.count + count, 0), updated=datetime.utcnow()
+        )
+    )
+
+
+def get_summaries():
+    """Return the summaries of all collections by collection ID."""
+    return {
+        summary.collection_id: summary
+        for summary in Session.query(CollectionSummary)
+    }
+
+
+def rebuild_summaries(batch_size=1000):
+    """
+    Recompute the summaries of all collections and the collections that
+    the products are counted in from the public, active datasets, and replace
+    the current ones. Returns the new summaries.
+
+    Only the extras needed for the summaries are read, in batches, and the
+    collection of each product is written with its batch, so the datasets are
+    never all held in memory.
+    """
+    query = (
+        Session.query(
+            model.Package.id,
+            model.Package.metadata_created,
+            model.Package.metadata_modified,
+            model.PackageExtra.key,
+            model.PackageExtra.value,
+        )
+        .join(model.PackageExtra, model.PackageExtra.package_id == model.Package.id)
+        .filter(model.Package.state == "active")
+        .filter(model.Package.private == False)  # noqa: E712
+        .filter(model.Package.type == "dataset")
+        .filter(model.PackageExtra.state == "active")
+        .filter(model.PackageExtra.key.in_(SUMMARY_KEYS))
+        .order_by(model.Package.id)
+        .yield_per(batch_size)
+    )
+
+    Session.query(CollectionSummary).delete()
+    Session.execute(collection_product_table.delete())
+
+    summaries = {}
+    products = []
+    for package_id, rows in groupby(query, key=lambda row: row[0]):
+        rows = list(rows)
+        product = flatten_extras([{"key": row[3], "value": row[4]} for row in rows])
+        product["metadata_created"] = rows[0][1]
+        product["metadata_modified"] = rows[0][2]
+
+        collection_id = product.get("collection_id")
+        if not collection_id:
+            continue
+        if collection_id not in summaries:
+            summaries[collection_id] = CollectionSummary(collection_id)
+        summaries[collection_id].add_product(get_product_extent(product))
+        products.append({"package_id": package_id, "collection_id": collection_id})
+        if len(products) >= batch_size:
+            Session.execute(collection_product_table.insert(), products)
+            products = []
+
+    if products:
+        Session.execute(collection_product_table.insert(), products)
+    for summary in summaries.values():
+        Session.add(summary)
+    Session.commit()
+
+    return summaries
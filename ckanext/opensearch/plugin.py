@@ -1,24 +1,38 @@
 # -*- coding: utf-8 -*-
 """This module contains the OpenSearch plugin."""
 
+import ckan.model as model
 import ckan.plugins as plugins
 import ckan.plugins.toolkit as toolkit
 
-from ckanext.opensearch import helpers
+from ckanext.opensearch import fragments, helpers
+from ckanext.opensearch import config as opensearch_config
+from ckanext.opensearch import model as opensearch_model
+from ckanext.opensearch.caching import invalidate_after_commit, setup_invalidation
 
 
 class OpensearchPlugin(plugins.SingletonPlugin):
     """Plugin enabling an OpenSearch interface."""
 
     plugins.implements(plugins.IConfigurer)
+    plugins.implements(plugins.IConfigurable, inherit=True)
     plugins.implements(plugins.ITemplateHelpers, inherit=True)
     plugins.implements(plugins.IRoutes, inherit=True)
+    plugins.implements(plugins.IPackageController, inherit=True)
 
     # IConfigurer
 
     def update_config(self, config_):
         toolkit.add_template_directory(config_, "templates")
 
+    # IConfigurable
+
+    def configure(self, config_):
+        opensearch_config.start_registry_watcher()
+        setup_invalidation(model.Session)
+        if opensearch_config.get_collection_summaries_enabled():
+            opensearch_model.setup()
+
     # ITemplateHelpers
 
     def get_helpers(self):
@@ -26,7 +40,9 @@ class OpensearchPlugin(plugins.SingletonPlugin):
             "os_make_collection_via": helpers.make_collection_via,
             "os_make_entry_polygon": helpers.make_entry_polygon,
             "os_make_entry_point": helpers.make_entry_point,
+            "os_make_entry_box": helpers.make_entry_box,
             "os_make_entry_resource": helpers.make_entry_resource,
+            "os_render_entry": fragments.make_atom_entry,
             'get_extra_names': helpers.get_extra_names,
             "os_spatial_type": helpers.spatial_type,
         }
@@ -59,8 +75,179 @@ class OpensearchPlugin(plugins.SingletonPlugin):
             search_type="collection",
         )
 
+        map.connect(
+            "process_query",
+            "/opensearch/search.geojson",
+            controller=controller,
+            action="return_search_results",
+            search_type="dataset",
+            output_format="geojson",
+        )
+
+        map.connect(
+            "process_query",
+            "/opensearch/collection_search.geojson",
+            controller=controller,
+            action="return_search_results",
+            search_type="collection",
+            output_format="geojson",
+        )
+
+        map.connect(
+            "process_query",
+            "/opensearch/search.jsonld",
+            controller=controller,
+            action="return_search_results",
+            search_type="dataset",
+            output_format="jsonld",
+        )
+
+        map.connect(
+            "process_query",
+            "/opensearch/collection_search.jsonld",
+            controller=controller,
+            action="return_search_results",
+            search_type="collection",
+            output_format="jsonld",
+        )
+
+        map.connect(
+            "return_jsonld_context",
+            "/opensearch/context.jsonld",
+            controller=controller,
+            action="return_jsonld_context",
+        )
+
+        map.connect(
+            "return_export",
+            "/opensearch/export.ndjson",
+            controller=controller,
+            action="return_export",
+            output_format="ndjson",
+        )
+
+        map.connect(
+            "return_export",
+            "/opensearch/export.atom",
+            controller=controller,
+            action="return_export",
+            output_format="atom",
+        )
+
+        map.connect(
+            "return_batch_results",
+            "/opensearch/batch",
+            controller=controller,
+            action="return_batch_results",
+            conditions={"method": ["POST"]},
+        )
+
+        map.connect(
+            "return_admission_counters",
+            "/opensearch/admission",
+            controller=controller,
+            action="return_admission_counters",
+        )
+
         return map
 
+    # IPackageController
+
+    def after_create(self, context, pkg_dict):
+        self._invalidate_results(context, pkg_dict)
+        self._update_summary(context, pkg_dict)
+
+    def after_update(self, context, pkg_dict):
+        self._invalidate_results(context, pkg_dict)
+        self._update_summary(context, pkg_dict)
+
+    def after_delete(self, context, pkg_dict):
+        self._invalidate_results(context, pkg_dict)
+        self._update_summary(context, pkg_dict, deleted=True)
+
+    def before_index(self, pkg_dict):
+        """
+        Store the GeoRSS values of the dataset's footprint in the index, so
+        they don't have to be computed from the GeoJSON for every feed.
+
+        The values are only stored if ckanext.opensearch.index_georss is
+        enabled, since the fields must be stored but not indexed by Solr.
+        """
+        if not opensearch_config.get_index_georss_enabled():
+            return pkg_dict
+
+        spatial = pkg_dict.get("extras_spatial")
+        if spatial:
+            for key, value in helpers.make_georss(spatial).items():
+                pkg_dict[helpers.GEORSS_INDEX_PREFIX + key] = value
+
+        return pkg_dict
+
+    def _invalidate_results(self, context, pkg_dict):
+        """
+        Evict the cached results of the dataset's collection once the change
+        has been committed and indexed. The collection that a moved dataset
+        was in before is evicted when the change is flushed.
+        """
+        invalidate_after_commit(model.Session(), get_collection_id(context, pkg_dict))
+
+    def _update_summary(self, context, pkg_dict, deleted=False):
+        """
+        Count a dataset in its collection's summary and extend the summary by
+        the dataset's extents, or uncount it. Private datasets and drafts
+        never appear in the results, so they're uncounted like deleted ones.
+        """
+        if not opensearch_config.get_collection_summaries_enabled():
+            return
+        package_id = pkg_dict.get("id")
+        if not package_id:
+            return
+
+        collection_id = None
+        product = None
+        if not deleted and is_listed(context, pkg_dict):
+            collection_id = get_collection_id(context, pkg_dict)
+            product = opensearch_model.make_product(context, pkg_dict)
+        opensearch_model.update_product(package_id, collection_id, product)
+
+
+def is_listed(context, pkg_dict):
+    """
+    Return True if a dataset is public and active, i.e., if it appears in the
+    results.
+
+    package_update doesn't have to pass the state, so the dataset object is
+    used if there is one.
+    """
+    package = context.get("package")
+    if package is not None:
+        return not package.private and package.state == "active"
+
+    return not pkg_dict.get("private") and pkg_dict.get("state", "active") == "active"
+
+
+def get_collection_id(context, pkg_dict):
+    """
+    Return the collection ID of a dataset.
+
+    package_delete only passes the dataset's ID, so the collection has to be
+    looked up in that case.
+    """
+    collection_id = pkg_dict.get("collection_id")
+
+    if not collection_id:
+        extras = pkg_dict.get("extras") or []
+        for extra in extras:
+            if extra.get("key") == "collection_id":
+                collection_id = extra.get("value")
+
+    if not collection_id and pkg_dict.get("id") and "model" in context:
+        package = context["model"].Package.get(pkg_dict["id"])
+        if package is not None:
+            collection_id = package.extras.get("collection_id")
+
+    return collection_id or None
+
 
 class OpenSearchError(Exception):
     """Used for OpenSearch-related errors, like invalid parameters in queries."""
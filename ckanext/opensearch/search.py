@@ -8,32 +8,227 @@ from datetime import datetime
 import math
 import re
 
+from six.moves import zip_longest
 from webob.multidict import MultiDict, UnicodeMultiDict
 
-from ckan.lib.base import abort, render
+from ckan.common import config
+from ckan.lib.base import abort
+import ckan.authz as authz
+import ckan.lib.plugins as lib_plugins
+from ckan.lib.search import SearchError
+from ckan.lib.search.common import make_connection
+from ckan.lib.search.query import QUERY_FIELDS
 import ckan.logic as logic
-
-from .config import COLLECTIONS, NAMESPACES, PARAMETERS, SHORT_NAME, SITE_URL, load_settings
+import ckan.model as model
+import pysolr
+
+from .caching import (
+    get_count_cache,
+    get_result_cache,
+    make_feed_etag,
+    make_query_key,
+)
+from .config import (
+    get_collection_summaries_enabled,
+    get_conditional_get_enabled,
+    get_filter_cache_hints_enabled,
+    get_index_georss_enabled,
+    get_projection_enabled,
+    get_projection_extras,
+    get_registry,
+    get_search_engine,
+    get_stream_chunk_size,
+    settings,
+)
+from .cost import apply_cost_budget
+from .encoders import stream_geojson
+from .feeds import stream_template
+from .instrumentation import annotate, timed, timed_iterator
+from .model import get_summaries
+from .temporal import TEMPORAL_PARAMS, compile_temporal_filters
 import converters
 from plugin import OpenSearchError
-import validators
 from ckanext.opensearch import helpers
 
+# The local parameter that keeps a filter query out of Solr's filterCache.
+NO_CACHE = "{!cache=false}"
+
+
+def make_results_feed(
+    search_type, params, request_url, context, param_dict=None, output_format="atom"
+):
+    """
+    Process the query and return the ETag and the last modification of its
+    results and the results feed in the output format, "atom", "geojson" or
+    "jsonld". The feed is only rendered while it's read.
+
+    The ETag and the last modification are None if conditional requests are
+    disabled or if the results are fetched while the feed is written.
+
+    param_dict is the validated query if make_search_query has already been
+    called.
+    """
+    if param_dict is None:
+        param_dict = make_search_query(search_type, params)
+
+    results_dict = process_query(search_type, param_dict, request_url, context)
+
+    etag = None
+    last_modified = None
+    if get_conditional_get_enabled():
+        etag = make_results_etag(results_dict, search_type, request_url)
+        last_modified = get_results_last_modified(results_dict, search_type)
+
+    if output_format in ("geojson", "jsonld"):
+        feed = stream_geojson(
+            results_dict, search_type, jsonld=output_format == "jsonld"
+        )
+    else:
+        feed = make_atom_feed(results_dict, search_type)
+
+    return etag, last_modified, timed_iterator("render", feed)
 
-def make_results_feed(search_type, params, request_url, context):
-    """Process the query and return the results feed."""
+
+def make_results_etag(results_dict, search_type, request_url):
+    """
+    Return the weak ETag of a page of results, or None if its results are
+    fetched in chunks while the feed is written.
+
+    The ETag depends on the request URL, the total, the ID and
+    metadata_modified of each dataset on the page (or the values of each
+    collection) and the configuration files, so it changes when a dataset on
+    the page is added, modified or deleted, and when the total changes.
+    """
+    results = results_dict["results"]
+    if not isinstance(results, list):
+        return None
+
+    if search_type == "collection":
+        # Without the summaries, the updated times are made up by each search.
+        ignored = () if get_collection_summaries_enabled() else ("updated",)
+        entries = [
+            sorted((key, value) for key, value in entry.items() if key not in ignored)
+            for entry in results
+        ]
+    else:
+        entries = [
+            (entry.get("id"), entry.get("metadata_modified")) for entry in results
+        ]
+
+    return make_feed_etag(
+        request_url,
+        results_dict["count"],
+        entries,
+        sorted(get_registry().sources.items()),
+    )
+
+
+def get_results_last_modified(results_dict, search_type):
+    """
+    Return the newest metadata_modified of the datasets on a page of results
+    (a naive UTC datetime), or None if there is none.
+    """
+    results = results_dict["results"]
+    if search_type == "collection" or not isinstance(results, list):
+        return None
+
+    modified = [
+        parse_metadata_modified(entry.get("metadata_modified")) for entry in results
+    ]
+    modified = [value for value in modified if value is not None]
+
+    return max(modified) if modified else None
+
+
+def get_results_version(search_type, param_dict, request_url, context):
+    """
+    Return the ETag and the newest metadata_modified (a naive UTC datetime, or
+    None if nothing matches) of all the datasets matching a query.
+
+    This is a probe for conditional requests: it only asks for the number of
+    matching datasets and the metadata_modified of the most recently
+    modified one, so it's much cheaper than the search itself. A feed can
+    only change if a matching dataset was added, modified or deleted, which
+    changes one of the two. Collection searches facet over the same
+    datasets, so the probe applies to them as well.
+    """
+    query = MultiDict(
+        (param, value) for param, value in param_dict.items() if param != "clientId"
+    )
+    PARAMETERS = get_params(query, search_type)
+    data_dict = translate_os_query(query, search_type, PARAMETERS)
+    probe = {
+        "q": data_dict.get("q"),
+        "fq": data_dict["fq"],
+        "fq_list": data_dict["fq_list"],
+        "ext_bbox": data_dict.get("ext_bbox"),
+        "rows": 1,
+        "start": 0,
+        "sort": "metadata_modified desc",
+        "fl": ["metadata_modified"],
+    }
+
+    with timed("probe"):
+        if get_search_engine() == "solr":
+            results_dict = solr_search(probe, context)
+        else:
+            results_dict = logic.get_action("package_search")(context, probe)
+
+    last_modified = None
+    if results_dict["results"]:
+        last_modified = parse_metadata_modified(
+            results_dict["results"][0].get("metadata_modified")
+        )
+
+    etag = make_feed_etag(
+        "probe",
+        request_url,
+        results_dict["count"],
+        last_modified.isoformat() if last_modified else "",
+        sorted(get_registry().sources.items()),
+    )
+
+    return etag, last_modified
+
+
+def parse_metadata_modified(value):
+    """
+    Return a metadata_modified value from the index as a naive UTC datetime,
+    or None if it can't be parsed.
+    """
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None)
+    if not value:
+        return None
+
+    value = value.rstrip("Z")
+    for date_format in ("%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S"):
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            pass
+
+    return None
+
+
+def make_search_query(search_type, params):
+    """Return the validated OpenSearch parameters of a query."""
     abort_if_collection_id_invalid(params)
     abort_if_collections_not_configured(search_type)
 
-    PARAMETERS = get_params(params, search_type)
+    document_type = get_document_type(params, search_type)
+    PARAMETERS = get_registry().get_parameters(document_type)
 
-    param_dict = make_param_dict(params, search_type)
+    with timed("params"):
+        param_dict = make_param_dict(params, search_type, PARAMETERS)
 
-    validate_params(param_dict, PARAMETERS)
+    with timed("validate"):
+        validate_params(param_dict, get_registry().get_validators(document_type))
 
-    results_dict = process_query(search_type, param_dict, request_url, context)
+    with timed("cost"):
+        check_cost(search_type, param_dict)
 
-    return make_atom_feed(results_dict, search_type)
+    return param_dict
 
 
 def abort_if_collection_id_invalid(params):
@@ -47,7 +242,7 @@ def abort_if_collection_id_invalid(params):
 
     if collection_id:
         try:
-            PARAMETERS[collection_id]
+            get_registry().get_parameters(collection_id)
         except KeyError:
             abort(400, "Invalid collection_id ({})".format(collection_id))
 
@@ -57,72 +252,73 @@ def abort_if_collections_not_configured(search_type):
     Abort if no collections are configured but a user is trying to perform a
     collection search.
     """
-    if search_type == "collection" and not COLLECTIONS:
+    if search_type == "collection" and not get_registry().collections:
         abort(400, "Collection search is unavailable.")
 
 
 def get_params(params, search_type):
     """
     Get the list of parameters according to search of productType
+
+    The parameters come from the precomputed registry, so they must not be
+    modified.
     """
-    try:
-        collection_id = params.get('productType', None)
-    except:
-        collection_id = params['productType'] or None
+    return get_registry().get_parameters(get_document_type(params, search_type))
+
+
+def get_document_type(params, search_type):
+    """Return the description document whose parameters apply to a search."""
+    registry = get_registry()
+    collection_id = params.get("productType", None)
 
     if collection_id is not None:
-        params = dict(PARAMETERS["dataset"])
-        for _id, details in COLLECTIONS.items():
-            if _id == collection_id:
-                additional_parameters = details.get("additional_parameters", [])
-                for parameters_file in additional_parameters:
-                    params.update(load_settings(parameters_file))
-        return params
+        if collection_id in registry.collections:
+            return collection_id
+        return "dataset"
+    elif search_type in registry.parameters:
+        return search_type
     else:
-        if search_type == 'dataset':
-            params = dict(PARAMETERS["dataset"])
-        if search_type == 'collection':
-            params = dict(PARAMETERS["collection"])
+        return "dataset"
 
-        return params
 
+def validate_params(submitted_params, param_validators):
+    """
+    Validate each submitted parameter and raise an exception if one is invalid.
 
-def validate_params(submitted_params, expected_params):
-    """Validate each submitted parameter and raise an exception if one is invalid."""
+    param_validators are the compiled validators of the search's parameters.
+    """
     try:
         param_counts = {}
         for param_name, _ in submitted_params.items():
-            if param_name not in param_counts:
-                param_counts[param_name] = 1
-            else:
-                param_counts[param_name] += 1
+            param_counts[param_name] = param_counts.get(param_name, 0) + 1
 
         for param_name, param_value in submitted_params.items():
-            param_config = expected_params[param_name]
-            display_name = "{}:{}".format(
-                param_config["namespace"], param_config["os_name"]
-            )
-            min_occurances = param_config.get("minimum", 0)
-            max_occurances = param_config.get("maximum", "*")
-            value_min_inclusive = param_config.get("min_inclusive", None)
-            value_max_exclusive = param_config.get("max_exclusive", None)
-            additional_validators = param_config.get("validators", [])
-
-            # Base validators for all parameters
-            validators.valid_occurances(
-                param_counts[param_name], min_occurances, max_occurances, display_name
-            )
-            validators.valid_value_min_max(
-                param_value, value_min_inclusive, value_max_exclusive, display_name
-            )
+            param_validators[param_name](param_value, param_counts[param_name])
+
+    except OpenSearchError as e:
+        abort(400, str(e))
 
-            # Additional validators from the parameter config
-            for validator in additional_validators:
-                getattr(validators, validator)(param_value, display_name)
 
+def check_cost(search_type, param_dict):
+    """
+    Check a validated query against the cost budget, degrading it in place if
+    that's configured, and abort if it's too expensive.
+    """
+    rows = set_rows(param_dict.get("rows"))
+    if param_dict.get("cursor"):
+        offset = 0
+    else:
+        start_index = set_search_index(param_dict.get("start_index"))
+        offset = set_start(rows, start_index, param_dict.get("page"))
+
+    try:
+        degraded = apply_cost_budget(search_type, param_dict, rows, offset)
     except OpenSearchError as e:
         abort(400, str(e))
 
+    if degraded:
+        annotate(degraded=degraded)
+
 
 def process_query(search_type, param_dict, request_url, context):
     """
@@ -133,13 +329,42 @@ def process_query(search_type, param_dict, request_url, context):
     # Translate the query parameters into a CKAN data_dict so we
     # can query the DB.
     client_id = param_dict.pop('clientId', None)
-    data_dict = translate_os_query(param_dict, search_type)
+    PARAMETERS = get_params(param_dict, search_type)
+    cache_key = make_query_key(search_type, param_dict)
+    with timed("translate"):
+        data_dict = translate_os_query(param_dict, search_type, PARAMETERS)
+    annotate(
+        query=cache_key,
+        fq=data_dict["fq_list"],
+        rows=data_dict["rows"],
+        client=client_id,
+    )
     start = data_dict['start_index']
     del data_dict['start_index']
 
-    results_dict = search(data_dict, search_type, context)
+    cursor = param_dict.get("cursor")
+    count_only = data_dict["rows"] == 0
+    if count_only and use_count_cache(search_type, param_dict):
+        results_dict = cached_count(
+            param_dict.get("productType"), data_dict, search_type, context
+        )
+    elif search_type == "collection" and use_collection_summaries(param_dict):
+        results_dict = summary_results_dict()
+    elif is_chunked(search_type, param_dict):
+        results_dict = search_in_chunks(
+            data_dict, search_type, context, get_stream_chunk_size()
+        )
+    else:
+        results_dict = cached_search(
+            cache_key, param_dict.get("productType"), data_dict, search_type, context
+        )
 
     results_dict["items_per_page"] = data_dict["rows"]
+    if count_only:
+        # Only the feed's header is written, even for collection searches,
+        # whose entries don't come from the rows.
+        results_dict["results"] = []
+    annotate(count=results_dict["count"])
 
     # Get next page, previous page and index of first element on page.
     current_page = int(param_dict.get("page") or 1)
@@ -148,7 +373,7 @@ def process_query(search_type, param_dict, request_url, context):
     expected_results = requested_rows * current_page
     osdd = param_dict.get('productType', 'dataset')
 
-    if expected_results >= total_results:
+    if count_only or expected_results >= total_results:
         next_page = None
     else:
         next_page = current_page + 1
@@ -158,26 +383,40 @@ def process_query(search_type, param_dict, request_url, context):
     else:
         prev_page = current_page - 1
 
-    last_page = int(math.ceil(total_results / float(requested_rows)))
+    if count_only:
+        last_page = 1
+    else:
+        last_page = int(math.ceil(total_results / float(requested_rows)))
     if last_page == 0:
         last_page = 1
     results_dict["namespaces"] = {
-        "xmlns:{0}".format(key): value for key, value in NAMESPACES.items()
+        "xmlns:{0}".format(key): value
+        for key, value in get_registry().namespaces.items()
     }
-    results_dict["feed_title"] = "{} OpenSearch Search Results".format(SHORT_NAME)
+    results_dict["feed_title"] = "{} OpenSearch Search Results".format(
+        settings.short_name
+    )
     results_dict["feed_subtitle"] = "{} results for your search".format(total_results)
     results_dict["feed_generator_attrs"] = {
         "version": "0.1",
         "uri": request_url.replace("&", "&amp;"),
     }
-    results_dict["feed_generator_content"] = "{} search results".format(SHORT_NAME)
+    results_dict["feed_generator_content"] = "{} search results".format(
+        settings.short_name
+    )
     results_dict["feed_updated"] = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
     results_dict["start_index"] = start
-    results_dict["query_attrs"] = make_query_dict(param_dict, search_type)
+    results_dict["query_attrs"] = make_query_dict(param_dict, search_type, PARAMETERS)
     results_dict["osdd"] = osdd
     results_dict["feed_box"] = make_feed_box(results_dict)
-    results_dict["site_url"] = SITE_URL
-    results_dict["search_url"] = "{}/opensearch/description.xml".format(SITE_URL)
+    results_dict["site_url"] = settings.site_url
+    results_dict["search_url"] = "{}/opensearch/description.xml".format(
+        settings.site_url
+    )
+    if param_dict.get("rows"):
+        # The page size may have been reduced by the cost budget, and the
+        # links have to use the page size of this page.
+        request_url = make_rows_url(request_url, param_dict["rows"])
     results_dict["self_url"] = request_url
     results_dict["base_url"] = make_base_url(request_url)
     results_dict["first_url"] = make_nav_url(request_url, 1)
@@ -185,17 +424,26 @@ def process_query(search_type, param_dict, request_url, context):
     results_dict["prev_url"] = make_nav_url(request_url, prev_page)
     results_dict["last_url"] = make_nav_url(request_url, last_page)
 
+    if cursor:
+        # Cursor pages can only be walked forward, one page after another.
+        next_cursor = make_next_cursor(results_dict["results"], requested_rows)
+        results_dict["first_url"] = make_cursor_url(request_url, "*")
+        results_dict["next_url"] = make_cursor_url(request_url, next_cursor)
+        results_dict["prev_url"] = None
+        results_dict["last_url"] = None
+
     return results_dict
 
 
-def make_param_dict(params, search_type):
+def make_param_dict(params, search_type, PARAMETERS=None):
     """
     Get the query parameters and remove 'amp' if it has snuck in.
     Strip any parameters that aren't valid as per CEOS-BP-009B.
     Exclude empty parameters.
     """
     param_dict = UnicodeMultiDict(MultiDict(), encoding="utf-8")
-    PARAMETERS = get_params(params, search_type)
+    if PARAMETERS is None:
+        PARAMETERS = get_params(params, search_type)
 
     for param, value in params.items():
         if param != "amp" and param in PARAMETERS and value:
@@ -204,7 +452,7 @@ def make_param_dict(params, search_type):
     return param_dict
 
 
-def translate_os_query(param_dict, search_type):
+def translate_os_query(param_dict, search_type, PARAMETERS=None):
     """
     Translate the OpenSearch query parameters based on a template.
 
@@ -236,11 +484,37 @@ def translate_os_query(param_dict, search_type):
     #     param_dict['TransmitterReceiverPolarisation'] = param_dict['polarisation']
     #     del param_dict['polarisation']
 
-    data_dict["fq"] = add_filters(param_dict, search_type)
+    # Each filter is a separate filter query, so Solr caches the documents
+    # matching each of them and reuses them for any combination of filters.
+    # package_search passes fq_list on to Solr (as of CKAN 2.7, which CI
+    # runs), and rejects parameters it doesn't know instead of dropping them.
+    data_dict["fq"] = ""
+    data_dict["fq_list"] = add_filters(param_dict, search_type, PARAMETERS)
+
+    # Cursor pages are selected by a filter on the sort values of the last
+    # result of the previous page, so Solr never has to skip any results.
+    cursor = param_dict.get("cursor")
+    if cursor:
+        data_dict["sort"] = converters.CURSOR_SORT
+        data_dict["start"] = 0
+        data_dict["start_index"] = 1
+        cursor_fq = make_cursor_filter(cursor)
+        if cursor_fq:
+            data_dict["fq_list"].append(cursor_fq)
 
     return data_dict
 
 
+def make_cursor_filter(cursor):
+    """Return the filter query of a cursor, or "" for the first page."""
+    cursor_fq = converters.cursor_filter(cursor)
+    # Every cursor is different, so caching its filter is useless.
+    if cursor_fq and get_filter_cache_hints_enabled():
+        cursor_fq = NO_CACHE + cursor_fq
+
+    return cursor_fq
+
+
 def set_rows(rows_param):
     if not rows_param:
         return 20
@@ -267,75 +541,474 @@ def set_start(rows, start_index, page_param):
         return rows * page
 
 
-def add_filters(param_dict, search_type):
+def add_filters(param_dict, search_type, PARAMETERS=None):
     """
     Some parameters map directly to filter queries; we can just append them.
+
+    Returns a list with a filter query for each parameter. If filter cache hints
+    are enabled, the filters of parameters marked with filter_cache = false,
+    whose values are rarely repeated, bypass Solr's filterCache.
     """
-    filters = ""
-    PARAMETERS = get_params(param_dict, search_type)
+    filters = []
+    cache_hints = get_filter_cache_hints_enabled()
+    if PARAMETERS is None:
+        PARAMETERS = get_params(param_dict, search_type)
 
     for (param, value) in param_dict.items():
         # TODO: the params to skip should be defined elsewhere.
-        skip = {"q", "rows", "page", "ext_bbox", "start_index", "bbox"}
+        skip = {"q", "rows", "page", "ext_bbox", "start_index", "bbox", "cursor"}
         extra_params = {"swath", "orbit_direction", "polarisation", "product_type",
                 "cloud_coverage", "family_name"}
 
-        if param not in skip:
+        if param not in skip and param not in TEMPORAL_PARAMS:
             for converter in PARAMETERS[param].get("converters", []):
                 value = getattr(converters, converter)(value)
             names = helpers.get_extra_names()
 
+            cache = PARAMETERS[param].get("filter_cache", True)
             if param in names:
                 param = names[param]
             if param == 'productType':
                 param = 'collection_id'
 
-            filters += " %s:%s" % (param, value)
+            filter_query = "%s:%s" % (param, value)
+            if cache_hints and not cache:
+                filter_query = NO_CACHE + filter_query
+            filters.append(filter_query)
 
         # if param in extra_params:
         #     os_name = PARAMETERS[search_type][param]["os_name"]
         #     filters += " %s:%s" % (os_name, value)
 
-    return filters + " +dataset_type:dataset"
+    # The time range and its relation are compiled together.
+    filters.extend(compile_temporal_filters(param_dict))
+    filters.append("+dataset_type:dataset")
+
+    return filters
+
+
+def is_chunked(search_type, param_dict):
+    """
+    Return True if the results of a query are fetched in chunks while the
+    feed is written, i.e., if the page is larger than a chunk.
+
+    A cursor page needs its last result for the next link, which comes before
+    the results in the feed, so cursor pages aren't fetched in chunks.
+    """
+    chunk_size = get_stream_chunk_size()
+
+    return (
+        search_type != "collection"
+        and not param_dict.get("cursor")
+        and 0 < chunk_size < set_rows(param_dict.get("rows"))
+    )
+
+
+def cached_search(cache_key, collection_id, data_dict, search_type, context):
+    """
+    Return the search results from the result cache or execute the search and
+    cache its results.
+
+    OpenSearch queries never include private datasets or drafts, so the
+    results don't depend on the user and can be shared between requests.
+    """
+    cache = get_result_cache()
+    results_dict = cache.get(cache_key, collection_id)
+
+    if results_dict is None:
+        # A dataset change during the search invalidates the results at once.
+        generation = cache.get_generation(collection_id)
+        results_dict = search(data_dict, search_type, context)
+        cache.set(cache_key, collection_id, results_dict, generation)
+
+    # The feed details are added to the results, so return a copy.
+    return dict(results_dict)
+
+
+# The parameters of count-only searches whose totals can be cached.
+COUNT_CACHE_PARAMS = {"rows", "productType"}
+
+
+def use_count_cache(search_type, param_dict):
+    """
+    Return True if the total of a count-only search can come from the count
+    cache, i.e., if it's enabled and the search is at most restricted to a
+    collection.
+    """
+    return (
+        search_type != "collection"
+        and get_count_cache().max_entries > 0
+        and all(param in COUNT_CACHE_PARAMS for param in param_dict)
+    )
+
+
+def cached_count(collection_id, data_dict, search_type, context):
+    """
+    Return the results of a count-only search with the total from the count
+    cache, or execute the search and cache its total.
+    """
+    cache = get_count_cache()
+    key = ("count", collection_id)
+    count = cache.get(key, None)
+
+    if count is None:
+        count = search(data_dict, search_type, context)["count"]
+        cache.set(key, None, count)
+
+    return {"count": count, "results": []}
+
+
+def search_in_chunks(data_dict, search_type, context, chunk_size):
+    """
+    Execute a search whose results are fetched from Solr in chunks as they're
+    iterated over.
+
+    Large pages are streamed instead of being held in memory, so they bypass
+    the result cache. Only the first chunk is fetched right away, since it
+    also returns the total number of results.
+    """
+    results_dict = search(dict(data_dict, rows=chunk_size), search_type, context)
+    remaining = max(results_dict["count"] - data_dict["start"], 0)
+    page_size = min(data_dict["rows"], remaining)
+    results_dict["results"] = iter_result_chunks(
+        data_dict, search_type, context, chunk_size, results_dict["results"], page_size
+    )
+
+    return results_dict
+
+
+def iter_result_chunks(
+    data_dict, search_type, context, chunk_size, first_chunk, page_size
+):
+    """Yield the results of a page, fetching the next chunk when necessary."""
+    fetched = len(first_chunk)
+    for entry in first_chunk:
+        yield entry
+
+    if fetched >= page_size:
+        return
+
+    # The rest of the page is fetched after the controller has returned and
+    # removed its database session, so the session opened here must be removed
+    # once the feed is finished.
+    try:
+        while fetched < page_size:
+            chunk_dict = dict(
+                data_dict,
+                start=data_dict["start"] + fetched,
+                rows=min(chunk_size, page_size - fetched),
+            )
+            results = search(chunk_dict, search_type, context)["results"]
+            if not results:
+                break
+            fetched += len(results)
+            for entry in results:
+                yield entry
+    finally:
+        model.Session.remove()
+
+
+# Index fields that the search results feed uses when projection is enabled.
+# Extras are requested separately as extras_{name}.
+PROJECTION_FIELDS = [
+    "id",
+    "name",
+    "title",
+    "notes",
+    "metadata_created",
+    "metadata_modified",
+    "organization",
+    "tags",
+    "res_name",
+    "res_url",
+    "res_format",
+]
 
 
 def search(data_dict, search_type, context):
     # Query the DB.
+    direct = get_search_engine() == "solr"
+    # The Solr engine never returns complete datasets.
+    projection = direct or get_projection_enabled()
+
     if search_type == "collection":
         data_dict["facet.field"] = ["collection_id"]
-
-    results_dict = logic.get_action("package_search")(context, data_dict)
+        if projection:
+            data_dict["fl"] = ["id"]
+    elif projection:
+        data_dict["fl"] = get_projection_fields()
+
+    with timed("search"):
+        if direct:
+            results_dict = solr_search(data_dict, context)
+        else:
+            results_dict = logic.get_action("package_search")(context, data_dict)
 
     if search_type == "collection":
         return collection_results_dict(results_dict)
+    elif projection:
+        return projected_results_dict(results_dict)
     else:
         return results_dict_with_accessible_extras(results_dict)
 
 
+_solr_connection = None
+
+
+def get_solr_connection():
+    """
+    Return this process's Solr connection, which keeps its HTTP connections
+    open between searches.
+    """
+    global _solr_connection
+
+    if _solr_connection is None:
+        _solr_connection = make_connection(decode_dates=False)
+
+    return _solr_connection
+
+
+def solr_search(data_dict, context):
+    """
+    Execute a search directly against the Solr index instead of through the
+    package_search action.
+
+    The OpenSearch parameters have already been validated, so this skips the
+    action's validation and the search hooks of other plugins, and it only
+    returns index fields. The filters that package_search would add (public,
+    active datasets of this site that the user is allowed to see) are added
+    here. Since ckanext-spatial's before_search hook doesn't run, bbox is
+    converted to a filter on its spatial_geom field.
+
+    Returns a dict with the same structure as the package_search results.
+    """
+    fq = [data_dict.get("fq") or ""] + list(data_dict.get("fq_list") or [])
+    fq += [
+        "+capacity:public",
+        "+state:active",
+        "+site_id:{}".format(converters.quote_solr(config.get("ckan.site_id", ""))),
+    ]
+
+    labels = get_permission_labels(context)
+    if labels is not None:
+        fq.append(
+            "+permission_labels:({})".format(
+                " OR ".join(converters.quote_solr(label) for label in labels)
+            )
+        )
+
+    bbox = data_dict.get("ext_bbox")
+    if bbox:
+        fq.append(converters.bbox_to_solr_spatial(bbox))
+
+    q = data_dict.get("q") or "*:*"
+    params = {
+        "fq": [filter_query.strip() for filter_query in fq if filter_query.strip()],
+        "fl": " ".join(data_dict.get("fl", ["id"])),
+        "rows": data_dict["rows"],
+        "start": data_dict["start"],
+        "sort": data_dict.get("sort") or "score desc, metadata_modified desc",
+        "wt": "json",
+    }
+    if ":" not in q:
+        # Free text searches use the same query parser settings as CKAN.
+        params.update(
+            {"defType": "dismax", "tie": "0.1", "mm": "2<-1 5<80%", "qf": QUERY_FIELDS}
+        )
+    if data_dict.get("facet.field"):
+        params.update(
+            {
+                "facet": "true",
+                "facet.field": data_dict["facet.field"],
+                "facet.mincount": 1,
+                "facet.limit": -1,
+            }
+        )
+
+    try:
+        solr_response = get_solr_connection().search(q, **params)
+    except pysolr.SolrError as e:
+        raise SearchError("Solr returned an error: {}".format(e))
+
+    results = []
+    for doc in solr_response.docs:
+        entry = {}
+        for key, value in doc.items():
+            if key.startswith("extras_"):
+                key = key[len("extras_"):]
+            entry[key] = value
+        results.append(entry)
+
+    facets = {}
+    facet_fields = solr_response.facets.get("facet_fields", {})
+    for field, values in facet_fields.items():
+        facets[field] = dict(zip(values[::2], values[1::2]))
+
+    return {"count": solr_response.hits, "results": results, "facets": facets}
+
+
+def get_permission_labels(context):
+    """
+    Return the permission labels of the datasets that the user can see, or None
+    if the user can see all datasets.
+    """
+    user = context.get("user")
+    if context.get("ignore_auth") or (user and authz.is_sysadmin(user)):
+        return None
+
+    return lib_plugins.get_permission_labels().get_user_dataset_labels(
+        context.get("auth_user_obj")
+    )
+
+
+def get_projection_fields():
+    """Return the index fields that are requested when projection is enabled."""
+    fields = PROJECTION_FIELDS + [
+        "extras_{}".format(name) for name in get_projection_extras()
+    ]
+    if get_index_georss_enabled():
+        fields += [helpers.GEORSS_INDEX_PREFIX + name for name in helpers.GEORSS_FIELDS]
+
+    return fields
+
+
 def collection_results_dict(results_dict):
-    """Return a new results_dict with just the collection information."""
+    """
+    Return a new results_dict with just the collection information.
+
+    The counts are the numbers of matching products. If the collection
+    summaries are enabled, the extents and times come from them.
+    """
     collection_results = []
 
-    # We don't have published/updated information for collections right now,
-    # so we have to fake it.
+    # Without the summaries, we don't have published/updated information for
+    # collections, so we have to fake it.
     published = "2018-01-16T00:00:00Z"
     updated = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
 
-    collections = results_dict["facets"].get("collection_id", {})
+    collections = get_registry().collections
+    facet_counts = results_dict["facets"].get("collection_id", {})
+    summaries = get_summaries() if get_collection_summaries_enabled() else {}
+
+    for _id, count in facet_counts.items():
+        entry = {
+            "id": _id,
+            "count": count,
+            "description": collections[_id]["description"],
+            "name": collections[_id]["name"],
+            "published": published,
+            "updated": updated,
+        }
+        if _id in summaries:
+            summary_entry = summaries[_id].as_entry()
+            summary_entry.pop("count")
+            entry.update(
+                (key, value) for key, value in summary_entry.items() if value
+            )
+        collection_results.append(entry)
+
+    return {"results": collection_results, "count": len(facet_counts)}
+
 
-    for _id, count in collections.items():
-        collection_results.append(
+# The parameters of collection searches that don't filter the collections.
+UNFILTERED_COLLECTION_PARAMS = {"rows", "page", "start_index"}
+
+
+def use_collection_summaries(param_dict):
+    """
+    Return True if a collection search can be answered from the collection
+    summaries, i.e., if they're enabled and the search isn't filtered.
+    """
+    return get_collection_summaries_enabled() and all(
+        param in UNFILTERED_COLLECTION_PARAMS for param in param_dict
+    )
+
+
+def summary_results_dict():
+    """
+    Return the results of an unfiltered collection search from the collection
+    summaries, without searching the index.
+    """
+    summaries = get_summaries()
+    collection_results = []
+
+    for _id, collection in get_registry().collections.items():
+        summary = summaries.get(_id)
+        if summary is None or summary.count < 1:
+            continue
+        entry = summary.as_entry()
+        entry.update(
             {
                 "id": _id,
-                "count": count,
-                "description": COLLECTIONS[_id]["description"],
-                "name": COLLECTIONS[_id]["name"],
-                "published": published,
-                "updated": updated,
+                "description": collection["description"],
+                "name": collection["name"],
             }
         )
+        collection_results.append(entry)
+
+    return {"results": collection_results, "count": len(collection_results)}
+
+
+def projected_results_dict(results_dict):
+    """
+    Turn the index fields returned by a projected search into entries with the
+    same structure as the datasets returned by a normal search.
+
+    The extras are already top-level keys and the precomputed GeoRSS values
+    lose the prefix of their index fields. Resource MIME types and sizes
+    aren't indexed, so resource links fall back to the default type and have
+    no length.
+    """
+    organizations = get_organization_titles(
+        set(
+            entry["organization"]
+            for entry in results_dict["results"]
+            if entry.get("organization")
+        )
+    )
+
+    for entry in results_dict["results"]:
+        organization = entry.get("organization")
+        if organization:
+            entry["organization"] = {
+                "name": organization,
+                "title": organizations.get(organization, organization),
+            }
+        entry["tags"] = [{"name": tag} for tag in entry.get("tags", [])]
+        for name in helpers.GEORSS_FIELDS:
+            indexed_name = helpers.GEORSS_INDEX_PREFIX + name
+            if indexed_name in entry:
+                entry[name] = entry.pop(indexed_name)
+        helpers.add_georss(entry)
+        entry["resources"] = [
+            {
+                "name": "Untitled" if name is None else name,
+                "url": url,
+                "format": format_,
+                "mimetype": None,
+                "size": None,
+            }
+            for name, url, format_ in zip_longest(
+                entry.pop("res_name", []),
+                entry.pop("res_url", []),
+                entry.pop("res_format", []),
+            )
+            if url
+        ]
+
+    return results_dict
+
+
+def get_organization_titles(names):
+    """Return a dict of the titles of the named organizations."""
+    if not names:
+        return {}
 
-    return {"results": collection_results, "count": len(collections)}
+    query = model.Session.query(model.Group.name, model.Group.title).filter(
+        model.Group.name.in_(list(names))
+    )
+
+    return dict(query)
 
 
 def results_dict_with_accessible_extras(results_dict):
@@ -343,11 +1016,12 @@ def results_dict_with_accessible_extras(results_dict):
     for entry in results_dict["results"]:
         extras = {extra["key"]: extra["value"] for extra in entry.pop("extras", [])}
         entry.update(extras)
+        helpers.add_georss(entry)
 
     return results_dict
 
 
-def make_query_dict(param_dict, search_type):
+def make_query_dict(param_dict, search_type, PARAMETERS=None):
     """
     Make a dict of params and values for Query element in the response.
 
@@ -358,7 +1032,8 @@ def make_query_dict(param_dict, search_type):
     """
     query_dict = OrderedDict()
 
-    PARAMETERS = get_params(param_dict, search_type)
+    if PARAMETERS is None:
+        PARAMETERS = get_params(param_dict, search_type)
 
     # XML attributes are unique per element, so parameters that occur more
     # than once in a query must be combined into a space-delimited string.
@@ -406,14 +1081,57 @@ def make_nav_url(query_url, page):
         return nav_url
 
 
+def make_next_cursor(results, rows):
+    """
+    Return the cursor of the page after the given results, or None if this is
+    the last page.
+    """
+    if not results or len(results) < rows:
+        return None
+
+    last = results[-1]
+
+    return converters.encode_cursor(last["metadata_modified"], last["id"])
+
+
+def make_cursor_url(query_url, cursor):
+    """Create a navigation URL for a cursor page."""
+    if not cursor:
+        return None
+
+    cursor_param = re.compile(r"([?&])cursor=[^&]*")
+    if cursor_param.search(query_url):
+        return cursor_param.sub(r"\1cursor={}".format(cursor), query_url, count=1)
+    elif "?" in query_url:
+        return "{}&cursor={}".format(query_url, cursor)
+    else:
+        return "{}?cursor={}".format(query_url, cursor)
+
+
+def make_rows_url(query_url, rows):
+    """Return a URL with its page size replaced."""
+    rows_param = re.compile(r"([?&])rows=[^&]*")
+    if rows_param.search(query_url):
+        return rows_param.sub(r"\1rows={}".format(rows), query_url, count=1)
+    elif "?" in query_url:
+        return "{}&rows={}".format(query_url, rows)
+    else:
+        return "{}?rows={}".format(query_url, rows)
+
+
 def make_atom_feed(results_dict, search_type):
-    """Convert the modified search results dictionary into Atom XML."""
+    """
+    Convert the modified search results dictionary into Atom XML.
+
+    Returns an iterator of UTF-8 encoded chunks that can be used as the
+    response body, so the feed is written while the entries are rendered.
+    """
     if search_type == "collection":
         template = "collection_results"
     else:
         template = "search_results"
 
-    return render("opensearch/{}.xml".format(template), extra_vars=results_dict)
+    return stream_template("opensearch/{}.xml".format(template), results_dict)
 
 
 def make_base_url(query_url):
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the compiler of temporal filters.
+
+The time:start and time:end parameters are compiled into Solr filter queries
+together with the time:relation between the query's time range and the time
+ranges of the products. The times are normalized to UTC and NOW is rounded to
+ckanext.opensearch.temporal_granularity, so repeating a query produces the
+same filter queries, which Solr can answer from its caches.
+"""
+
+from datetime import datetime, timedelta
+import re
+
+from .config import (
+    get_temporal_end_field,
+    get_temporal_granularity,
+    get_temporal_start_field,
+)
+
+RELATIONS = ("intersects", "during", "contains", "disjoint", "equals")
+# During matches the products' time ranges against time:start and time:end
+# like the original range filters did.
+DEFAULT_RELATION = "during"
+GRANULARITIES = ("SECOND", "MINUTE", "HOUR", "DAY")
+
+# The parameters compiled here instead of being converted one by one.
+START_PARAM = "timerange_start"
+END_PARAM = "timerange_end"
+RELATION_PARAM = "time_relation"
+TEMPORAL_PARAMS = {START_PARAM, END_PARAM, RELATION_PARAM}
+
+DATETIME_PATTERN = re.compile(
+    r"^(\d{4})-(\d{2})-(\d{2})"
+    r"(?:T(\d{2}):(\d{2}):(\d{2})(\.\d+)?(Z|([+-])(\d{2}):(\d{2}))?)?$"
+)
+
+
+def make_now(granularity=None):
+    """
+    Return Solr's NOW rounded up to the end of the current period of the
+    granularity, e.g., NOW/HOUR+1HOUR, or NOW if there is no granularity.
+
+    NOW is only used as an upper bound, so it's rounded up and no products
+    from the current period are missed.
+    """
+    if granularity is None:
+        granularity = get_temporal_granularity()
+    if granularity not in GRANULARITIES:
+        return "NOW"
+
+    return "NOW/{0}+1{0}".format(granularity)
+
+
+def to_solr_datetime(value):
+    """
+    Return a datetime string as a UTC datetime in the format Solr expects.
+
+    Dates without a time start at midnight, times without a time zone are in
+    UTC and times with an offset are converted to UTC. Values that don't look
+    like datetimes, like Solr's date math, are returned as they are.
+    """
+    match = DATETIME_PATTERN.match(value)
+    if match is None:
+        return value
+
+    date = "{}-{}-{}".format(*match.group(1, 2, 3))
+    if match.group(4) is None:
+        return date + "T00:00:00Z"
+
+    fraction = match.group(7) or ""
+    if match.group(9) is None:
+        hour, minute, second = match.group(4, 5, 6)
+        return "{}T{}:{}:{}{}Z".format(date, hour, minute, second, fraction)
+
+    local = datetime(*[int(part) for part in match.group(1, 2, 3, 4, 5, 6)])
+    offset = timedelta(hours=int(match.group(10)), minutes=int(match.group(11)))
+    if match.group(9) == "+":
+        utc = local - offset
+    else:
+        utc = local + offset
+
+    return "{}{}Z".format(utc.strftime("%Y-%m-%dT%H:%M:%S"), fraction)
+
+
+def make_range(field, lower, upper, exclusive_lower=False, exclusive_upper=False):
+    """Return a Solr range filter on a field."""
+    return "{}:{}{} TO {}{}".format(
+        field,
+        "{" if exclusive_lower else "[",
+        lower,
+        upper,
+        "}" if exclusive_upper else "]",
+    )
+
+
+def compile_temporal_filters(param_dict):
+    """
+    Return the filter queries of the temporal parameters of a query.
+
+    Only the given bounds are filtered on. With the query's range from start
+    to end and a product's range from its start field to its end field, the
+    relations are:
+
+    * intersects: the product starts before end and ends after start.
+    * during: the product starts and ends between start and end.
+    * contains: the product starts before start and ends after end.
+    * disjoint: the product starts after end or ends before start.
+    * equals: the product starts at start and ends at end.
+    """
+    start = param_dict.get(START_PARAM)
+    end = param_dict.get(END_PARAM)
+    if not start and not end:
+        return []
+
+    relation = param_dict.get(RELATION_PARAM) or DEFAULT_RELATION
+    start_field = get_temporal_start_field() or START_PARAM
+    end_field = get_temporal_end_field() or END_PARAM
+    start = to_solr_datetime(start) if start else None
+    end = to_solr_datetime(end) if end else None
+    filters = []
+
+    if relation == "intersects":
+        if end:
+            filters.append(make_range(start_field, "*", end))
+        if start:
+            filters.append(make_range(end_field, start, "*"))
+    elif relation == "during":
+        if start:
+            filters.append(make_range(start_field, start, end or make_now()))
+        if end:
+            filters.append(make_range(end_field, start or "*", end))
+    elif relation == "contains":
+        if start:
+            filters.append(make_range(start_field, "*", start))
+        if end:
+            filters.append(make_range(end_field, end, "*"))
+    elif relation == "disjoint":
+        clauses = []
+        if end:
+            clauses.append(make_range(start_field, end, "*", exclusive_lower=True))
+        if start:
+            clauses.append(make_range(end_field, "*", start, exclusive_upper=True))
+        filters.append("({})".format(" OR ".join(clauses)))
+    elif relation == "equals":
+        if start:
+            filters.append('{}:"{}"'.format(start_field, start))
+        if end:
+            filters.append('{}:"{}"'.format(end_field, end))
+
+    return filters
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Common helpers of the tests that send requests to the CKAN application.
+
+The test database is reset and filled with the test datasets once, when this
+module is first imported.
+"""
+
+from io import BytesIO
+import json
+import pathlib
+
+from lxml import etree
+
+import ckan.tests.helpers as helpers
+
+
+HERE = pathlib.Path(__file__).parent
+
+APP = helpers._get_test_app()
+
+# The test dataset in json/test_record.json.
+RECORD_ID = "7d3a53f5-e9ab-4b12-95bc-482cf299a165"
+RECORD_COLLECTION_ID = "SENTINEL1_L1_SLC"
+
+
+def get_xml(request_url):
+    """
+    Return a parsed description document or Atom feed.
+
+    request_url is relative, i.e.: /opensearch/search.atom
+    """
+    result = APP.get(url=request_url)
+    xml = BytesIO(result.body.encode("utf-8"))
+
+    return etree.parse(xml)
+
+
+def load_json(name):
+    """Return the parsed contents of a file in the json directory."""
+    with open(str(HERE / "json" / name), "r") as f:
+        return json.load(f)
+
+
+def setup_db():
+    """Reset the test database and add some test datasets."""
+    helpers.reset_db()
+    context = {}
+    context.setdefault("user", "test_user")
+    context.setdefault("ignore_auth", True)
+    params = load_json("test_user.json")
+    params["email"] = "test@example.com"
+    params["password"] = "testpassword"
+    helpers.call_action("user_create", context, **params)
+    helpers.call_action("organization_create", context, **load_json("test_org.json"))
+    helpers.call_action("package_create", context, **load_json("test_record.json"))
+
+
+setup_db()
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""Tests for the admission control of searches."""
+
+from nose.tools import assert_raises
+
+import ckan.tests.helpers as helpers
+
+from ckanext.opensearch.admission import (
+    Admission,
+    AdmissionError,
+    get_client_keys,
+    reset_admission,
+)
+from ckanext.opensearch.tests.common import APP
+
+
+class TestClientKey(object):
+    """Class for the identification of clients."""
+
+    def test_address(self):
+        """Check if clients without a clientId are identified by their address."""
+        environ = {"REMOTE_ADDR": "10.0.0.1", "QUERY_STRING": "rows=1"}
+        assert get_client_keys(environ) == ("client:10.0.0.1", "address:10.0.0.1")
+
+    def test_client_id(self):
+        """Check if the clientIds of an address are different clients."""
+        first = {"REMOTE_ADDR": "10.0.0.1", "QUERY_STRING": "clientId=a"}
+        second = {"REMOTE_ADDR": "10.0.0.1", "QUERY_STRING": "clientId=b"}
+        assert get_client_keys(first) == ("client:10.0.0.1 a", "address:10.0.0.1")
+        assert get_client_keys(second) == ("client:10.0.0.1 b", "address:10.0.0.1")
+
+    def test_untrusted_proxy(self):
+        """Check if X-Forwarded-For is ignored if the proxy isn't trusted."""
+        environ = {"REMOTE_ADDR": "10.0.0.1", "HTTP_X_FORWARDED_FOR": "1.2.3.4"}
+        assert get_client_keys(environ)[1] == "address:10.0.0.1"
+
+    @helpers.change_config("ckanext.opensearch.trusted_proxies", "10.0.0.1 10.0.0.2")
+    def test_trusted_proxies(self):
+        """Check if the address is the last one not added by a trusted proxy."""
+        environ = {
+            "REMOTE_ADDR": "10.0.0.1",
+            "HTTP_X_FORWARDED_FOR": "6.6.6.6, 1.2.3.4, 10.0.0.2",
+        }
+        assert get_client_keys(environ)[1] == "address:1.2.3.4"
+
+
+class TestLimits(object):
+    """Class for the limits of the admission control."""
+
+    def test_rate(self):
+        """Check if a client over its burst is rejected with a 429."""
+        admission = Admission(0.01, 2, 0, 0, 10)
+        admission.admit("a")
+        admission.admit("a")
+        with assert_raises(AdmissionError) as context:
+            admission.admit("a")
+
+        assert context.exception.status == 429
+        assert context.exception.retry_after > 0
+        admission.admit("b")
+
+    def test_several_searches(self):
+        """Check if searches admitted together are charged one by one."""
+        admission = Admission(0.01, 3, 3, 0, 10)
+        admission.admit("a", 2)
+        with assert_raises(AdmissionError):
+            admission.admit("a", 2)
+
+        admission.admit("a")
+        admission.release("a", 2)
+        assert admission.get_counters()["clients"]["a"]["active"] == 1
+
+    def test_address_cap(self):
+        """Check if the clientIds of an address have separate buckets up to its cap."""
+        admission = Admission(0.01, 1, 0, 0, 10, 2)
+        admission.admit("a 1", address="a")
+        admission.admit("a 2", address="a")
+        with assert_raises(AdmissionError):
+            admission.admit("a 1", address="a")
+        with assert_raises(AdmissionError):
+            admission.admit("a 3", address="a")
+
+        admission.admit("b 1", address="b")
+        admission.release("a 1", address="a")
+        counters = admission.get_counters()["clients"]
+        assert counters["a"]["active"] == 1
+        assert counters["a 1"]["active"] == 0
+
+    def test_client_concurrency(self):
+        """Check if a client's concurrent searches are capped until released."""
+        admission = Admission(0, 1, 1, 0, 10)
+        admission.admit("a")
+        with assert_raises(AdmissionError):
+            admission.admit("a")
+
+        admission.release("a")
+        admission.admit("a")
+
+    def test_process_concurrency(self):
+        """Check if the process rejects searches with a 503 while it's busy."""
+        admission = Admission(0, 1, 0, 1, 10)
+        admission.admit("a")
+        with assert_raises(AdmissionError) as context:
+            admission.admit("b")
+
+        assert context.exception.status == 503
+
+
+class TestAdmission(object):
+    """Class for the admission control of search requests."""
+
+    def setup(self):
+        reset_admission()
+
+    def teardown(self):
+        reset_admission()
+
+    @helpers.change_config("ckanext.opensearch.client_rate", "0.01")
+    @helpers.change_config("ckanext.opensearch.client_burst", "1")
+    def test_rate_limit(self):
+        """Check if a client over its rate gets a 429 with a Retry-After header."""
+        APP.get(url="/opensearch/search.atom?rows=1")
+        result = APP.get(url="/opensearch/search.atom?rows=1", status=429)
+        assert int(result.headers["Retry-After"]) > 0
+
+    @helpers.change_config("ckanext.opensearch.client_rate", "0.01")
+    @helpers.change_config("ckanext.opensearch.client_burst", "1")
+    @helpers.change_config("ckanext.opensearch.address_clients", "2")
+    def test_client_ids(self):
+        """Check if the clientIds of an address share its limits."""
+        url = "/opensearch/search.atom?rows=1&clientId={}"
+        APP.get(url=url.format("first"))
+        APP.get(url=url.format("second"))
+        APP.get(url=url.format("first"), status=429)
+        APP.get(url=url.format("third"), status=429)
+
+    def test_counters_require_sysadmin(self):
+        """Check if the admission counters are hidden from other users."""
+        APP.get(url="/opensearch/admission", status=403)
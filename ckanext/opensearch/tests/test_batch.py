@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""Tests for batch searches."""
+
+import json
+
+import ckan.tests.helpers as helpers
+
+from ckanext.opensearch.admission import reset_admission
+from ckanext.opensearch.tests.common import APP
+
+
+class TestBatchSearch(object):
+    """Class for batch searches."""
+
+    def test_batch(self):
+        """Check if a batch returns a feature collection per query."""
+        queries = [{"rows": "1"}, {"rows": 2}, {"searchType": "collection"}]
+        result = APP.post(
+            "/opensearch/batch", json.dumps(queries), content_type="application/json"
+        )
+        results = json.loads(result.body)["results"]
+        assert len(results) == len(queries)
+        assert results[0]["itemsPerPage"] == 1
+        assert results[1]["itemsPerPage"] == 2
+        for collection in results:
+            assert collection["type"] == "FeatureCollection"
+
+    def test_invalid_query(self):
+        """Check if an invalid query rejects the whole batch."""
+        queries = [{"rows": "1"}, {"rows": "many"}]
+        APP.post(
+            "/opensearch/batch",
+            json.dumps(queries),
+            content_type="application/json",
+            status=400,
+        )
+
+    def test_too_many_queries(self):
+        """Check if a batch over the maximum number of queries is rejected."""
+        queries = [{"rows": "1"}] * 3
+        with helpers.changed_config("ckanext.opensearch.batch_max_queries", "2"):
+            APP.post(
+                "/opensearch/batch",
+                json.dumps(queries),
+                content_type="application/json",
+                status=400,
+            )
+
+    @helpers.change_config("ckanext.opensearch.client_rate", "0.01")
+    @helpers.change_config("ckanext.opensearch.client_burst", "3")
+    def test_admission(self):
+        """Check if each query of a batch is charged to the client's rate."""
+        reset_admission()
+        try:
+            body = json.dumps([{"rows": "1"}] * 2)
+            APP.post("/opensearch/batch", body, content_type="application/json")
+            result = APP.post(
+                "/opensearch/batch", body, content_type="application/json", status=429
+            )
+            assert int(result.headers["Retry-After"]) > 0
+        finally:
+            reset_admission()
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""Tests for the result cache and its invalidation."""
+
+from nose.plugins.skip import SkipTest
+
+import ckan.model as model
+import ckan.tests.helpers as helpers
+
+from ckanext.opensearch import caching
+from ckanext.opensearch.caching import Generations, ResultCache
+from ckanext.opensearch.tests.common import load_json
+
+
+class FakeRedis(object):
+    """The Redis commands used by the generations, kept in a dict."""
+
+    def __init__(self):
+        self.values = {}
+
+    def mget(self, keys):
+        return [self.values.get(key) for key in keys]
+
+    def incr(self, key):
+        self.values[key] = self.values.get(key, 0) + 1
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakePipeline(object):
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def incr(self, key):
+        self.commands.append(key)
+
+    def execute(self):
+        for key in self.commands:
+            self.client.incr(key)
+
+
+class BrokenRedis(object):
+    """A Redis client whose server is unavailable."""
+
+    def mget(self, keys):
+        raise caching.redis.ConnectionError("unavailable")
+
+    def pipeline(self):
+        raise caching.redis.ConnectionError("unavailable")
+
+
+class TestResultCache(object):
+    """Class for the LRU cache of search results."""
+
+    def test_lru_eviction(self):
+        """Check if the least recently used entry is evicted."""
+        cache = ResultCache(2, 60, Generations())
+        cache.set("a", None, 1)
+        cache.set("b", None, 2)
+        assert cache.get("a", None) == 1
+        cache.set("c", None, 3)
+        assert cache.get("b", None) is None
+        assert cache.get("a", None) == 1
+        assert cache.get("c", None) == 3
+
+    def test_ttl(self):
+        """Check if expired entries aren't returned."""
+        cache = ResultCache(2, -1, Generations())
+        cache.set("a", None, 1)
+        assert cache.get("a", None) is None
+
+    def test_disabled(self):
+        """Check if a cache without entries never stores anything."""
+        cache = ResultCache(0, 60, Generations())
+        cache.set("a", None, 1)
+        assert cache.get("a", None) is None
+        assert cache.get_generation(None) is None
+
+    def test_invalidate_collection(self):
+        """
+        Check if invalidating a collection evicts its results and the results
+        of unrestricted searches, but not those of other collections.
+        """
+        cache = ResultCache(10, 60, Generations())
+        cache.set("a", "A", 1)
+        cache.set("b", "B", 2)
+        cache.set("all", None, 3)
+        cache.invalidate("A")
+        assert cache.get("a", "A") is None
+        assert cache.get("b", "B") == 2
+        assert cache.get("all", None) is None
+
+    def test_invalidate_unknown_collection(self):
+        """Check if a dataset without a collection evicts every collection."""
+        cache = ResultCache(10, 60, Generations())
+        cache.set("a", "A", 1)
+        cache.invalidate(None)
+        assert cache.get("a", "A") is None
+
+    def test_invalidated_during_search(self):
+        """Check if results computed during an invalidation aren't cached."""
+        cache = ResultCache(10, 60, Generations())
+        generation = cache.get_generation("A")
+        cache.invalidate("A")
+        cache.set("a", "A", 1, generation)
+        assert cache.get("a", "A") is None
+
+
+class TestCacheStream(object):
+    """Class for caching streamed pages once they've been written."""
+
+    def test_cached(self):
+        """Check if the written page is cached with its validators."""
+        cache = ResultCache(10, 60, Generations())
+        generation = cache.get_generation("A")
+        chunks = caching.cache_stream(
+            cache, "page", "A", iter([b"a", b"b"]), generation, 'W/"etag"', None
+        )
+
+        assert b"".join(chunks) == b"ab"
+        assert cache.get("page", "A") == ('W/"etag"', None, b"ab")
+
+    def test_invalidated_while_written(self):
+        """Check if a page invalidated while it was written isn't cached."""
+        cache = ResultCache(10, 60, Generations())
+        generation = cache.get_generation("A")
+
+        def chunks():
+            yield b"a"
+            cache.invalidate("A")
+            yield b"b"
+
+        written = caching.cache_stream(cache, "page", "A", chunks(), generation)
+        assert b"".join(written) == b"ab"
+        assert cache.get("page", "A") is None
+
+
+class TestRedisGenerations(object):
+    """Class for generations shared between processes through Redis."""
+
+    def setup(self):
+        if caching.redis is None:
+            raise SkipTest("Redis isn't installed.")
+
+    def test_shared_invalidation(self):
+        """Check if an invalidation in one process evicts the other's results."""
+        client = FakeRedis()
+        web = Generations()
+        web._redis = client
+        harvester = Generations()
+        harvester._redis = client
+
+        cache = ResultCache(10, 60, web)
+        cache.set("a", "A", 1)
+        harvester.bump("A")
+        assert cache.get("a", "A") is None
+
+    def test_unavailable_redis(self):
+        """Check if the local generations are used if Redis is unavailable."""
+        generations = Generations()
+        generations._redis = BrokenRedis()
+        cache = ResultCache(10, 60, generations)
+        cache.set("a", "A", 1)
+        assert cache.get("a", "A") == 1
+        cache.invalidate("A")
+        assert cache.get("a", "A") is None
+
+
+class TestInvalidationAfterCommit(object):
+    """Class for invalidations that wait for the dataset to be committed."""
+
+    def setup(self):
+        caching.setup_invalidation(model.Session)
+
+    def test_commit(self):
+        """Check if the collection is only invalidated once it's committed."""
+        cache = caching.get_result_cache()
+        generation = cache.generations.get("A")
+        caching.invalidate_after_commit(model.Session(), "A")
+        assert cache.generations.get("A") == generation
+        model.Session.commit()
+        assert cache.generations.get("A") != generation
+
+    def test_rollback(self):
+        """Check if rolled back changes don't invalidate anything."""
+        cache = caching.get_result_cache()
+        generation = cache.generations.get("A")
+        caching.invalidate_after_commit(model.Session(), "A")
+        model.Session.rollback()
+        model.Session.commit()
+        assert cache.generations.get("A") == generation
+
+    def test_moved_dataset(self):
+        """Check if moving a dataset invalidates its previous collection too."""
+        context = {"user": "test_user", "ignore_auth": True}
+        dataset = helpers.call_action(
+            "package_create",
+            dict(context),
+            name="moved-dataset",
+            owner_org=load_json("test_org.json")["id"],
+            extras=[{"key": "collection_id", "value": "MOVED_FROM"}],
+        )
+        cache = caching.get_result_cache()
+        generation = cache.generations.get("MOVED_FROM")
+        try:
+            helpers.call_action(
+                "package_patch",
+                dict(context),
+                id=dataset["id"],
+                extras=[{"key": "collection_id", "value": "MOVED_TO"}],
+            )
+            assert cache.generations.get("MOVED_FROM") != generation
+        finally:
+            helpers.call_action("package_delete", dict(context), id=dataset["id"])
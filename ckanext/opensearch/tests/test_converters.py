@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""Tests for the conversion of OpenSearch parameters."""
+
+import base64
+import json
+
+from nose.tools import assert_raises
+from parameterized import parameterized
+
+from ckanext.opensearch import converters
+
+
+def encode(value):
+    """Return a JSON value as a cursor without padding."""
+    encoded = base64.urlsafe_b64encode(json.dumps(value).encode("utf-8"))
+
+    return encoded.decode("ascii").rstrip("=")
+
+
+class TestCursors(object):
+    """Class for the cursors of deep paging."""
+
+    def test_round_trip(self):
+        """Check if a cursor decodes to its date and ID."""
+        cursor = converters.encode_cursor("2018-03-15T10:31:35.481071", "abc")
+        assert converters.decode_cursor(cursor) == ("2018-03-15T10:31:35.481Z", "abc")
+
+    def test_round_trip_with_zone(self):
+        """Check if a cursor of a date in UTC keeps a single Z."""
+        cursor = converters.encode_cursor("2018-03-15T10:31:35Z", "abc")
+        assert converters.decode_cursor(cursor) == ("2018-03-15T10:31:35Z", "abc")
+
+    @parameterized(
+        [
+            ("not base64!",),
+            (encode([1, 2]),),
+            (encode(["2018-03-15T10:31:35Z"]),),
+            (encode(["2018-03-15T10:31:35Z", ""]),),
+            (encode(["2018-03-15T10:31:35Z", None]),),
+            (encode({"a": 1, "b": 2}),),
+            (encode("2018-03-15T10:31:35Z"),),
+        ]
+    )
+    def test_invalid_cursor(self, cursor):
+        """Check if a malformed cursor raises a ValueError."""
+        with assert_raises(ValueError):
+            converters.decode_cursor(cursor)
+
+    def test_first_page_filter(self):
+        """Check if the cursor of the first page doesn't filter anything."""
+        assert converters.cursor_filter("*") == ""
+
+    def test_filter(self):
+        """Check if a cursor filters the results after its date and ID."""
+        cursor = converters.encode_cursor("2018-03-15T10:31:35Z", "abc")
+        assert converters.cursor_filter(cursor) == (
+            '+(metadata_modified:{"2018-03-15T10:31:35Z" TO *] OR '
+            '(metadata_modified:"2018-03-15T10:31:35Z" AND id:{"abc" TO *]))'
+        )
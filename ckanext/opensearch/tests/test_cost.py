@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""Tests for the cost budget of queries."""
+
+import re
+
+from six.moves.urllib.parse import urlsplit
+
+import ckan.tests.helpers as helpers
+
+from ckanext.opensearch.tests.common import APP, RECORD_COLLECTION_ID, load_json
+
+CONTEXT = {"user": "test_user", "ignore_auth": True}
+
+
+def get_link(body, rel):
+    """Return the relative URL of a link of an Atom feed."""
+    match = re.search(r'<atom:link href="([^"]*)"[^>]* rel="{}"'.format(rel), body)
+    url = urlsplit(match.group(1).replace("&amp;", "&"))
+
+    return "{}?{}".format(url.path, url.query)
+
+
+def get_entry_ids(body):
+    """Return the IDs of the entries of an Atom feed."""
+    return re.findall(r"<dc:identifier>([^<]*)</dc:identifier>", body)
+
+
+class TestQueryCost(object):
+    """Class for the cost budget of queries."""
+
+    def setup(self):
+        self._configs = [
+            helpers.changed_config("ckanext.opensearch.query_cost_budget", "5"),
+            helpers.changed_config("ckanext.opensearch.query_cost_action", "degrade"),
+            helpers.changed_config("ckanext.opensearch.query_cost_degraded_rows", "1"),
+        ]
+        for changed_config in self._configs:
+            changed_config.__enter__()
+
+    def teardown(self):
+        for changed_config in reversed(self._configs):
+            changed_config.__exit__(None, None, None)
+
+    def test_reject(self):
+        """Check if a query over the budget is rejected."""
+        with helpers.changed_config("ckanext.opensearch.query_cost_action", "reject"):
+            APP.get(url="/opensearch/search.atom?rows=1000", status=400)
+            APP.get(url="/opensearch/search.atom?rows=10")
+
+    def test_degrade(self):
+        """Check if a first page over the budget gets the degraded page size."""
+        result = APP.get(url="/opensearch/search.atom?rows=1000&page=1")
+        assert "<opensearch:itemsPerPage>1<" in result.body
+        assert "rows=1&" in get_link(result.body, "self")
+        assert "rows=1&" in get_link(result.body, "last")
+
+    def test_reject_deep_page(self):
+        """Check if a deeper page over the budget is rejected, not degraded."""
+        APP.get(url="/opensearch/search.atom?rows=1000&page=2", status=400)
+
+    def test_paging(self):
+        """Check if the links of a degraded page lead through all the results."""
+        org = load_json("test_org.json")
+        dataset = helpers.call_action(
+            "package_create",
+            dict(CONTEXT),
+            name="cost-paging",
+            title="Cost paging",
+            owner_org=org["id"],
+            extras=[
+                {"key": "collection_id", "value": RECORD_COLLECTION_ID},
+                {"key": "identifier", "value": "COST_PAGING"},
+                {"key": "StartTime", "value": "2017-02-26T10:51:54.000Z"},
+                {"key": "StopTime", "value": "2017-02-26T10:52:21.000Z"},
+            ],
+        )
+        try:
+            url = "/opensearch/search.atom?rows=1000&page=1"
+            ids = []
+            while url:
+                result = APP.get(url=url)
+                assert "<opensearch:itemsPerPage>1<" in result.body
+                ids.extend(get_entry_ids(result.body))
+                url = None
+                if 'rel="next"' in result.body:
+                    url = get_link(result.body, "next")
+
+            assert len(ids) == 2
+            assert len(set(ids)) == 2
+        finally:
+            helpers.call_action("package_delete", dict(CONTEXT), id=dataset["id"])
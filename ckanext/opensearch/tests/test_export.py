@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""Tests for the bulk export of products."""
+
+import json
+
+from parameterized import parameterized
+
+import ckan.tests.helpers as helpers
+
+from ckanext.opensearch.tests.common import APP, RECORD_COLLECTION_ID, load_json
+
+CONTEXT = {"user": "test_user", "ignore_auth": True}
+
+
+class TestExport(object):
+    """Class for the bulk export of products."""
+
+    def test_ndjson(self):
+        """Check if every line of an NDJSON export is a feature with a cursor."""
+        result = APP.get(url="/opensearch/export.ndjson")
+        assert result.headers["Content-Type"].startswith("application/x-ndjson")
+        for line in result.body.splitlines():
+            feature = json.loads(line)
+            assert feature["type"] == "Feature"
+            assert feature["cursor"]
+
+    def test_atom(self):
+        """Check if an Atom export is a single feed without paging links."""
+        result = APP.get(url="/opensearch/export.atom")
+        assert result.body.count("<atom:feed") == 1
+        assert 'rel="next"' not in result.body
+
+    def test_resume(self):
+        """Check if an export resumed at a cursor continues after its product."""
+        lines = APP.get(url="/opensearch/export.ndjson").body.splitlines()
+        cursor = json.loads(lines[0])["cursor"]
+        result = APP.get(url="/opensearch/export.ndjson?cursor={}".format(cursor))
+        assert result.body.splitlines() == lines[1:]
+
+    @helpers.change_config("ckanext.opensearch.export_page_size", "2000")
+    @helpers.change_config("ckan.search.rows_max", "1")
+    def test_rows_max(self):
+        """Check if an export with pages above rows_max has every product."""
+        org = load_json("test_org.json")
+        dataset = helpers.call_action(
+            "package_create",
+            dict(CONTEXT),
+            name="export-rows-max",
+            title="Export rows max",
+            owner_org=org["id"],
+            extras=[
+                {"key": "collection_id", "value": RECORD_COLLECTION_ID},
+                {"key": "identifier", "value": "EXPORT_ROWS_MAX"},
+                {"key": "StartTime", "value": "2017-02-26T10:51:54.000Z"},
+                {"key": "StopTime", "value": "2017-02-26T10:52:21.000Z"},
+            ],
+        )
+        try:
+            lines = APP.get(url="/opensearch/export.ndjson").body.splitlines()
+            cursors = [json.loads(line)["cursor"] for line in lines]
+
+            assert len(cursors) == 2
+            assert len(set(cursors)) == 2
+        finally:
+            helpers.call_action("package_delete", dict(CONTEXT), id=dataset["id"])
+
+    @parameterized.expand(
+        [
+            ("not_base64", "not-a-cursor!"),
+            ("not_a_pair", "WyJhIl0"),
+            ("not_strings", "WzEsIDJd"),
+        ]
+    )
+    def test_invalid_cursor(self, _, cursor):
+        """Check if an export resumed at a malformed cursor is rejected."""
+        APP.get(url="/opensearch/export.ndjson?cursor={}".format(cursor), status=400)
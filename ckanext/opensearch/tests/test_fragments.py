@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""Tests for the cache of rendered entries."""
+
+import json
+
+import ckan.tests.helpers as helpers
+
+from ckanext.opensearch import fragments
+from ckanext.opensearch.tests.common import APP
+from ckanext.opensearch.encoders import make_cached_product_feature
+from ckanext.opensearch.fragments import (
+    BASE_URL,
+    get_fragment,
+    make_atom_entry,
+    make_fragment_key,
+)
+
+
+class CountingRenderer(object):
+    """A renderer that counts the entries it renders."""
+
+    def __init__(self):
+        self.rendered = []
+
+    def __call__(self, entry):
+        self.rendered.append(entry["id"])
+        return "fragment of {}".format(entry["id"])
+
+
+def make_entry(dataset_id="a", metadata_modified="2018-03-15T10:31:35.481071"):
+    return {"id": dataset_id, "metadata_modified": metadata_modified}
+
+
+class TestFragmentCache(object):
+    """Class for the keys and eviction of cached fragments."""
+
+    def setup(self):
+        fragments._fragments.clear()
+
+    def teardown(self):
+        fragments._fragments.clear()
+
+    def test_disabled(self):
+        """Check if every entry is rendered while the cache is disabled."""
+        render = CountingRenderer()
+        get_fragment(make_entry(), "atom", render)
+        get_fragment(make_entry(), "atom", render)
+
+        assert render.rendered == ["a", "a"]
+        assert not fragments._fragments
+
+    @helpers.change_config("ckanext.opensearch.entry_cache_size", "10")
+    def test_cached(self):
+        """Check if an entry is rendered once per revision and format."""
+        render = CountingRenderer()
+        assert get_fragment(make_entry(), "atom", render) == "fragment of a"
+        assert get_fragment(make_entry(), "atom", render) == "fragment of a"
+        assert render.rendered == ["a"]
+
+        updated = make_entry(metadata_modified="2019-01-01T00:00:00")
+        get_fragment(make_entry(), "geojson", render)
+        get_fragment(updated, "atom", render)
+        assert render.rendered == ["a", "a", "a"]
+
+    @helpers.change_config("ckanext.opensearch.entry_cache_size", "10")
+    def test_incomplete_key(self):
+        """Check if entries without an ID or revision aren't cached."""
+        render = CountingRenderer()
+        get_fragment(make_entry(metadata_modified=None), "atom", render)
+        get_fragment(make_entry(metadata_modified=None), "atom", render)
+
+        assert render.rendered == ["a", "a"]
+        assert not fragments._fragments
+
+    @helpers.change_config("ckanext.opensearch.entry_cache_size", "2")
+    def test_lru_eviction(self):
+        """Check if the least recently used fragment is evicted."""
+        render = CountingRenderer()
+        for dataset_id in ("a", "b", "a", "c"):
+            get_fragment(make_entry(dataset_id), "atom", render)
+        get_fragment(make_entry("a"), "atom", render)
+        get_fragment(make_entry("b"), "atom", render)
+
+        assert render.rendered == ["a", "b", "c", "b"]
+
+    @helpers.change_config("ckanext.opensearch.entry_cache_size", "10")
+    def test_output_settings(self):
+        """Check if an entry is rendered again when the output settings change."""
+        render = CountingRenderer()
+        get_fragment(make_entry(), "geojson", render)
+        with helpers.changed_config("ckanext.opensearch.coordinate_precision", "2"):
+            get_fragment(make_entry(), "geojson", render)
+        with helpers.changed_config("ckanext.opensearch.projection", "true"):
+            get_fragment(make_entry(), "geojson", render)
+        get_fragment(make_entry(), "geojson", render)
+
+        assert render.rendered == ["a", "a", "a"]
+
+    @helpers.change_config("ckanext.opensearch.entry_cache_size", "10")
+    def test_organization_title(self):
+        """Check if an entry is rendered again when its organization is renamed."""
+        render = CountingRenderer()
+        entry = make_entry()
+        entry["organization"] = {"title": "Old title"}
+        get_fragment(entry, "atom", render)
+        entry["organization"] = {"title": "New title"}
+        get_fragment(entry, "atom", render)
+
+        assert render.rendered == ["a", "a"]
+
+    @helpers.change_config("ckanext.opensearch.entry_cache_size", "10")
+    def test_request_host(self):
+        """Check if entries are cached separately for each request host."""
+        for host in ("a.example", "b.example", "a.example"):
+            APP.get(url="/opensearch/search.atom", extra_environ={"HTTP_HOST": host})
+
+        hosts = set(key[-1][0][0] for key in fragments._fragments)
+        assert hosts == {"http://a.example", "http://b.example"}
+
+class TestBaseURL(object):
+    """Class for the substitution of the request's base URL."""
+
+    def setup(self):
+        fragments._fragments.clear()
+
+    def teardown(self):
+        fragments._fragments.clear()
+
+    @helpers.change_config("ckanext.opensearch.entry_cache_size", "10")
+    def test_atom_entry(self):
+        """Check if a cached Atom entry gets the escaped base URL."""
+        entry = make_entry()
+        key = make_fragment_key(entry, "atom")
+        fragments._fragments[key] = (
+            '<atom:link href="{}&amp;identifier=x"/>'.format(BASE_URL)
+        )
+        atom_entry = make_atom_entry(entry, "http://x/opensearch/search.atom?a=1&b=2")
+
+        assert atom_entry == (
+            '<atom:link href="http://x/opensearch/search.atom?a=1&amp;b=2'
+            '&amp;identifier=x"/>'
+        )
+
+    @helpers.change_config("ckanext.opensearch.entry_cache_size", "10")
+    def test_geojson_feature(self):
+        """Check if a cached feature gets the encoded Atom base URL."""
+        entry = make_entry()
+        key = make_fragment_key(entry, "geojson")
+        fragments._fragments[key] = '{{"href":"{}&identifier=x"}}'.format(BASE_URL)
+        feature = make_cached_product_feature(
+            entry, {"base_url": 'http://x/opensearch/search.geojson?q="a"'}
+        )
+
+        assert json.loads(feature)["href"] == (
+            'http://x/opensearch/search.atom?q="a"&identifier=x'
+        )
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""Tests for the GeoJSON and JSON-LD encodings of search results."""
+
+import json
+
+from ckanext.opensearch.encoders import make_atom_url
+from ckanext.opensearch.tests.common import APP
+
+
+class TestGeoJSONResults(object):
+    """Class for search results in the GeoJSON format."""
+
+    def test_product_results(self):
+        """Check if dataset search returns a GeoJSON feature collection."""
+        result = APP.get(url="/opensearch/search.geojson?rows=1")
+        assert result.headers["Content-Type"].startswith("application/geo+json")
+        collection = json.loads(result.body)
+        assert collection["type"] == "FeatureCollection"
+        assert collection["itemsPerPage"] == 1
+        for feature in collection["features"]:
+            assert feature["type"] == "Feature"
+
+    def test_http_accept(self):
+        """Check if the httpAccept parameter selects the GeoJSON format."""
+        result = APP.get(
+            url="/opensearch/search.atom?rows=1&httpAccept=application/geo%2Bjson"
+        )
+        assert result.headers["Content-Type"].startswith("application/geo+json")
+        assert json.loads(result.body)["type"] == "FeatureCollection"
+
+    def test_alternate_links(self):
+        """Check if the Atom links of the features point to the Atom feed."""
+        result = APP.get(url="/opensearch/search.geojson?rows=1")
+        features = json.loads(result.body)["features"]
+        assert features
+        for feature in features:
+            for link in feature["properties"]["links"]["alternates"]:
+                assert link["type"] == "application/atom+xml"
+                assert "/opensearch/search.atom?" in link["href"]
+
+
+class TestJSONLDResults(object):
+    """Class for search results in the JSON-LD format."""
+
+    def test_product_results(self):
+        """Check if dataset search returns a feature collection with a context."""
+        result = APP.get(url="/opensearch/search.jsonld?rows=1")
+        assert result.headers["Content-Type"].startswith("application/ld+json")
+        collection = json.loads(result.body)
+        assert collection["@context"].endswith("/opensearch/context.jsonld")
+        assert collection["type"] == "FeatureCollection"
+        assert collection["features"]
+
+    def test_collection_results(self):
+        """Check if collection search returns JSON-LD."""
+        result = APP.get(url="/opensearch/collection_search.jsonld?q=*")
+        collection = json.loads(result.body)
+        assert collection["@context"]
+        assert collection["features"]
+
+    def test_http_accept(self):
+        """Check if the httpAccept parameter selects the JSON-LD format."""
+        result = APP.get(
+            url="/opensearch/search.atom?rows=1&httpAccept=application/ld%2Bjson"
+        )
+        assert result.headers["Content-Type"].startswith("application/ld+json")
+        assert "@context" in json.loads(result.body)
+
+    def test_context(self):
+        """Check if the context maps the members of the feature collections."""
+        result = APP.get(url="/opensearch/context.jsonld")
+        assert result.headers["Content-Type"].startswith("application/ld+json")
+        context = json.loads(result.body)["@context"]
+        for member in ("type", "id", "features", "totalResults", "title", "links"):
+            assert member in context
+
+
+class TestAtomURL(object):
+    """Class for the Atom versions of search URLs."""
+
+    def test_extensions(self):
+        """Check if the GeoJSON and JSON-LD endpoints are replaced."""
+        assert make_atom_url("http://x/opensearch/search.geojson?rows=1") == (
+            "http://x/opensearch/search.atom?rows=1"
+        )
+        assert make_atom_url("http://x/opensearch/collection_search.jsonld?q=*") == (
+            "http://x/opensearch/collection_search.atom?q=*"
+        )
+
+    def test_http_accept(self):
+        """Check if the httpAccept parameter asks for Atom."""
+        url = "http://x/opensearch/search.atom?httpAccept=application/ld%2Bjson"
+        assert make_atom_url(url) == (
+            "http://x/opensearch/search.atom?httpAccept=application/atom%2Bxml"
+        )
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""Tests for the footprint helpers."""
+
+import json
+
+from ckanext.opensearch.helpers import (
+    DEFAULT_BOX,
+    iter_positions,
+    make_box,
+    make_footprint,
+    make_georss,
+    reduce_geometry,
+    round_coordinates,
+)
+
+# A square with a vertex that is almost on its southern edge.
+POLYGON = {
+    "type": "Polygon",
+    "coordinates": [[[0, 0], [1, 0.0001], [2, 0], [2, 2], [0, 2], [0, 0]]],
+}
+
+
+class TestRoundCoordinates(object):
+    """Class for rounding GeoJSON coordinates."""
+
+    def test_position(self):
+        """Check if each number of a position is rounded."""
+        assert round_coordinates([1.23456, 2.34567], 2) == [1.23, 2.35]
+
+    def test_collapsed_vertices(self):
+        """Check if consecutive vertices that become identical are merged."""
+        ring = [[0, 0], [1.0001, 0], [1.0002, 0], [1, 1], [0, 1], [0, 0]]
+        assert round_coordinates([ring], 2) == [
+            [[0, 0], [1.0, 0], [1, 1], [0, 1], [0, 0]]
+        ]
+
+    def test_collapsed_ring(self):
+        """Check if vertices aren't merged if a ring would be too short."""
+        ring = [[0, 0], [0.001, 0], [0.002, 0], [0, 0]]
+        assert len(round_coordinates([ring], 1)[0]) == 4
+
+    def test_missing_coordinates(self):
+        """Check if a geometry without coordinates is left alone."""
+        assert round_coordinates(None, 2) is None
+
+
+class TestMakeBox(object):
+    """Class for the GeoRSS boxes of footprints."""
+
+    def test_box(self):
+        """Check if the box is 'south west north east'."""
+        coordinates = [[10.123, 40.987], [10.456, 41.001]]
+        assert make_box(coordinates) == "40.987 10.123 41.001 10.456"
+
+    def test_outward_rounding(self):
+        """Check if a rounded box still encloses the footprint."""
+        assert make_box([[[10.123, 40.987], [10.456, 41.001]]], 1) == (
+            "40.9 10.1 41.1 10.5"
+        )
+        assert make_box([[-0.15, -0.25], [0.15, 0.25]], 1) == "-0.3 -0.2 0.3 0.2"
+
+    def test_no_positions(self):
+        """Check if a geometry without positions gets the default box."""
+        assert make_box([]) == DEFAULT_BOX
+
+
+class TestReduceGeometry(object):
+    """Class for rounding and simplifying footprints."""
+
+    def test_unchanged(self):
+        """Check if a geometry is unchanged without precision or tolerance."""
+        assert reduce_geometry(POLYGON) == POLYGON
+
+    def test_simplify(self):
+        """Check if a polygon is simplified to the tolerance."""
+        geometry = reduce_geometry(POLYGON, 3, 0.01)
+        assert geometry["type"] == "Polygon"
+        assert geometry["coordinates"] == [
+            [[0.0, 0.0], [2.0, 0.0], [2.0, 2.0], [0.0, 2.0], [0.0, 0.0]]
+        ]
+
+    def test_point(self):
+        """Check if points are only rounded."""
+        geometry = reduce_geometry({"type": "Point", "coordinates": [1.23456, 2]}, 2, 1)
+        assert geometry["coordinates"] == [1.23, 2]
+
+    def test_georss(self):
+        """Check if the GeoRSS values use the reduced polygon and the full box."""
+        georss = make_georss(json.dumps(POLYGON), 3, 0.01)
+        assert georss["georss_polygon"] == "0 0 2 0 2 2 0 2 0 0"
+        assert georss["georss_box"] == "0 0 2 2"
+
+
+class TestMalformedGeometry(object):
+    """Class for geometries whose coordinates aren't lists of numbers."""
+
+    def test_string_coordinates(self):
+        """Check if coordinates given as a string have no positions."""
+        assert list(iter_positions("10 40 12 40")) == []
+        assert round_coordinates("10 40 12 40", 2) == "10 40 12 40"
+
+    def test_georss(self):
+        """Check if a malformed geometry gets the default box and no polygon."""
+        spatial = json.dumps({"type": "Polygon", "coordinates": "10 40 12 40"})
+        georss = make_georss(spatial, 2, 0.01)
+        assert georss["georss_polygon"] == ""
+        assert georss["georss_box"] == DEFAULT_BOX
+
+    def test_original_geometry(self):
+        """Check if a malformed geometry is returned as it was given."""
+        geometry = {"type": "Polygon", "coordinates": [[[0, 0], [1, 0], "x", [0, 0]]]}
+        footprint = make_footprint(json.dumps(geometry), 2, 0.01)
+        assert footprint["georss_polygon"] == ""
+        assert footprint["geometry"] == geometry
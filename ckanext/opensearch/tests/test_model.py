@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""Tests for the collection summaries."""
+
+import ckan.model as model
+import ckan.tests.helpers as helpers
+
+from ckanext.opensearch import model as opensearch_model
+from ckanext.opensearch.tests.common import load_json
+
+CONTEXT = {"user": "test_user", "ignore_auth": True}
+
+SPATIAL = (
+    '{"type": "Polygon", "coordinates": '
+    '[[[10, 40], [12, 40], [12, 42], [10, 42], [10, 40]]]}'
+)
+
+
+def make_dataset(name, collection_id, **kwargs):
+    """Create a dataset in a collection and return its dict."""
+    org = load_json("test_org.json")
+    data_dict = {
+        "name": name,
+        "owner_org": org["id"],
+        "extras": [
+            {"key": "collection_id", "value": collection_id},
+            {"key": "StartTime", "value": "2017-02-26T10:51:54.000Z"},
+            {"key": "StopTime", "value": "2017-02-26T10:52:21.000Z"},
+            {"key": "spatial", "value": SPATIAL},
+        ],
+    }
+    data_dict.update(kwargs)
+
+    return helpers.call_action("package_create", dict(CONTEXT), **data_dict)
+
+
+def get_counts():
+    """Return the number of products of each collection."""
+    model.Session.expire_all()
+    return {
+        collection_id: summary.count
+        for collection_id, summary in opensearch_model.get_summaries().items()
+    }
+
+
+def set_collection(dataset, collection_id):
+    """Move a dataset to another collection."""
+    extras = [
+        dict(extra, value=collection_id)
+        if extra["key"] == "collection_id"
+        else extra
+        for extra in dataset["extras"]
+    ]
+    helpers.call_action("package_patch", dict(CONTEXT), id=dataset["id"], extras=extras)
+
+
+class TestCollectionSummaries(object):
+    """Class for the counts of the collection summaries."""
+
+    @classmethod
+    def setup_class(cls):
+        opensearch_model.setup()
+
+    def setup(self):
+        self._config = helpers.changed_config(
+            "ckanext.opensearch.collection_summaries", "true"
+        )
+        self._config.__enter__()
+        self.datasets = []
+
+    def teardown(self):
+        self._config.__exit__(None, None, None)
+        for dataset in self.datasets:
+            helpers.call_action("dataset_purge", dict(CONTEXT), id=dataset["id"])
+        model.Session.execute(opensearch_model.collection_summary_table.delete())
+        model.Session.execute(opensearch_model.collection_product_table.delete())
+        model.Session.commit()
+
+    def create(self, name, collection_id="TEST_A", **kwargs):
+        dataset = make_dataset(name, collection_id, **kwargs)
+        self.datasets.append(dataset)
+        return dataset
+
+    def test_create(self):
+        """Check if a public dataset is counted with its extents."""
+        self.create("summary-create")
+        summary = opensearch_model.get_summaries()["TEST_A"]
+
+        assert summary.count == 1
+        assert summary.west == 10
+        assert summary.north == 42
+
+    def test_update(self):
+        """Check if an updated dataset isn't counted twice."""
+        dataset = self.create("summary-update")
+        helpers.call_action(
+            "package_patch", dict(CONTEXT), id=dataset["id"], title="Updated"
+        )
+
+        assert get_counts() == {"TEST_A": 1}
+
+    def test_private(self):
+        """Check if a dataset is only counted while it's public."""
+        dataset = self.create("summary-private", private=True)
+        assert get_counts().get("TEST_A", 0) == 0
+
+        helpers.call_action(
+            "package_patch", dict(CONTEXT), id=dataset["id"], private=False
+        )
+        assert get_counts() == {"TEST_A": 1}
+
+        helpers.call_action(
+            "package_patch", dict(CONTEXT), id=dataset["id"], private=True
+        )
+        assert get_counts() == {"TEST_A": 0}
+
+    def test_draft(self):
+        """Check if a draft is counted once it's active."""
+        dataset = self.create("summary-draft", state="draft")
+        assert get_counts().get("TEST_A", 0) == 0
+
+        helpers.call_action(
+            "package_patch", dict(CONTEXT), id=dataset["id"], state="active"
+        )
+        assert get_counts() == {"TEST_A": 1}
+
+    def test_move(self):
+        """Check if a dataset moved to another collection is counted there."""
+        dataset = self.create("summary-move")
+        set_collection(dataset, "TEST_B")
+
+        assert get_counts() == {"TEST_A": 0, "TEST_B": 1}
+
+    def test_delete(self):
+        """Check if a deleted dataset is uncounted."""
+        self.create("summary-kept")
+        dataset = self.create("summary-delete")
+        helpers.call_action("package_delete", dict(CONTEXT), id=dataset["id"])
+
+        assert get_counts() == {"TEST_A": 1}
+
+    def test_delete_private(self):
+        """Check if deleting a dataset that wasn't counted changes nothing."""
+        self.create("summary-public")
+        dataset = self.create("summary-deleted-private", private=True)
+        helpers.call_action("package_delete", dict(CONTEXT), id=dataset["id"])
+
+        assert get_counts() == {"TEST_A": 1}
+
+    def test_rebuild(self):
+        """Check if a rebuild counts each dataset in its collection once."""
+        dataset = self.create("summary-rebuild")
+        self.create("summary-rebuild-private", private=True)
+        opensearch_model.rebuild_summaries()
+
+        assert get_counts()["TEST_A"] == 1
+        helpers.call_action(
+            "package_patch", dict(CONTEXT), id=dataset["id"], title="Updated"
+        )
+        assert get_counts()["TEST_A"] == 1
+
+    def test_rebuild_in_batches(self):
+        """Check if a rebuild writes the products of every batch."""
+        first = self.create("summary-batch-first")
+        second = self.create("summary-batch-second")
+        third = self.create("summary-batch-third", collection_id="TEST_B")
+        opensearch_model.rebuild_summaries(batch_size=1)
+
+        counts = get_counts()
+        assert counts["TEST_A"] == 2
+        assert counts["TEST_B"] == 1
+        table = opensearch_model.collection_product_table
+        rows = model.Session.execute(
+            table.select().where(
+                table.c.package_id.in_([first["id"], second["id"], third["id"]])
+            )
+        ).fetchall()
+        assert sorted(row["collection_id"] for row in rows) == [
+            "TEST_A",
+            "TEST_A",
+            "TEST_B",
+        ]
+
+    def test_insert_missing(self):
+        """Check if inserting an existing summary leaves it unchanged."""
+        table = opensearch_model.collection_summary_table
+        opensearch_model.insert_missing(table, collection_id="TEST_C", count=3)
+        opensearch_model.insert_missing(table, collection_id="TEST_C", count=0)
+
+        assert get_counts()["TEST_C"] == 3
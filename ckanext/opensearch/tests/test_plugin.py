@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""Tests for the hooks of the OpenSearch plugin."""
+
+import json
+
+import ckan.tests.helpers as helpers
+
+from ckanext.opensearch.plugin import OpensearchPlugin
+from ckanext.opensearch.search import get_projection_fields, projected_results_dict
+
+SPATIAL = json.dumps(
+    {"type": "Polygon", "coordinates": [[[1, 2], [3, 2], [3, 4], [1, 4], [1, 2]]]}
+)
+
+GEORSS_INDEX_FIELDS = [
+    "opensearch_spatial_type",
+    "opensearch_georss_polygon",
+    "opensearch_georss_point",
+    "opensearch_georss_box",
+]
+
+
+class TestBeforeIndex(object):
+    """Class for the GeoRSS values stored in the index."""
+
+    def test_disabled(self):
+        """Check if the index is unchanged by default."""
+        pkg_dict = OpensearchPlugin().before_index({"extras_spatial": SPATIAL})
+
+        assert pkg_dict == {"extras_spatial": SPATIAL}
+        for field in GEORSS_INDEX_FIELDS:
+            assert field not in get_projection_fields()
+
+    @helpers.change_config("ckanext.opensearch.index_georss", "true")
+    def test_enabled(self):
+        """Check if the values are stored in their own fields, not as extras."""
+        pkg_dict = OpensearchPlugin().before_index({"extras_spatial": SPATIAL})
+
+        assert pkg_dict["opensearch_spatial_type"] == "Polygon"
+        assert pkg_dict["opensearch_georss_polygon"] == "1 2 3 2 3 4 1 4 1 2"
+        assert pkg_dict["opensearch_georss_box"] == "2 1 4 3"
+        assert not [key for key in pkg_dict if key.startswith("extras_georss")]
+        for field in GEORSS_INDEX_FIELDS:
+            assert field in get_projection_fields()
+
+    @helpers.change_config("ckanext.opensearch.index_georss", "true")
+    def test_without_footprint(self):
+        """Check if datasets without a footprint are indexed unchanged."""
+        assert OpensearchPlugin().before_index({"id": "a"}) == {"id": "a"}
+
+    def test_projected_results(self):
+        """Check if the stored values are used without their prefix."""
+        results_dict = projected_results_dict(
+            {
+                "count": 1,
+                "results": [
+                    {
+                        "id": "a",
+                        "spatial": SPATIAL,
+                        "opensearch_spatial_type": "Polygon",
+                        "opensearch_georss_polygon": "stored polygon",
+                        "opensearch_georss_box": "stored box",
+                    }
+                ],
+            }
+        )
+        entry = results_dict["results"][0]
+
+        assert entry["georss_polygon"] == "stored polygon"
+        assert entry["georss_box"] == "stored box"
+        assert "opensearch_georss_box" not in entry
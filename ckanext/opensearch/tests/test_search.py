@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""Tests for the execution of searches."""
+
+from collections import OrderedDict
+
+import ckan.tests.helpers as helpers
+
+from ckanext.opensearch import converters
+from ckanext.opensearch.search import (
+    NO_CACHE,
+    add_filters,
+    make_cursor_filter,
+    translate_os_query,
+)
+from ckanext.opensearch.tests.common import (
+    APP,
+    RECORD_COLLECTION_ID,
+    RECORD_ID,
+    get_xml,
+)
+
+ATOM = "{http://www.w3.org/2005/Atom}"
+DC = "{http://purl.org/dc/elements/1.1/}"
+GEORSS = "{http://www.georss.org/georss}"
+
+
+def get_entries(request_url):
+    """Return the comparable contents of the entries of a results feed."""
+    feed = get_xml(request_url)
+    entries = []
+    for entry in feed.findall(ATOM + "entry"):
+        entries.append(
+            {
+                "title": entry.findtext(ATOM + "title"),
+                "identifier": entry.findtext(DC + "identifier"),
+                "publisher": entry.findtext(DC + "publisher"),
+                "date": entry.findtext(DC + "date"),
+                "polygon": entry.findtext(GEORSS + "polygon"),
+                "box": entry.findtext(GEORSS + "box"),
+                "categories": sorted(
+                    category.get("term")
+                    for category in entry.findall(ATOM + "category")
+                ),
+                "links": sorted(
+                    (link.get("rel"), link.get("href"))
+                    for link in entry.findall(ATOM + "link")
+                ),
+            }
+        )
+
+    return entries
+
+
+class TestProjection(object):
+    """Class for searches that only fetch the index fields used by the feeds."""
+
+    def test_same_entries(self):
+        """Check if projected searches render the same entries."""
+        url = "/opensearch/search.atom?rows=10"
+        entries = get_entries(url)
+        with helpers.changed_config("ckanext.opensearch.projection", "true"):
+            projected = get_entries(url)
+
+        assert entries
+        assert projected == entries
+
+
+class TestCursorPaging(object):
+    """Class for deep paging with cursors."""
+
+    def test_follow_next_link(self):
+        """Check if the next link of a cursor page leads to the following page."""
+        feed = get_xml("/opensearch/search.atom?rows=1&cursor=*")
+        assert len(feed.findall(ATOM + "entry")) == 1
+        next_link = feed.find(ATOM + "link[@rel='next']")
+        assert next_link is not None
+        assert feed.find(ATOM + "link[@rel='prev']") is None
+
+        next_url = next_link.get("href")
+        following = get_xml(next_url[next_url.index("/opensearch/"):])
+        assert not following.findall(ATOM + "entry")
+        assert following.find(ATOM + "link[@rel='next']") is None
+
+    def test_invalid_cursor(self):
+        """Check if a cursor that doesn't encode two strings is rejected."""
+        APP.get(url="/opensearch/search.atom?cursor=WzEsIDJd", status=400)
+
+
+class TestSolrEngine(object):
+    """Class for searches that query Solr directly."""
+
+    def test_same_entries(self):
+        """Check if the Solr engine renders the same entries as package_search."""
+        url = "/opensearch/search.atom?rows=10"
+        entries = get_entries(url)
+        with helpers.changed_config("ckanext.opensearch.search_engine", "solr"):
+            direct = get_entries(url)
+
+        assert entries
+        assert direct == entries
+
+    def test_same_collections(self):
+        """Check if the Solr engine finds the same collections."""
+        url = "/opensearch/collection_search.atom?q=*"
+        collections = get_entries(url)
+        with helpers.changed_config("ckanext.opensearch.search_engine", "solr"):
+            direct = get_entries(url)
+
+        assert [entry["title"] for entry in direct] == [
+            entry["title"] for entry in collections
+        ]
+
+    def test_filters(self):
+        """Check if the Solr engine applies the OpenSearch filters."""
+        with helpers.changed_config("ckanext.opensearch.search_engine", "solr"):
+            assert get_entries(
+                "/opensearch/search.atom?productType={}".format(RECORD_COLLECTION_ID)
+            )
+            assert not get_entries(
+                "/opensearch/search.atom?timerange_start=2030-01-01"
+            )
+
+    def test_private_datasets(self):
+        """Check if the Solr engine hides private datasets from anonymous users."""
+        context = {"user": "test_user", "ignore_auth": True}
+        helpers.call_action("package_patch", context, id=RECORD_ID, private=True)
+        try:
+            with helpers.changed_config("ckanext.opensearch.search_engine", "solr"):
+                assert not get_entries("/opensearch/search.atom")
+        finally:
+            helpers.call_action("package_patch", context, id=RECORD_ID, private=False)
+
+
+class TestPackageSearchFilters(object):
+    """Class for the filter queries of searches through package_search."""
+
+    def test_fq_list(self):
+        """Check if package_search applies the filters of fq_list."""
+        context = {"user": "test_user", "ignore_auth": True}
+        found = helpers.call_action(
+            "package_search",
+            dict(context),
+            fq="",
+            fq_list=["collection_id:{}".format(RECORD_COLLECTION_ID)],
+        )
+        missing = helpers.call_action(
+            "package_search", dict(context), fq="", fq_list=["collection_id:MISSING"]
+        )
+
+        assert found["count"] >= 1
+        assert missing["count"] == 0
+
+    def test_filters(self):
+        """Check if the OpenSearch filters narrow the results."""
+        assert get_entries(
+            "/opensearch/search.atom?productType={}".format(RECORD_COLLECTION_ID)
+        )
+        assert not get_entries("/opensearch/search.atom?productType=SENTINEL2_L1C")
+        assert not get_entries("/opensearch/search.atom?timerange_start=2030-01-01")
+
+
+# The parameters of the filter query tests.
+FILTER_PARAMETERS = {
+    "productType": {},
+    "identifier": {"filter_cache": False},
+    "swath": {},
+}
+
+
+class TestFilterQueries(object):
+    """Class for the filter queries sent to Solr."""
+
+    def test_filter_list(self):
+        """Check if each filter parameter is a separate filter query."""
+        param_dict = OrderedDict(
+            [
+                ("q", "sentinel"),
+                ("rows", "10"),
+                ("productType", "SENTINEL1_L1_SLC"),
+                ("identifier", "S1A_IW_SLC"),
+                ("swath", "IW"),
+            ]
+        )
+        filters = add_filters(param_dict, "dataset", FILTER_PARAMETERS)
+
+        assert filters == [
+            "collection_id:SENTINEL1_L1_SLC",
+            "identifier:S1A_IW_SLC",
+            "Swath:IW",
+            "+dataset_type:dataset",
+        ]
+
+    def test_translated_query(self):
+        """Check if the filters are sent as fq_list instead of one fq."""
+        param_dict = OrderedDict([("productType", "SENTINEL1_L1_SLC")])
+        data_dict = translate_os_query(param_dict, "dataset", FILTER_PARAMETERS)
+
+        assert data_dict["fq"] == ""
+        assert data_dict["fq_list"] == [
+            "collection_id:SENTINEL1_L1_SLC",
+            "+dataset_type:dataset",
+        ]
+
+    def test_no_cache_hints_by_default(self):
+        """Check if no filter bypasses the filterCache by default."""
+        param_dict = OrderedDict([("identifier", "S1A_IW_SLC")])
+        filters = add_filters(param_dict, "dataset", FILTER_PARAMETERS)
+
+        assert not [fq for fq in filters if fq.startswith(NO_CACHE)]
+        assert not make_cursor_filter("*")
+
+    @helpers.change_config("ckanext.opensearch.filter_cache_hints", "true")
+    def test_cache_hints(self):
+        """Check if only the marked filters bypass the filterCache."""
+        param_dict = OrderedDict(
+            [("productType", "SENTINEL1_L1_SLC"), ("identifier", "S1A_IW_SLC")]
+        )
+        filters = add_filters(param_dict, "dataset", FILTER_PARAMETERS)
+
+        assert filters == [
+            "collection_id:SENTINEL1_L1_SLC",
+            "{!cache=false}identifier:S1A_IW_SLC",
+            "+dataset_type:dataset",
+        ]
+
+    @helpers.change_config("ckanext.opensearch.filter_cache_hints", "true")
+    def test_cursor_cache_hint(self):
+        """Check if cursor filters bypass the filterCache."""
+        cursor = converters.encode_cursor("2018-03-15T10:31:35.481071", "abc")
+
+        assert make_cursor_filter(cursor) == (
+            "{!cache=false}" + converters.cursor_filter(cursor)
+        )
+
+    @helpers.change_config("ckanext.opensearch.filter_cache_hints", "true")
+    def test_configured_parameters(self):
+        """Check if the default parameters mark the identifier filter."""
+        param_dict = OrderedDict([("identifier", "S1A_IW_SLC")])
+        filters = add_filters(param_dict, "dataset")
+
+        assert "{!cache=false}identifier:S1A_IW_SLC" in filters
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""Tests for the compilation of temporal filters."""
+
+from parameterized import parameterized
+
+import ckan.tests.helpers as helpers
+
+from ckanext.opensearch.temporal import (
+    compile_temporal_filters,
+    make_now,
+    to_solr_datetime,
+)
+
+START = "2017-01-01T00:00:00Z"
+END = "2017-12-31T23:59:59Z"
+
+
+def compile_filters(start=None, end=None, relation=None):
+    """Return the temporal filters of a query with the given values."""
+    param_dict = {}
+    if start:
+        param_dict["timerange_start"] = start
+    if end:
+        param_dict["timerange_end"] = end
+    if relation:
+        param_dict["time_relation"] = relation
+
+    return compile_temporal_filters(param_dict)
+
+
+class TestSolrDatetime(object):
+    """Class for the normalization of datetimes to UTC."""
+
+    @parameterized.expand(
+        [
+            ("2017-02-26", "2017-02-26T00:00:00Z"),
+            ("2017-02-26T10:51:54", "2017-02-26T10:51:54Z"),
+            ("2017-02-26T10:51:54Z", "2017-02-26T10:51:54Z"),
+            ("2017-02-26T10:51:54.123Z", "2017-02-26T10:51:54.123Z"),
+            ("2017-02-26T10:51:54+02:00", "2017-02-26T08:51:54Z"),
+            ("2017-02-26T23:30:00-01:30", "2017-02-27T01:00:00Z"),
+            ("2017-01-01T00:15:00.5+00:30", "2016-12-31T23:45:00.5Z"),
+            ("NOW-1DAY", "NOW-1DAY"),
+        ]
+    )
+    def test_conversion(self, value, expected):
+        """Check if a datetime is converted to UTC in Solr's format."""
+        assert to_solr_datetime(value) == expected
+
+
+class TestMakeNow(object):
+    """Class for the rounding of NOW."""
+
+    @parameterized.expand(
+        [
+            ("HOUR", "NOW/HOUR+1HOUR"),
+            ("DAY", "NOW/DAY+1DAY"),
+            ("", "NOW"),
+            ("WEEK", "NOW"),
+        ]
+    )
+    def test_granularity(self, granularity, expected):
+        """Check if NOW is rounded up to the end of the period."""
+        assert make_now(granularity) == expected
+
+
+class TestTemporalFilters(object):
+    """Class for the filter queries of each time relation."""
+
+    @parameterized.expand(
+        [
+            (
+                "intersects",
+                [
+                    "timerange_start:[* TO 2017-12-31T23:59:59Z]",
+                    "timerange_end:[2017-01-01T00:00:00Z TO *]",
+                ],
+            ),
+            (
+                "during",
+                [
+                    "timerange_start:[2017-01-01T00:00:00Z TO 2017-12-31T23:59:59Z]",
+                    "timerange_end:[2017-01-01T00:00:00Z TO 2017-12-31T23:59:59Z]",
+                ],
+            ),
+            (
+                "contains",
+                [
+                    "timerange_start:[* TO 2017-01-01T00:00:00Z]",
+                    "timerange_end:[2017-12-31T23:59:59Z TO *]",
+                ],
+            ),
+            (
+                "disjoint",
+                [
+                    "(timerange_start:{2017-12-31T23:59:59Z TO *]"
+                    " OR timerange_end:[* TO 2017-01-01T00:00:00Z})"
+                ],
+            ),
+            (
+                "equals",
+                [
+                    'timerange_start:"2017-01-01T00:00:00Z"',
+                    'timerange_end:"2017-12-31T23:59:59Z"',
+                ],
+            ),
+        ]
+    )
+    def test_relation(self, relation, expected):
+        """Check the filters of a relation with both bounds."""
+        assert compile_filters(START, END, relation) == expected
+
+    def test_default_relation(self):
+        """Check if the default relation is during."""
+        assert compile_filters(START, END) == compile_filters(START, END, "during")
+
+    def test_no_bounds(self):
+        """Check if a query without a time range has no temporal filters."""
+        assert compile_filters(relation="intersects") == []
+
+    @helpers.change_config("ckanext.opensearch.temporal_granularity", "HOUR")
+    def test_open_end_during(self):
+        """Check if a range without an end ends at the rounded NOW."""
+        assert compile_filters(start=START) == [
+            "timerange_start:[2017-01-01T00:00:00Z TO NOW/HOUR+1HOUR]"
+        ]
+
+    def test_open_start_during(self):
+        """Check if a range without a start only limits the end."""
+        assert compile_filters(end=END) == [
+            "timerange_end:[* TO 2017-12-31T23:59:59Z]"
+        ]
+
+    @parameterized.expand(
+        [
+            ("intersects", ["timerange_end:[2017-01-01T00:00:00Z TO *]"]),
+            ("contains", ["timerange_start:[* TO 2017-01-01T00:00:00Z]"]),
+            ("disjoint", ["(timerange_end:[* TO 2017-01-01T00:00:00Z})"]),
+            ("equals", ['timerange_start:"2017-01-01T00:00:00Z"']),
+        ]
+    )
+    def test_open_end(self, relation, expected):
+        """Check if only the given bound is filtered on."""
+        assert compile_filters(start=START, relation=relation) == expected
+
+    def test_offset(self):
+        """Check if bounds with an offset are converted to UTC."""
+        filters = compile_filters(
+            "2017-01-01T02:00:00+02:00", "2017-01-01", "intersects"
+        )
+        assert filters == [
+            "timerange_start:[* TO 2017-01-01T00:00:00Z]",
+            "timerange_end:[2017-01-01T00:00:00Z TO *]",
+        ]
+
+    @helpers.change_config("ckanext.opensearch.temporal_start", "StartTime")
+    @helpers.change_config("ckanext.opensearch.temporal_end", "StopTime")
+    def test_configured_fields(self):
+        """Check if the configured index fields are filtered on."""
+        assert compile_filters(START, END, "intersects") == [
+            "StartTime:[* TO 2017-12-31T23:59:59Z]",
+            "StopTime:[2017-01-01T00:00:00Z TO *]",
+        ]
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""Tests for the compiled validation of OpenSearch parameters."""
+
+from nose.tools import assert_raises
+from parameterized import parameterized
+
+from ckanext.opensearch.plugin import OpenSearchError
+from ckanext.opensearch.validators import compile_validator, compile_validators
+
+
+def make_config(**kwargs):
+    """Return the configuration of a parameter with the given settings."""
+    param_config = {"namespace": "os", "os_name": "count"}
+    param_config.update(kwargs)
+
+    return param_config
+
+
+class TestOccurrences(object):
+    """Class for the number of times a parameter may occur in a query."""
+
+    def test_defaults(self):
+        """Check if a parameter is optional and repeatable by default."""
+        validate = compile_validator(make_config())
+        for count in (0, 1, 5):
+            validate("10", count)
+
+    @parameterized.expand([(0,), (3,)])
+    def test_invalid(self, count):
+        """Check if too few or too many occurrences are rejected."""
+        validate = compile_validator(make_config(minimum=1, maximum=2))
+        with assert_raises(OpenSearchError) as context:
+            validate("10", count)
+
+        assert str(context.exception) == (
+            "Minimum 1 and maximum 2 instances of os:count are permitted."
+        )
+
+    @parameterized.expand([(1,), (2,)])
+    def test_valid(self, count):
+        """Check if the number of occurrences within the limits is accepted."""
+        compile_validator(make_config(minimum=1, maximum=2))("10", count)
+
+
+class TestValueLimits(object):
+    """Class for the limits of integer parameters."""
+
+    @parameterized.expand([("0",), ("1",), ("500",)])
+    def test_valid(self, value):
+        """Check if values from the minimum up to the maximum are accepted."""
+        validate = compile_validator(make_config(min_inclusive=0, max_exclusive=501))
+        validate(value, 1)
+
+    @parameterized.expand([("-1",), ("501",), ("ten",), ("1.5",)])
+    def test_invalid(self, value):
+        """Check if values outside the limits or not integers are rejected."""
+        validate = compile_validator(make_config(min_inclusive=0, max_exclusive=501))
+        with assert_raises(OpenSearchError) as context:
+            validate(value, 1)
+
+        assert str(context.exception) == "os:count must be an integer from 0 to 501."
+
+    def test_open_limit(self):
+        """Check if a limit that isn't set isn't checked."""
+        validate = compile_validator(make_config(min_inclusive=1))
+        validate("100000", 1)
+        with assert_raises(OpenSearchError):
+            validate("0", 1)
+
+    def test_no_limits(self):
+        """Check if values of parameters without limits aren't parsed."""
+        compile_validator(make_config())("ten", 1)
+
+
+class TestAdditionalValidators(object):
+    """Class for the validators listed in the parameter configuration."""
+
+    @parameterized.expand(
+        [
+            ("valid_bbox", "-10,-5,10,5", "10,-5,-10,5"),
+            ("valid_geometry", "POINT(1 2)", "POINT(1)"),
+            ("valid_datetime_string", "2018-01-01T00:00:00Z", "01-01-2018"),
+            (
+                "valid_date_range",
+                "[2018-01-01T00:00:00,2018-02-01T00:00:00]",
+                "[2018-01-01,2018-02-01]",
+            ),
+            ("valid_time_relation", "intersects", "overlaps"),
+            ("valid_cursor", "*", "WzEsIDJd"),
+        ]
+    )
+    def test_validator(self, validator, valid_value, invalid_value):
+        """Check if a validator accepts a valid value and rejects an invalid one."""
+        validate = compile_validator(make_config(validators=[validator]))
+        validate(valid_value, 1)
+        with assert_raises(OpenSearchError):
+            validate(invalid_value, 1)
+
+    def test_order(self):
+        """Check if the occurrences are checked before the value."""
+        validate = compile_validator(
+            make_config(maximum=1, validators=["valid_bbox"])
+        )
+        with assert_raises(OpenSearchError) as context:
+            validate("invalid", 2)
+
+        assert "instances" in str(context.exception)
+
+
+class TestCompileValidators(object):
+    """Class for the validators of a set of parameters."""
+
+    def test_compile(self):
+        """Check if each parameter gets its own validator."""
+        validators = compile_validators(
+            {
+                "rows": make_config(min_inclusive=0, max_exclusive=501),
+                "bbox": make_config(os_name="box", validators=["valid_bbox"]),
+            }
+        )
+
+        assert sorted(validators) == ["bbox", "rows"]
+        validators["rows"]("10", 1)
+        with assert_raises(OpenSearchError):
+            validators["bbox"]("10", 1)
@@ -2,9 +2,10 @@
 """Tests for XML documents."""
 from __future__ import print_function
 
-import json
-import pathlib
 from io import BytesIO
+import subprocess
+import sys
+import zlib
 
 from lxml import etree
 from parameterized import parameterized
@@ -12,10 +13,8 @@ import toml
 
 import ckan.tests.helpers as helpers
 
-
-HERE = pathlib.Path(__file__).parent
-
-APP = helpers._get_test_app()
+from ckanext.opensearch import caching
+from ckanext.opensearch.tests.common import APP, HERE, RECORD_ID, get_xml
 
 
 def get_relaxng(rng):
@@ -48,18 +47,6 @@ def validate_against_rng(xml, rng):
     return result
 
 
-def get_xml(request_url):
-    """
-    Return a parsed description document or Atom feed.
-
-    request_url is relative, i.e.: /opensearch/search.atom
-    """
-    result = APP.get(url=request_url)
-    xml = BytesIO(result.body.encode("utf-8"))
-
-    return etree.parse(xml)
-
-
 def get_collection_ids():
     """Return a list of collection IDs from the config."""
     filepath = str(HERE.parent / "defaults" / "collections_list.toml")
@@ -68,27 +55,6 @@ def get_collection_ids():
         return [_id for _id, details in collection_params_list.items()]
 
 
-def setup_db():
-    """Reset the test database and add some test datasets."""
-    helpers.reset_db()
-    context = {}
-    context.setdefault("user", "test_user")
-    context.setdefault("ignore_auth", True)
-    with open(str(HERE / "json" / "test_user.json"), "r") as f:
-        params = json.load(f)
-        params["email"] = "test@example.com"
-        params["password"] = "testpassword"
-    helpers.call_action("user_create", context, **params)
-    with open(str(HERE / "json" / "test_org.json"), "r") as f:
-        params = json.load(f)
-    helpers.call_action("organization_create", context, **params)
-    with open(str(HERE / "json" / "test_record.json"), "r") as f:
-        params = json.load(f)
-    helpers.call_action("package_create", context, **params)
-
-
-setup_db()
-
 collection_ids = get_collection_ids()
 collection_ids.extend(["collection", "dataset"])
 
@@ -166,6 +132,204 @@ class TestDescriptionDocuments(object):
         assert validate_against_rng(osdd, "tests/result-timerelations.rng")
 
 
+class TestLazySettings(object):
+    """Class for the cost of importing the extension."""
+
+    def test_import_is_lazy(self):
+        """Check if importing the plugin doesn't load the settings."""
+        script = "\n".join(
+            [
+                "import ckanext.opensearch.plugin",
+                "from ckanext.opensearch import config",
+                "assert config._registry is None",
+            ]
+        )
+        subprocess.check_call([sys.executable, "-c", script])
+
+
+class TestDescriptionDocumentCaching(object):
+    """Class for conditional requests for description documents."""
+
+    def test_etag_is_stable(self):
+        """Check if the same document is served with the same ETag."""
+        first = APP.get(url="/opensearch/description.xml?osdd=dataset")
+        second = APP.get(url="/opensearch/description.xml?osdd=dataset")
+        assert first.headers["ETag"]
+        assert first.headers["ETag"] == second.headers["ETag"]
+        assert first.body == second.body
+
+    def test_not_modified(self):
+        """Check if a matching If-None-Match header returns a 304."""
+        url = "/opensearch/description.xml?osdd=dataset"
+        etag = APP.get(url=url).headers["ETag"]
+        result = APP.get(url=url, headers={"If-None-Match": etag}, status=304)
+        assert not result.body
+
+
+class TestResultsFeedCaching(object):
+    """Class for conditional requests for search results feeds."""
+
+    def test_not_modified(self):
+        """Check if a matching If-None-Match header returns a 304."""
+        url = "/opensearch/search.atom?rows=1"
+        etag = APP.get(url=url).headers["ETag"]
+        assert etag.startswith('W/"')
+        result = APP.get(url=url, headers={"If-None-Match": etag}, status=304)
+        assert not result.body
+
+    def test_modified(self):
+        """Check if an outdated If-None-Match header returns the feed."""
+        url = "/opensearch/search.atom?rows=1"
+        result = APP.get(url=url, headers={"If-None-Match": 'W/"outdated"'})
+        assert result.status_int == 200
+        assert result.body
+
+    def test_changed_dataset(self):
+        """Check if the ETag changes when a dataset on the page is modified."""
+        url = "/opensearch/search.atom?rows=1"
+        etag = APP.get(url=url).headers["ETag"]
+        context = {"user": "test_user", "ignore_auth": True}
+        notes = helpers.call_action("package_show", context, id=RECORD_ID)["notes"]
+        helpers.call_action("package_patch", context, id=RECORD_ID, notes="Changed")
+        try:
+            result = APP.get(url=url, headers={"If-None-Match": etag})
+            assert result.status_int == 200
+            assert result.headers["ETag"] != etag
+        finally:
+            helpers.call_action("package_patch", context, id=RECORD_ID, notes=notes)
+
+    def test_count_only(self):
+        """Check if a search that only returns the total has an ETag."""
+        url = "/opensearch/search.atom?rows=0"
+        etag = APP.get(url=url).headers["ETag"]
+        APP.get(url=url, headers={"If-None-Match": etag}, status=304)
+
+    def test_probe(self):
+        """Check if a current conditional request is answered by the probe."""
+        url = "/opensearch/search.atom?rows=1"
+        etag = APP.get(url=url).headers["ETag"]
+        # The first conditional request gets the probe's ETag...
+        first = APP.get(url=url, headers={"If-None-Match": etag}, status=304)
+        assert "probe;" in first.headers["Server-Timing"]
+        probe_etag = first.headers["ETag"]
+        # ...so the following ones are answered without any search.
+        second = APP.get(url=url, headers={"If-None-Match": probe_etag}, status=304)
+        assert "probe;" in second.headers["Server-Timing"]
+        assert "search;" not in second.headers["Server-Timing"]
+
+    def test_unconditional(self):
+        """Check if a request without validators isn't probed."""
+        result = APP.get(url="/opensearch/search.atom?rows=1")
+        assert "probe;" not in result.headers["Server-Timing"]
+
+    def test_last_modified(self):
+        """Check if a feed has a Last-Modified header for If-Modified-Since."""
+        # Every dataset is on the page, so its newest one is the newest match.
+        url = "/opensearch/search.atom?rows=100"
+        last_modified = APP.get(url=url).headers["Last-Modified"]
+        result = APP.get(
+            url=url, headers={"If-Modified-Since": last_modified}, status=304
+        )
+        assert result.headers["Last-Modified"] == last_modified
+        result = APP.get(
+            url=url, headers={"If-Modified-Since": "Fri, 01 Jan 2010 00:00:00 GMT"}
+        )
+        assert result.status_int == 200
+
+    @helpers.change_config("ckanext.opensearch.conditional_get", "false")
+    def test_disabled(self):
+        """Check if feeds have no ETag if conditional requests are disabled."""
+        result = APP.get(url="/opensearch/search.atom?rows=1")
+        assert "ETag" not in result.headers
+
+    @helpers.change_config("ckanext.opensearch.result_cache_size", "10")
+    def test_cached_page(self):
+        """Check if a cached page is served with its ETag."""
+        url = "/opensearch/search.atom?rows=1&q=etag"
+        previous = caching._result_cache
+        caching._result_cache = None
+        try:
+            first = APP.get(url=url)
+            second = APP.get(url=url)
+            assert second.headers["ETag"] == first.headers["ETag"]
+            assert second.body == first.body
+            headers = {"If-None-Match": first.headers["ETag"]}
+            APP.get(url=url, headers=headers, status=304)
+        finally:
+            caching._result_cache = previous
+
+
+class TestCompression(object):
+    """Class for compressed responses."""
+
+    def test_gzip_description_document(self):
+        """Check if a description document is compressed with gzip."""
+        url = "/opensearch/description.xml?osdd=dataset"
+        plain = APP.get(url=url)
+        result = APP.get(url=url, headers={"Accept-Encoding": "gzip"})
+        assert result.headers["Content-Encoding"] == "gzip"
+        assert result.headers["ETag"] != plain.headers["ETag"]
+        assert zlib.decompress(result.body, 16 + zlib.MAX_WBITS) == plain.body
+
+    def test_gzip_feed(self):
+        """Check if a results feed is compressed with gzip."""
+        url = "/opensearch/search.atom?rows=1"
+        result = APP.get(url=url, headers={"Accept-Encoding": "gzip"})
+        assert result.headers["Content-Encoding"] == "gzip"
+        feed = etree.parse(BytesIO(zlib.decompress(result.body, 16 + zlib.MAX_WBITS)))
+        assert validate_against_rng(feed, "schemas/atom_feed.rng")
+
+
+class TestServerTiming(object):
+    """Class for the timing of requests."""
+
+    def test_server_timing(self):
+        """Check if a feed's Server-Timing header lists the stages."""
+        result = APP.get(url="/opensearch/search.atom?rows=1")
+        server_timing = result.headers["Server-Timing"]
+        assert "validate;dur=" in server_timing
+        assert "search;dur=" in server_timing
+        assert "total;dur=" in server_timing
+
+
+class TestCountOnly(object):
+    """Class for searches that only return the number of results."""
+
+    def test_count_only(self):
+        """Check if count=0 returns the total without any entries."""
+        result = APP.get(url="/opensearch/search.atom?rows=0")
+        feed = etree.parse(BytesIO(result.body))
+        assert validate_against_rng(feed, "schemas/atom_feed.rng")
+        assert not feed.findall("{http://www.w3.org/2005/Atom}entry")
+        items_per_page = "{http://a9.com/-/spec/opensearch/1.1/}itemsPerPage"
+        assert feed.findtext(items_per_page) == "0"
+
+    def test_negative_count(self):
+        """Check if a negative count is still rejected."""
+        APP.get(url="/opensearch/search.atom?rows=-1", status=400)
+
+
+class TestTimeRelations(object):
+    """Class for temporal searches with a time relation."""
+
+    @parameterized(["intersects", "during", "contains", "disjoint", "equals"])
+    def test_relation(self, relation):
+        """Check if each time relation is accepted."""
+        result = APP.get(
+            url="/opensearch/search.atom?rows=1&timerange_start=2017-01-01"
+            "&timerange_end=2017-12-31T23:59:59Z&time_relation={}".format(relation)
+        )
+        assert result.status_int == 200
+
+    def test_invalid_relation(self):
+        """Check if an unknown time relation is rejected."""
+        APP.get(
+            url="/opensearch/search.atom?timerange_start=2017-01-01"
+            "&time_relation=overlaps",
+            status=400,
+        )
+
+
 class TestCollectionResultsFeed(object):
     """Class for collection (step one) search results tests."""
 
@@ -7,39 +7,78 @@ import shapely.wkt
 from shapely.errors import ReadingError, WKTReadingError
 
 from plugin import OpenSearchError
+from converters import decode_cursor
+from .temporal import RELATIONS
 
+DATETIME_PATTERN = re.compile(
+    r"^[0-9]{4}-[0-9]{2}-[0-9]{2}(T[0-9]{2}:[0-9]{2}:[0-9]{2}(\.[0-9]+)?(Z|[\+\-][0-9]{2}:[0-9]{2})?)?$"  # noqa: E501
+)
 
-def valid_occurances(count, min_occurances, max_occurances, display_name):
-    """Validate the number of occurances of the parameter."""
-    try:
-        assert count >= min_occurances
-        if max_occurances != "*":
-            assert count <= max_occurances
-    except AssertionError:
-        raise OpenSearchError(
-            "Minimum {} and maximum {} instances of {} are permitted.".format(
-                min_occurances, max_occurances, display_name
-            )
+DATE_RANGE_PATTERN = re.compile(
+    r"\[[0-9]{4}-[0-9]{2}-[0-9]{2}T[0-9]{2}:[0-9]{2}:[0-9]{2},[0-9]{4}-[0-9]{2}-[0-9]{2}T[0-9]{2}:[0-9]{2}:[0-9]{2}]"  # noqa: E501
+)
+
+
+def compile_validators(parameters):
+    """
+    Compile the validation of each parameter into a single function.
+
+    Returns a dict of functions that take a parameter's value and the number of
+    times that the parameter occurs in the query and raise an OpenSearchError
+    if either is invalid.
+    """
+    return {
+        param_name: compile_validator(param_config)
+        for param_name, param_config in parameters.items()
+    }
+
+
+def compile_validator(param_config):
+    """
+    Compile the validation of a parameter into a single function.
+
+    The limits, the additional validators and the error messages are resolved
+    once, so validating a query only calls the prepared checks.
+    """
+    display_name = "{}:{}".format(param_config["namespace"], param_config["os_name"])
+    min_occurances = param_config.get("minimum", 0)
+    max_occurances = param_config.get("maximum", "*")
+    value_min_inclusive = param_config.get("min_inclusive", None)
+    value_max_exclusive = param_config.get("max_exclusive", None)
+    additional_validators = [
+        globals()[validator] for validator in param_config.get("validators", [])
+    ]
+
+    occurances_error = (
+        "Minimum {} and maximum {} instances of {} are permitted.".format(
+            min_occurances, max_occurances, display_name
         )
+    )
+    value_error = "{} must be an integer from {} to {}.".format(
+        display_name, value_min_inclusive, value_max_exclusive
+    )
+    check_value = value_min_inclusive is not None or value_max_exclusive is not None
 
+    def validate(param_value, count):
+        if count < min_occurances or (
+            max_occurances != "*" and count > max_occurances
+        ):
+            raise OpenSearchError(occurances_error)
 
-def valid_value_min_max(
-    param_value, value_min_inclusive, value_max_exclusive, display_name
-):
-    """Validate the value of the parameter against a min and max value."""
-    if value_min_inclusive or value_max_exclusive:
-        try:
-            value = int(param_value)
-            if value_min_inclusive:
-                assert value_min_inclusive <= value
-            if value_max_exclusive:
-                assert value < value_max_exclusive
-        except (ValueError, AssertionError):
-            raise OpenSearchError(
-                "{} must be an integer from {} to {}.".format(
-                    display_name, value_min_inclusive, value_max_exclusive
-                )
-            )
+        if check_value:
+            try:
+                value = int(param_value)
+            except ValueError:
+                raise OpenSearchError(value_error)
+            if value_min_inclusive is not None and value < value_min_inclusive:
+                raise OpenSearchError(value_error)
+            if value_max_exclusive is not None and value >= value_max_exclusive:
+                raise OpenSearchError(value_error)
+
+        for validator in additional_validators:
+            validator(param_value, display_name)
+
+    return validate
 
 
 def valid_bbox(bbox, display_name):
@@ -82,10 +121,7 @@ def valid_datetime_string(datetime_string, display_name):
     we can define each pattern once for use by both the OSDD template and the
     related validator.
     """
-    pattern = re.compile(
-        r"^[0-9]{4}-[0-9]{2}-[0-9]{2}(T[0-9]{2}:[0-9]{2}:[0-9]{2}(\.[0-9]+)?(Z|[\+\-][0-9]{2}:[0-9]{2})?)?$"  # noqa: E501
-    )
-    if not pattern.match(datetime_string):
+    if not DATETIME_PATTERN.match(datetime_string):
         raise OpenSearchError(
             "{} must be in the form YYYY-MM-DDTHH:MM:SS".format(display_name)
         )
@@ -93,12 +129,32 @@ def valid_datetime_string(datetime_string, display_name):
 
 def valid_date_range(date_range, display_name):
     """Check if the date range array is well-formed."""
-    pattern = re.compile(
-        r"\[[0-9]{4}-[0-9]{2}-[0-9]{2}T[0-9]{2}:[0-9]{2}:[0-9]{2},[0-9]{4}-[0-9]{2}-[0-9]{2}T[0-9]{2}:[0-9]{2}:[0-9]{2}]"  # noqa: E501
-    )
-    if not pattern.match(date_range):
+    if not DATE_RANGE_PATTERN.match(date_range):
         raise OpenSearchError(
             "{} must be in the form [YYYY-MM-DDTHH:MM:SS,YYYY-MM-DDTHH:MM:SS]".format(
                 display_name
             )
         )
+
+
+def valid_time_relation(relation, display_name):
+    """Check if a time relation is one of the supported relations."""
+    if relation not in RELATIONS:
+        raise OpenSearchError(
+            "{} must be one of {}.".format(display_name, ", ".join(RELATIONS))
+        )
+
+
+def valid_cursor(cursor, display_name):
+    """Check if a cursor is "*" or was returned in a previous page of results."""
+    if cursor == "*":
+        return
+
+    try:
+        decode_cursor(cursor)
+    except ValueError:
+        raise OpenSearchError(
+            "{} must be * or the value from the next link of a previous page.".format(
+                display_name
+            )
+        )
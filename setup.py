@@ -69,6 +69,9 @@ setup(
         [ckan.plugins]
         opensearch=ckanext.opensearch.plugin:OpensearchPlugin
 
+        [paste.paster_command]
+        opensearch=ckanext.opensearch.commands:OpenSearchCommand
+
         [babel.extractors]
         ckan = ckan.lib.extract:extract_ckan
     """,